@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.orm import Session, load_only
 from typing import List, Optional
 from fastapi.responses import StreamingResponse
 import json
+import time
+import hashlib
 import asyncio
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,7 +12,18 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_db
 from app.models import sql_models as models
 from app import schemas
-from app.services import ollama_service
+from app.services import answer_cache, conversation_memory, ollama_service, vector_index, web_search
+from app.services.scheduler import llm_scheduler, Priority, QueueFullError
+from app.services.streaming import cancel_on_disconnect, coalesce_chunks, format_sse
+from app.services.latency import LatencyTracker
+from app.services.persistence import ChatTurnWriter, run_unit_of_work
+from app.services.blob_store import resolve_text
+from app.services.context_resolver import resolve_context_texts
+from app.services.tag_service import set_chat_tags, tag_cache
+from app.services.summarizer import format_summary, load_summaries
+from app.services.deletion import chat_purger, set_chats_archived, soft_delete_chats
+from app import utils_json
+from app.core.config import settings
 from app.utils_log import log_debug
 import logging
 
@@ -28,9 +41,90 @@ def read_chats(
     """
     Retrieve a list of chats with pagination.
     """
-    chats = db.query(models.Chat).order_by(models.Chat.updated_at.desc()).offset(skip).limit(limit).all()
+    chats = db.query(models.Chat).filter(models.Chat.deleted_at.is_(None)).order_by(
+        models.Chat.updated_at.desc()).offset(skip).limit(limit).all()
     return chats
 
+def _parse_cursor(cursor: str):
+    """Cursors are "<iso timestamp>|<id>" pairs used for keyset pagination."""
+    try:
+        timestamp, row_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _encode_chat_cursor(chat: models.Chat) -> str:
+    return f"{chat.updated_at.isoformat()}|{chat.id}"
+
+@router.get("/list", response_model=schemas.ChatListPage)
+def read_chat_list(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    include_archived: bool = True,
+    db: Session = Depends(get_db)
+):
+    """
+    Sidebar chat list: keyset-paginated on (updated_at, id), newest first.
+    Tags and attachment names are loaded in one batched query each (no extracted_text).
+    Supports ETag / If-None-Match (304 when the page is unchanged).
+    """
+    limit = max(1, min(limit, 200))
+    query = db.query(models.Chat).filter(models.Chat.deleted_at.is_(None))
+    if not include_archived:
+        query = query.filter(models.Chat.is_archived == False)
+    if cursor:
+        cursor_updated_at, cursor_id = _parse_cursor(cursor)
+        query = query.filter(
+            (models.Chat.updated_at < cursor_updated_at) |
+            ((models.Chat.updated_at == cursor_updated_at) & (models.Chat.id < cursor_id))
+        )
+    chats = query.order_by(models.Chat.updated_at.desc(), models.Chat.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(chats) > limit:
+        chats = chats[:limit]
+        next_cursor = _encode_chat_cursor(chats[-1])
+
+    chat_ids = [chat.id for chat in chats]
+    tags_by_chat = {chat_id: [] for chat_id in chat_ids}
+    names_by_chat = {chat_id: [] for chat_id in chat_ids}
+    if chat_ids:
+        tag_rows = db.query(models.chat_tags.c.chat_id, models.Tag).join(
+            models.Tag, models.Tag.id == models.chat_tags.c.tag_id
+        ).filter(models.chat_tags.c.chat_id.in_(chat_ids)).all()
+        for chat_id, tag in tag_rows:
+            tags_by_chat[chat_id].append(schemas.Tag.model_validate(tag))
+
+        attachment_rows = db.query(models.Attachment.chat_id, models.Attachment.file_name).filter(
+            models.Attachment.chat_id.in_(chat_ids)
+        ).order_by(models.Attachment.id).all()
+        for chat_id, file_name in attachment_rows:
+            names_by_chat[chat_id].append(file_name)
+
+    page = schemas.ChatListPage(
+        items=[
+            schemas.ChatListItem(
+                id=chat.id,
+                title=chat.title,
+                created_at=chat.created_at,
+                updated_at=chat.updated_at,
+                is_archived=bool(chat.is_archived),
+                tags=tags_by_chat[chat.id],
+                attachment_count=len(names_by_chat[chat.id]),
+                attachment_names=names_by_chat[chat.id]
+            )
+            for chat in chats
+        ],
+        next_cursor=next_cursor
+    )
+
+    body = utils_json.dumps(page.model_dump(mode="json"))
+    etag = f'W/"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
 @router.post("/", response_model=schemas.Chat)
 def create_chat(chat: schemas.ChatCreate, db: Session = Depends(get_db)):
     db_chat = models.Chat(title=chat.title)
@@ -41,38 +135,160 @@ def create_chat(chat: schemas.ChatCreate, db: Session = Depends(get_db)):
 
 @router.get("/{chat_id}", response_model=schemas.ChatWithMessages)
 def read_chat(chat_id: int, db: Session = Depends(get_db)):
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = db.query(models.Chat).filter(models.Chat.id == chat_id, models.Chat.deleted_at.is_(None)).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-    return chat
+    result = schemas.ChatWithMessages.model_validate(chat)
+    resolve_context_texts(ctx for msg in result.messages for ctx in msg.contexts)
+    return result
+
+MESSAGE_OPTIONAL_FIELDS = {"thinking_process", "augmented_content", "latency", "context_text"}
+
+@router.get("/{chat_id}/messages", response_model=schemas.MessagePage)
+def read_chat_messages(
+    chat_id: int,
+    cursor: Optional[str] = None,
+    limit: int = 30,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Paginated message history, newest first (keyset on created_at, id).
+    Heavy fields are only loaded when requested via a comma-separated `fields` list:
+    thinking_process, augmented_content, latency, context_text.
+    Attachments and contexts are loaded in one batched query each.
+    """
+    requested = {f.strip() for f in fields.split(",")} if fields else set()
+    unknown = requested - MESSAGE_OPTIONAL_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    limit = max(1, min(limit, 200))
+
+    if not db.query(models.Chat.id).filter(models.Chat.id == chat_id, models.Chat.deleted_at.is_(None)).first():
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    columns = [models.Message.id, models.Message.chat_id, models.Message.role, models.Message.content,
+               models.Message.model_used, models.Message.created_at]
+    if "thinking_process" in requested:
+        columns.append(models.Message.thinking_process)
+    if "augmented_content" in requested:
+        columns.append(models.Message.augmented_content)
+    if "latency" in requested:
+        columns.append(models.Message.latency_json)
+
+    query = db.query(models.Message).options(load_only(*columns)).filter(models.Message.chat_id == chat_id)
+    if cursor:
+        cursor_created_at, cursor_id = _parse_cursor(cursor)
+        query = query.filter(
+            (models.Message.created_at < cursor_created_at) |
+            ((models.Message.created_at == cursor_created_at) & (models.Message.id < cursor_id))
+        )
+    messages = query.order_by(models.Message.created_at.desc(), models.Message.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = f"{messages[-1].created_at.isoformat()}|{messages[-1].id}"
+
+    message_ids = [m.id for m in messages]
+    attachments_by_msg = {mid: [] for mid in message_ids}
+    contexts_by_msg = {mid: [] for mid in message_ids}
+    thinking_ids = set()
+    if message_ids:
+        # Cheap flag so the UI knows there is something to fetch on demand
+        thinking_ids = {row.id for row in db.query(models.Message.id).filter(
+            models.Message.id.in_(message_ids), models.Message.thinking_process.isnot(None)
+        )}
+
+        attachment_rows = db.query(
+            models.Attachment.id, models.Attachment.message_id, models.Attachment.file_name,
+            models.Attachment.file_type, models.Attachment.file_size, models.Attachment.created_at
+        ).filter(models.Attachment.message_id.in_(message_ids)).all()
+        for row in attachment_rows:
+            attachments_by_msg[row.message_id].append(schemas.AttachmentSummary.model_validate(row))
+
+        context_columns = [models.MessageContext.id, models.MessageContext.message_id, models.MessageContext.document_id,
+                           models.MessageContext.document_name, models.MessageContext.is_active, models.MessageContext.created_at,
+                           models.MessageContext.content_digest, models.MessageContext.chunk_id, models.MessageContext.chunk_index,
+                           models.MessageContext.chunk_index_end, models.MessageContext.score]
+        if "context_text" in requested:
+            context_columns.append(models.MessageContext.content)
+        context_rows = db.query(*context_columns).filter(
+            models.MessageContext.message_id.in_(message_ids)
+        ).order_by(models.MessageContext.id).all()
+        contexts = [schemas.MessageContextSummary(**row._asdict()) for row in context_rows]
+
+        if "context_text" in requested:
+            # Blob-stored snippets and chunk references are resolved in bulk
+            resolve_context_texts(contexts)
+
+        for ctx in contexts:
+            contexts_by_msg[ctx.message_id].append(ctx)
+
+    items = []
+    for m in messages:
+        item = schemas.MessageHistoryItem(
+            id=m.id,
+            chat_id=m.chat_id,
+            role=m.role,
+            content=m.content or "",
+            model_used=m.model_used,
+            created_at=m.created_at,
+            has_thinking=m.id in thinking_ids,
+            thinking_process=m.thinking_process if "thinking_process" in requested else None,
+            augmented_content=m.augmented_content if "augmented_content" in requested else None,
+            latency_json=m.latency_json if "latency" in requested else None,
+            attachments=attachments_by_msg[m.id],
+            contexts=contexts_by_msg[m.id]
+        )
+        items.append(item)
+    return schemas.MessagePage(items=items, next_cursor=next_cursor)
+
+@router.get("/{chat_id}/messages/{message_id}", response_model=schemas.Message)
+def read_chat_message(chat_id: int, message_id: int, db: Session = Depends(get_db)):
+    """
+    Full message including heavy fields (augmented_content, thinking_process, context text).
+    """
+    message = db.query(models.Message).join(models.Chat, models.Chat.id == models.Message.chat_id).filter(
+        models.Message.id == message_id, models.Message.chat_id == chat_id, models.Chat.deleted_at.is_(None)
+    ).first()
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+    result = schemas.Message.model_validate(message)
+    resolve_context_texts(result.contexts)
+    return result
 
 @router.delete("/{chat_id}")
 def delete_chat(chat_id: int, db: Session = Depends(get_db)):
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
-    if not chat:
+    """
+    Soft-deletes the chat. Messages, attachments, files and vector chunks are
+    reclaimed in the background by the chat purger.
+    """
+    if not soft_delete_chats(db, [chat_id]):
         raise HTTPException(status_code=404, detail="Chat not found")
-    
-    # Get attachment IDs before deleting the chat (for vector DB cleanup)
-    attachment_ids = [str(att.id) for att in chat.attachments]
-    
-    # Delete from MSSQL (Cascades to Attachments, Messages, Contexts)
-    db.delete(chat)
     db.commit()
-    
-    # Delete from Vector DB (PostgreSQL)
-    if attachment_ids:
-        from app.services import ingestion
-        for doc_id in attachment_ids:
-            try:
-                ingestion.delete_document_chunks(doc_id)
-            except Exception as e:
-                logger.error(f"Error deleting chunks for doc_id {doc_id}: {e}")
-
+    chat_purger.wake()
     return {"ok": True}
 
+@router.post("/bulk", response_model=schemas.BulkChatActionResult)
+def bulk_chat_action(action_in: schemas.BulkChatAction, db: Session = Depends(get_db)):
+    """
+    Deletes (soft, purged in the background), archives or unarchives many chats in one statement.
+    """
+    if action_in.action == "delete":
+        affected = soft_delete_chats(db, action_in.chat_ids)
+    elif action_in.action in ("archive", "unarchive"):
+        affected = set_chats_archived(db, action_in.chat_ids, action_in.action == "archive")
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown action: {action_in.action}")
+    db.commit()
+    if action_in.action == "delete" and affected:
+        chat_purger.wake()
+    return schemas.BulkChatActionResult(action=action_in.action, affected=affected)
+
 @router.patch("/{chat_id}", response_model=schemas.Chat)
 def update_chat(chat_id: int, chat_update: schemas.ChatUpdate, db: Session = Depends(get_db)):
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    chat = db.query(models.Chat).filter(models.Chat.id == chat_id, models.Chat.deleted_at.is_(None)).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
@@ -82,88 +298,150 @@ def update_chat(chat_id: int, chat_update: schemas.ChatUpdate, db: Session = Dep
         chat.is_archived = chat_update.is_archived
         
     if chat_update.tags is not None:
-        # Clear current tags
-        chat.tags = []
-        for tag_name in chat_update.tags:
-            tag_name = tag_name.strip()
-            if not tag_name:
-                continue
-            
-            # Check if tag exists
-            tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-            if not tag:
-                # Create if not exists
-                tag = models.Tag(name=tag_name)
-                db.add(tag)
-                db.commit()
-                db.refresh(tag)
-            
-            if tag not in chat.tags:
-                chat.tags.append(tag)
+        # Resolve/create all tags and replace the association rows set-based
+        set_chat_tags(db, [chat.id], chat_update.tags)
+        db.expire(chat, ["tags"])
         
     db.commit()
+    if chat_update.tags is not None:
+        tag_cache.invalidate()
     db.refresh(chat)
     return chat
 
+def _chunk_location(chunk: dict) -> str:
+    """ " (Section > Subsection, p. 3-4)" for a retrieved chunk/window, or "" if unknown."""
+    parts = []
+    if chunk.get("heading_path"):
+        parts.append(chunk["heading_path"])
+    start, end = chunk.get("page_start"), chunk.get("page_end")
+    if start is not None:
+        parts.append(f"p. {start}" if end in (None, start) else f"p. {start}-{end}")
+    return f" ({', '.join(parts)})" if parts else ""
+
 # --- Streaming Chat Endpoint ---
 
 @router.post("/message")
 async def send_message(
     message_in: schemas.MessageCreate,
-    db: Session = Depends(get_db)
+    request: Request
 ):
     """
     Send a message to a chat. Handles context retrieval (RAG/Web) and streams the LLM response.
+    Requests are admitted through the LLM scheduler; returns 429 when its queue is too deep.
     """
     logger.debug(f"Received message request: {message_in}")
-    # 1. Fetch Chat
-    chat = db.query(models.Chat).filter(models.Chat.id == message_in.chat_id).first()
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
-    
-    # 2. Save User Message
+    # 0. Admission Control (shed load before touching the DB). The admission counts towards
+    # the queue depth during context preparation, until the LLM ticket is queued.
+    try:
+        admission = llm_scheduler.admit()
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    # No user accounts: the client address identifies the "user" for fair queueing
+    user_key = request.client.host if request.client else "anonymous"
+    chat_key = str(message_in.chat_id)
+    model_name = message_in.model_used or "llama3"
+    tracker = LatencyTracker(model_name)
+
+    # 1. Save User Message
     user_msg_content = message_in.content
     
     # NEW: Handle empty content with attachments (Implicit "Summarize/Analyze this")
-    if not user_msg_content.strip() and message_in.attachments:
+    summary_request = not user_msg_content.strip() and bool(message_in.attachments)
+    if summary_request:
         user_msg_content = "Please analyze and summarise the attached document(s)."
     
-    # Handle Attachments (Metadata/Text extraction context)
-    attached_context = ""
     start_time = datetime.utcnow()
-    
-    if message_in.attachments:
-        # Fetch actual attachment records from DB
-        attachments = db.query(models.Attachment).filter(models.Attachment.id.in_(message_in.attachments)).all()
-        for att in attachments:
-            if att.extracted_text:
-               attached_context += f"\n\n--- FILE: {att.file_name} ---\n{att.extracted_text}\n--- END FILE ---\n"
-    
-    user_msg = models.Message(
-        chat_id=message_in.chat_id,
-        role="user",
-        content=message_in.content, # Store original user query in DB
-        model_used=message_in.model_used,
-        created_at=start_time
-    )
-    db.add(user_msg)
-    db.commit()
-    db.refresh(user_msg)
 
-    # Link attachments to the new message AND chat
-    if message_in.attachments:
-         db.query(models.Attachment).filter(models.Attachment.id.in_(message_in.attachments)).update(
-             {"message_id": user_msg.id, "chat_id": message_in.chat_id}, synchronize_session=False
-         )
-         db.commit()
+    def save_user_turn(db: Session):
+        """Checks the chat, saves the user message and links attachments in one transaction."""
+        if not db.query(models.Chat.id).filter(
+            models.Chat.id == message_in.chat_id, models.Chat.deleted_at.is_(None)
+        ).first():
+            return None, ""
 
-    # 3. Stream Generator (Now includes Context Building to prevent Timeout)
-    from app.core.database import SessionLocal
-    
+        # Handle Attachments (Metadata/Text extraction context)
+        attached_context = ""
+        if message_in.attachments:
+            attachments = db.query(
+                models.Attachment.id, models.Attachment.file_name,
+                models.Attachment.extracted_text, models.Attachment.text_digest
+            ).filter(models.Attachment.id.in_(message_in.attachments)).all()
+            # Summary requests use the precomputed summaries instead of the full text (much shorter prefill)
+            summaries = load_summaries(db, [att.id for att in attachments], model_name) if summary_request else {}
+            for att in attachments:
+                if att.id in summaries:
+                    attached_context += format_summary(att.file_name, summaries[att.id])
+                    continue
+                extracted_text = resolve_text(att.extracted_text or None, att.text_digest)
+                if extracted_text:
+                    attached_context += f"\n\n--- FILE: {att.file_name} ---\n{extracted_text}\n--- END FILE ---\n"
+
+        user_msg = models.Message(
+            chat_id=message_in.chat_id,
+            role="user",
+            content=message_in.content, # Store original user query in DB
+            model_used=message_in.model_used,
+            created_at=start_time
+        )
+        db.add(user_msg)
+        db.flush() # Assigns user_msg.id inside the transaction
+
+        # Link attachments to the new message AND chat
+        if message_in.attachments:
+            db.query(models.Attachment).filter(models.Attachment.id.in_(message_in.attachments)).update(
+                {"message_id": user_msg.id, "chat_id": message_in.chat_id}, synchronize_session=False
+            )
+        return user_msg.id, attached_context
+
+    try:
+        with tracker.stage("db_write"):
+            user_msg_id, attached_context = await run_unit_of_work(save_user_turn)
+    except BaseException:
+        admission.release()
+        raise
+    if user_msg_id is None:
+        admission.release()
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    # Remaining writes of this turn are collected and persisted write-behind
+    writer = ChatTurnWriter(message_in.chat_id, user_msg_id)
+
+    # 2. Stream Generator (Now includes Context Building to prevent Timeout)
     async def response_generator():
-        new_db = SessionLocal()
         final_content = user_msg_content # Default fallback
+        full_content = []
+        full_thinking = []
+        completion_suffix = ""
+        cancelled = False
+        cache_probe = None
+        cached_answer = None
         try:
+            # 0. Answer cache (opt-in): a similar question over the same documents is answered directly
+            if not message_in.use_web_search:
+                with tracker.stage("answer_cache"):
+                    cache_probe = await answer_cache.prepare(
+                        message_in.chat_id, user_msg_id, user_msg_content, model_name,
+                        message_in.use_llm_data, message_in.use_documents, message_in.attachments
+                    )
+                    if cache_probe:
+                        cached_answer = await asyncio.to_thread(answer_cache.lookup, cache_probe)
+            if cached_answer:
+                logger.info(f"Answer cache hit ({cached_answer.similarity:.3f}) for chat {message_in.chat_id}")
+                yield format_sse({'type': 'cached', 'cached': True, 'similarity': round(cached_answer.similarity, 4),
+                                  'query': cached_answer.query_text})
+                tracker.mark_first_token()
+                step = max(1, settings.STREAM_COALESCE_MAX_CHARS)
+                if cached_answer.thinking:
+                    full_thinking.append(cached_answer.thinking)
+                    for i in range(0, len(cached_answer.thinking), step):
+                        yield format_sse({'type': 'think', 'chunk': cached_answer.thinking[i:i + step], 'cached': True})
+                full_content.append(cached_answer.answer)
+                for i in range(0, len(cached_answer.answer), step):
+                    yield format_sse({'type': 'content', 'chunk': cached_answer.answer[i:i + step], 'cached': True})
+                completion_suffix = "\n\n✅ Finished (cached answer)"
+                return
+
             # --- CONTEXT PREPARATION INSIDE GENERATOR ---
             
             # A. System Instruction
@@ -174,73 +452,96 @@ async def send_message(
                 system_instruction = "You are a helpfull assistant. Answer using the provided context if any (Files, Documents, Web Search).'\n\n"
             
             # B. Web Search
-            web_context = ""
-            if message_in.use_web_search:
+            async def prepare_web_context() -> str:
+                if not message_in.use_web_search:
+                    return ""
                 try:
                     # logger.debug(f"Started Search Query generation")
-                    search_query = await ollama_service.generate_search_query(message_in.model_used or "llama3", user_msg_content)
+                    with tracker.stage("query_rewrite"):
+                        search_query = await ollama_service.generate_search_query(model_name, user_msg_content, user_key, chat_key)
                     logger.info(f"Generated Search Query: {search_query}")
                     # Yield a status update if frontend supports it, otherwise just log
                     # yield f"data: {json.dumps({'status': 'Searching web...'})}\n\n" 
                     
-                    search_results = await ollama_service.execute_web_search(search_query)
+                    with tracker.stage("web_search"):
+                        results = await web_search.search(search_query)
+                    search_results = web_search.format_results(results)
                     web_context = f"\n\n--- WEB SEARCH RESULTS ({search_query}) ---\n{search_results}\n--- END WEB SEARCH ---\n"
                     
                     # Persist Web Search Context
-                    if search_results and "Error" not in search_results:
+                    if results:
                         # Truncate to avoid SQL error (255 char limit)
                         doc_name = f"Web Search: {search_query}"
                         if len(doc_name) > 250:
                             doc_name = doc_name[:247] + "..."
                             
-                        web_ctx_entry = models.MessageContext(
-                            message_id=user_msg.id,
-                            document_name=doc_name,
-                            content=search_results,
-                            is_active=True
-                        )
-                        new_db.add(web_ctx_entry)
-                        new_db.commit()
+                        writer.add_context(document_name=doc_name, content=search_results)
+                    return web_context
                 except Exception as e:
                     logger.error(f"Web Search Error: {e}")
-                    web_context = f"\n[Web Search Failed: {str(e)}]\n"
+                    return f"\n[Web Search Failed: {str(e)}]\n"
 
             # C. RAG (Documents)
-            rag_context = ""
-            if message_in.use_documents:
-                from app.services import ingestion
+            async def prepare_rag_context() -> str:
+                if not message_in.use_documents:
+                    return ""
                 
                 # Get ALL attachments for this chat
-                chat_attachments = new_db.query(models.Attachment).filter(models.Attachment.chat_id == message_in.chat_id).all()
-                doc_ids = [str(att.id) for att in chat_attachments]
+                doc_ids = await run_unit_of_work(lambda db: [
+                    str(row.id) for row in
+                    db.query(models.Attachment.id).filter(models.Attachment.chat_id == message_in.chat_id)
+                ])
                 
                 chunks = []
                 if doc_ids:
-                    # Note: retrieve_relevant_chunks uses its own VectorSessionLocal, so it's fine
-                    chunks = ingestion.retrieve_relevant_chunks(user_msg_content, doc_ids)
+                    # Note: retrieve_relevant_chunks uses its own VectorSessionLocal, so it's fine.
+                    # Run in a thread so the event loop (and disconnect detection) is not blocked.
+                    timings = {}
+                    chunks = await asyncio.to_thread(vector_index.retrieve_relevant_chunks, user_msg_content, doc_ids, 5, timings)
+                    for stage, seconds in timings.items():
+                        tracker.record(stage, seconds)
                 
                 rag_context_parts = []
                 if chunks:
                     for chunk in chunks:
                         text = chunk.get("text", "")
                         doc_name = chunk.get("meta", {}).get("filename", "Unknown Document")
-                        rag_context_parts.append(f"--- DOCUMENT: {doc_name} ---\n{text}\n")
+                        location = _chunk_location(chunk)
+                        rag_context_parts.append(f"--- DOCUMENT: {doc_name}{location} ---\n{text}\n")
                         
-                        # Persist RAG Context
-                        rag_ctx_entry = models.MessageContext(
-                            message_id=user_msg.id,
-                            document_id=chunk.get("doc_id"),
+                        # Persist RAG Context (reference to the chunk or whole window, or a text snapshot for audit)
+                        writer.add_context(
                             document_name=doc_name,
-                            content=text,
-                            is_active=True
+                            content=text if settings.CONTEXT_STORAGE_MODE == "snapshot" else None,
+                            document_id=chunk.get("doc_id"),
+                            chunk_id=chunk.get("chunk_id"),
+                            score=chunk.get("val_score"),
+                            chunk_index=chunk.get("window_start", chunk.get("chunk_index")),
+                            chunk_index_end=chunk.get("window_end")
                         )
-                        new_db.add(rag_ctx_entry)
-                    new_db.commit()
                 
                 if rag_context_parts:
-                    rag_context = "\n\nRelevant Context from Documents:\n" + "\n".join(rag_context_parts)
+                    return "\n\nRelevant Context from Documents:\n" + "\n".join(rag_context_parts)
+                return ""
+
+            # 3. History (token budget + rolling summary, see conversation_memory)
+            def load_history(db: Session):
+                return conversation_memory.load_history(db, message_in.chat_id, exclude_message_id=user_msg_id)
+
+            # Web search, RAG and history run concurrently; all are cancelled if the client disconnects
+            context_tasks = [
+                asyncio.create_task(prepare_web_context()),
+                asyncio.create_task(prepare_rag_context()),
+                asyncio.create_task(run_unit_of_work(load_history))
+            ]
+            try:
+                web_context, rag_context, history = await asyncio.gather(*context_tasks)
+            finally:
+                for task in context_tasks:
+                    task.cancel()
 
             # D. Construct Final Prompt & Save Augmented Content
+            prompt_build_start = time.perf_counter()
             # REMOVED system_instruction from here. It will be sent as a separate message.
             final_content = user_msg_content
             context_block = f"{attached_context}{rag_context}{web_context}"
@@ -249,47 +550,23 @@ async def send_message(
                 final_content = f"Use the following context to answer.\n\nContext:\n{context_block}\n\nUser Query: {user_msg_content}"
             # Else: just user query. logic for system instruction is handled via role: system
             
-            # Update User Message with Augmented Content
-            # Re-fetch user_msg attached to this session or update by ID
-            user_msg_ref = new_db.query(models.Message).filter(models.Message.id == user_msg.id).first()
-            if user_msg_ref:
-                user_msg_ref.augmented_content = final_content
-                new_db.commit()
-
-            # 4. History (Last Messages)
-            # Fetch last N messages (e.g. 10) for context
-            history = new_db.query(models.Message).filter(
-                models.Message.chat_id == message_in.chat_id,
-                models.Message.id != user_msg.id 
-            ).order_by(models.Message.created_at.desc()).limit(10).all()
-            
-            # Reverse history to be Chronological (Oldest -> Newest)
-            history_chronological = list(reversed(history))
-            
+            # Update User Message with Augmented Content; contexts and prompt go out as one unit of work
+            writer.set_augmented_content(final_content)
+            writer.flush()
+
             ollama_messages = []
             
-            # Add System Message FIRST
-            if system_instruction:
+            # Stable prefix (system + rolling summary + history) so Ollama can reuse its prompt cache;
+            # everything that changes per turn (context, query) goes into the last message
+            system_content = (system_instruction.strip() + history.system_suffix()).strip()
+            if system_content:
                 ollama_messages.append({
                     "role": "system",
-                    "content": system_instruction.strip()
+                    "content": system_content
                 })
             
-            # Add History
-            for msg in history_chronological:
-                role = msg.role
-                content = msg.content
-                # Use augmented_content if available (contains RAG context from previous turns)
-                # However, for history, maybe we want just the clean content? 
-                # Usually standard practice is to send what was actually "said". 
-                # If we send augmented content, we might re-inject old context.
-                # Let's stick to content for now to be safe and avoid context window explosion, 
-                # unless augmented_content is critical for continuity.
-                # Given RAG is per-turn usually, let's use msg.content.
-                ollama_messages.append({
-                    "role": role,
-                    "content": content
-                })
+            # Add History (clean content, not augmented_content, so old context is not re-injected)
+            ollama_messages.extend(history.messages)
             
             # Add Current User Message
             ollama_messages.append({
@@ -302,40 +579,59 @@ async def send_message(
             # for i, m in enumerate(ollama_messages):
             #     logger.info(f"  [{i}] Role: {m['role']}, Content Preview: {m['content'][:50]}...")
             
-            # 5. Stream LLM
-            full_content = []
-            full_thinking = []
-            completion_suffix = ""
-            
+            tracker.record("prompt_build", time.perf_counter() - prompt_build_start)
+
+            # 4. Stream LLM
+            ticket = admission.submit(model_name, ollama_service.OLLAMA_URL, user_key, chat_key, Priority.INTERACTIVE)
             try:
-                async for chunk_data in ollama_service.stream_chat(message_in.model_used or "llama3", ollama_messages):
-                    # chunk_data is {"type": "think"|"content", "content": "..."}
+                # Report queue position while waiting for a slot
+                async for position in ticket.wait():
+                    yield format_sse({'type': 'queue', 'position': position})
+                tracker.record("queue_wait", ticket.wait_seconds)
+
+                # Tokens are coalesced into larger frames (see STREAM_COALESCE_MS)
+                llm_stream = coalesce_chunks(
+                    ollama_service.stream_chat(model_name, ollama_messages),
+                    settings.STREAM_COALESCE_MS,
+                    settings.STREAM_COALESCE_MAX_CHARS
+                )
+                async for chunk_data in llm_stream:
+                    # chunk_data is {"type": "think"|"content"|"stats", "content": "..."}
+                    if chunk_data["type"] == "stats":
+                        tracker.add_ollama_stats(chunk_data["stats"])
+                        continue
+                    tracker.mark_first_token()
                     if chunk_data["type"] == "think":
                         full_thinking.append(chunk_data["content"])
-                        yield f"data: {json.dumps({'type': 'think', 'chunk': chunk_data['content']})}\n\n"
+                        yield format_sse({'type': 'think', 'chunk': chunk_data['content']})
                     else:
                         full_content.append(chunk_data["content"])
                         # detailed type for frontend, fallback compatible if they just check 'chunk'
-                        yield f"data: {json.dumps({'type': 'content', 'chunk': chunk_data['content']})}\n\n"
+                        yield format_sse({'type': 'content', 'chunk': chunk_data['content']})
                 
                 completion_suffix = "\n\n✅ Finished"
 
             except Exception as e:
                 completion_suffix = f"\n\n🛑 Stopped due to Error: {str(e)}"
                 raise e # Re-raise to be caught by outer handler for logging/yielding error
+            finally:
+                ticket.release()
                 
-        except GeneratorExit:
-            # Handle client disconnect (Stop generation)
+        except (GeneratorExit, asyncio.CancelledError):
+            # Handle client disconnect (Stop generation).
+            # Cancellation unwinds through the Ollama stream / web search, closing their HTTP requests.
             completion_suffix = "\n\n🛑 Stopped by User"
-            raise # Propagate GeneratorExit
+            cancelled = True
+            raise # Propagate
             
         except Exception as e:
             logger.error(f"Error in response generator: {e}")
             if not completion_suffix:
                  completion_suffix = f"\n\n🛑 Stopped due to Error: {str(e)}"
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield format_sse({'error': str(e)})
             
         finally:
+            admission.release() # No-op once the ticket was queued
             # Save Assistant Message (Guaranteed execution)
             response_text = "".join(full_content)
             thinking_text = "".join(full_thinking) if full_thinking else None
@@ -344,32 +640,38 @@ async def send_message(
             if not completion_suffix and (response_text or thinking_text):
                  completion_suffix = "\n\n🛑 Stopped by User"
 
+            if cache_probe and not cached_answer and response_text and completion_suffix == "\n\n✅ Finished":
+                answer_cache.schedule_store(cache_probe, response_text, thinking_text)
+
             if response_text or thinking_text:
                 # Append suffix to content
                 response_text += completion_suffix
                 
-                try:
-                    asst_msg = models.Message(
-                        chat_id=message_in.chat_id,
-                        role="assistant",
-                        content=response_text,
-                        thinking_process=thinking_text,
-                        model_used=message_in.model_used
-                    )
-                    new_db.add(asst_msg)
-                    # Update chat updated_at
-                    chat_ref = new_db.query(models.Chat).filter(models.Chat.id == message_in.chat_id).first()
-                    if chat_ref:
-                        chat_ref.updated_at = datetime.utcnow()
-                    
-                    new_db.commit()
-                except Exception as save_err:
-                    logger.error(f"Error saving message: {save_err}")
+                # Write-behind: also bumps the chat's updated_at; never delays the stream
+                writer.set_assistant_message(
+                    content=response_text,
+                    thinking_process=thinking_text,
+                    model_used=message_in.model_used,
+                    latency_json=tracker.to_json(),
+                    routing_reason="answer_cache" if cached_answer else None
+                )
+            try:
+                writer.flush()
+            except Exception as save_err:
+                logger.error(f"Error saving message: {save_err}")
+            tracker.observe()
+            if response_text:
+                # Fold older turns into the rolling summary once the tail grows (background)
+                conversation_memory.schedule_summary_refresh(message_in.chat_id)
 
-            new_db.close()
-            yield "data: [DONE]\n\n"
+            if not cancelled:
+                yield "data: [DONE]\n\n"
 
-    return StreamingResponse(response_generator(), media_type="text/event-stream")
+    # Drive the generator in its own task so a client disconnect cancels it immediately
+    return StreamingResponse(
+        cancel_on_disconnect(request, response_generator(), settings.STREAM_DISCONNECT_POLL_MS),
+        media_type="text/event-stream"
+    )
 
 @router.post("/search_context")
 def search_context_endpoint(
@@ -380,7 +682,6 @@ def search_context_endpoint(
     Search vector DB for context.
     Returns: List of chunks with metadata.
     """
-    from app.services import ingestion
     
     # We need doc_ids associated with this chat. 
     # Logic: Get all attachments for this chat? Or all attachments forever?
@@ -393,5 +694,5 @@ def search_context_endpoint(
         
     doc_ids = [str(att.id) for att in chat_attachments]
     
-    chunks = ingestion.retrieve_relevant_chunks(query_in.content, doc_ids, top_k=10)
+    chunks = vector_index.retrieve_relevant_chunks(query_in.content, doc_ids, top_k=10)
     return chunks
@@ -1,17 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List
 
 from app.core.database import get_db
 from app.models import sql_models as models
 from app import schemas
+from app.services.tag_service import set_chat_tags, tag_cache
 
 router = APIRouter()
 
 @router.get("/", response_model=List[schemas.Tag])
 def read_tags(db: Session = Depends(get_db)):
-    tags = db.query(models.Tag).all()
-    return tags
+    return tag_cache.all(db)
 
 @router.post("/", response_model=schemas.Tag)
 def create_tag(tag: schemas.TagCreate, db: Session = Depends(get_db)):
@@ -23,4 +24,33 @@ def create_tag(tag: schemas.TagCreate, db: Session = Depends(get_db)):
     except Exception:
         db.rollback()
         raise HTTPException(status_code=400, detail="Tag already exists")
+    tag_cache.invalidate()
     return db_tag
+
+@router.post("/bulk", response_model=schemas.BulkTagResult)
+def bulk_update_chat_tags(update: schemas.BulkTagUpdate, db: Session = Depends(get_db)):
+    """
+    Applies tags to many chats at once (mode: replace, add or remove).
+    Missing tags are created; everything happens in a single transaction.
+    Returns 404 if any chat does not exist (or is deleted).
+    """
+    chat_ids = set(update.chat_ids)
+    found = set()
+    id_list = list(chat_ids)
+    for i in range(0, len(id_list), 1000): # Stay below the MSSQL parameter limit
+        found.update(row.id for row in db.query(models.Chat.id).filter(
+            models.Chat.id.in_(id_list[i:i + 1000]), models.Chat.deleted_at.is_(None)))
+    missing = sorted(chat_ids - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Chats not found: {', '.join(map(str, missing))}")
+    try:
+        tags = set_chat_tags(db, update.chat_ids, update.tags, update.mode)
+        db.commit()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        db.rollback() # A chat was purged in the meantime
+        raise HTTPException(status_code=404, detail="Chat not found")
+    tag_cache.invalidate()
+    return schemas.BulkTagResult(chat_count=len(chat_ids),
+                                 tags=[schemas.Tag.model_validate(tag) for tag in tags])
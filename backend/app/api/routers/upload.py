@@ -1,10 +1,19 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from typing import Awaitable, Callable, Optional, Set
+from app.core.database import SessionLocal, get_db
 from app.models import sql_models as models
 from app import schemas
-from app.services import file_service
+from app.services import file_service, vector_index
+from app.services.ingest_queue import IngestJobError, ingest_queue
+from app.services.persistence import run_unit_of_work
+from app.services.blob_store import resolve_text
+from app.services.summarizer import schedule_summary
+from app.services.upload_sessions import InvalidPartError, UploadSessionNotFoundError, upload_sessions
+from app.core.config import settings
 from datetime import datetime
+import asyncio
+import os
 
 import logging
 
@@ -13,6 +22,130 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+_tasks: Set[asyncio.Task] = set()
+
+def _find_existing(db: Session, file_name: str, overwrite: bool) -> Optional[models.Attachment]:
+    # Attachments of soft-deleted chats are about to be purged (with their files and vectors): never reuse them
+    existing_attachment = db.query(models.Attachment).outerjoin(
+        models.Chat, models.Chat.id == models.Attachment.chat_id
+    ).filter(models.Attachment.file_name == file_name, models.Chat.deleted_at.is_(None)).first()
+    if existing_attachment and not overwrite:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"The file '{file_name}' already exists. Enable 'Overwrite File' to update it."
+        )
+    return existing_attachment
+
+def _attachment_response(attachment: models.Attachment) -> schemas.Attachment:
+    """Single-attachment responses include the extracted text, resolved from the blob store."""
+    result = schemas.Attachment.model_validate(attachment)
+    result.extracted_text = resolve_text(attachment.extracted_text or None, attachment.text_digest)
+    return result
+
+async def _attach_saved_file(db: Session, file_name: str, file_type: str, saved: file_service.SavedFile,
+                             existing_attachment: Optional[models.Attachment],
+                             on_committed: Optional[Callable[[], Awaitable[None]]] = None) -> models.Attachment:
+    """
+    Creates (or overwrites) the Attachment for a file already saved to disk, then indexes it:
+    in this process (INGESTION_MODE "inline") or via the ingestion worker queue ("worker").
+    `on_committed` is awaited once the Attachment row is committed, before indexing.
+    """
+    if existing_attachment:
+        # --- OVERWRITE LOGIC ---
+        logger.info(f"Overwriting file {file_name} (ID: {existing_attachment.id})")
+        
+        # 1. Delete from Vector DB
+        doc_id = str(existing_attachment.id)
+        await asyncio.to_thread(vector_index.delete_document_chunks, doc_id)
+        
+        # 2. Delete the old file from disk (unless the new upload landed on the same path)
+        old_path = existing_attachment.file_path
+        if old_path and old_path != saved.file_path and os.path.exists(old_path):
+            try:
+                os.remove(old_path)
+                logger.info(f"Deleted old file: {old_path}")
+            except Exception as e:
+                logger.warning(f"Could not delete old file: {e}")
+        
+        # 3. Update SQL Record
+        db_attachment = existing_attachment
+        db_attachment.file_path = saved.file_path
+        db_attachment.file_size = saved.file_size
+        db_attachment.created_at = datetime.utcnow() # Update timestamp
+        db_attachment.extracted_text = "" # Reset
+        db_attachment.text_digest = None
+        db_attachment.content_hash = None
+        db.query(models.DocumentSummary).filter(
+            models.DocumentSummary.attachment_id == db_attachment.id).delete(synchronize_session=False)
+    else:
+        # --- NEW FILE LOGIC ---
+        db_attachment = models.Attachment(
+            file_name=file_name,
+            file_type=file_type or "application/octet-stream",
+            file_size=saved.file_size,
+            file_path=saved.file_path,
+            extracted_text="" 
+        )
+        db.add(db_attachment)
+    db.commit()
+    db.refresh(db_attachment)
+    if on_committed:
+        await on_committed()
+    
+    if settings.INGESTION_MODE == "worker":
+        await _index_in_worker(db, db_attachment, saved)
+        return db_attachment
+
+    # Process & Index (Docling, OCR and embeddings) in a worker thread, so streams keep flowing
+    await asyncio.to_thread(_index_inline, db_attachment.id, saved)
+    db.refresh(db_attachment)
+
+    # Precompute the map-reduce summary in the background (used by attachment-only messages)
+    schedule_summary(db_attachment.id, db_attachment.content_hash)
+    return db_attachment
+
+def _index_inline(attachment_id: int, saved: file_service.SavedFile):
+    """index_attachment with its own session (the request's session stays on the event loop)."""
+    db = SessionLocal()
+    try:
+        attachment = db.query(models.Attachment).filter(models.Attachment.id == attachment_id).first()
+        if attachment is None:
+            return
+        file_service.index_attachment(db, attachment, saved.file_path, saved.content_hash)
+    finally:
+        db.close()
+
+async def _index_in_worker(db: Session, attachment: models.Attachment, saved: file_service.SavedFile):
+    """
+    Queues the attachment for ingest_worker.py and waits up to INGEST_WAIT_SECONDS.
+    If the worker is still busy after that, the attachment is returned unindexed
+    (its content_hash stays empty until the worker finishes).
+    The summary is built here, in the API process, once the job is done.
+    """
+    job_id = ingest_queue.submit({
+        "attachment_id": attachment.id, "file_path": saved.file_path, "content_hash": saved.content_hash
+    })
+    job = await ingest_queue.wait(job_id, settings.INGEST_WAIT_SECONDS)
+    if job is None:
+        logger.info(f"Attachment {attachment.id} is still being indexed (job {job_id}).")
+        task = asyncio.get_running_loop().create_task(_summarize_when_indexed(attachment.id, job_id))
+        _tasks.add(task) # Keep a reference until done
+        task.add_done_callback(_tasks.discard)
+    elif job["status"] == "failed":
+        raise IngestJobError(f"Ingestion failed: {job.get('error')}")
+    db.refresh(attachment)
+    if job is not None:
+        schedule_summary(attachment.id, attachment.content_hash)
+
+async def _summarize_when_indexed(attachment_id: int, job_id: str):
+    """Schedules the summary of an attachment whose ingestion job outlived the upload request."""
+    job = await ingest_queue.wait(job_id, settings.INGEST_JOB_RETENTION_HOURS * 3600, poll_seconds=5.0)
+    if job is None or job["status"] != "done":
+        return
+    content_hash = await run_unit_of_work(lambda db: db.query(models.Attachment.content_hash).filter(
+        models.Attachment.id == attachment_id).scalar())
+    schedule_summary(attachment_id, content_hash)
+
 @router.post("/", response_model=schemas.Attachment)
 async def upload_file(
     file: UploadFile = File(...),
@@ -22,85 +155,121 @@ async def upload_file(
     """
     Handle file upload, logic for overwriting existing files, and triggering ingestion.
     """
-    import os
     try:
-        # Check for existing file
-        existing_attachment = db.query(models.Attachment).filter(models.Attachment.file_name == file.filename).first()
-
-        if existing_attachment:
-            if not overwrite:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"The file '{file.filename}' already exists. Enable 'Overwrite File' to update it."
-                )
-            
-            # --- OVERWRITE LOGIC ---
-            logger.info(f"Overwriting file {file.filename} (ID: {existing_attachment.id})")
-            
-            # 1. Delete from Vector DB
-            from app.services import ingestion
-            doc_id = str(existing_attachment.id)
-            ingestion.delete_document_chunks(doc_id)
-            
-            # 2. Delete existing file from disk
-            if existing_attachment.file_path and os.path.exists(existing_attachment.file_path):
-                try:
-                    os.remove(existing_attachment.file_path)
-                    logger.info(f"Deleted old file: {existing_attachment.file_path}")
-                except Exception as e:
-                    logger.warning(f"Could not delete old file: {e}")
-            
-            # 3. Save New File (Disk)
-            # This creates a new file, potentially in a new date-folder
-            file_path, file_size = await file_service.save_upload_file(file)
-            
-            # 4. Update SQL Record
-            existing_attachment.file_path = file_path
-            existing_attachment.file_size = file_size
-            existing_attachment.created_at = datetime.utcnow() # Update timestamp
-            existing_attachment.extracted_text = "" # Reset
-            
-            db.commit()
-            db.refresh(existing_attachment)
-            
-            # 5. Process & Re-Index
-            markdown_text = ingestion.process_and_index_document(file_path, doc_id)
-            
-            existing_attachment.extracted_text = markdown_text
-            db.commit()
-            db.refresh(existing_attachment)
-            
-            return existing_attachment
-
-        else:
-            # --- NEW FILE LOGIC ---
-            file_path, file_size = await file_service.save_upload_file(file)
-            
-            # Create Attachment
-            db_attachment = models.Attachment(
-                file_name=file.filename,
-                file_type=file.content_type or "application/octet-stream",
-                file_size=file_size,
-                file_path=file_path,
-                extracted_text="" 
-            )
-            db.add(db_attachment)
-            db.commit()
-            db.refresh(db_attachment)
-            
-            # Process
-            from app.services import ingestion
-            doc_id = str(db_attachment.id)
-            markdown_text = ingestion.process_and_index_document(file_path, doc_id)
-            
-            db_attachment.extracted_text = markdown_text
-            db.commit()
-            db.refresh(db_attachment)
-            
-            return db_attachment
+        # Check for existing file before writing anything
+        existing_attachment = _find_existing(db, file.filename, overwrite)
+        # Save New File (Disk); the old file is only removed once the new one is in place
+        saved = await file_service.save_upload_file(file)
+        attachment = await _attach_saved_file(db, file.filename, file.content_type, saved, existing_attachment)
+        return _attachment_response(attachment)
 
     except HTTPException as he:
         raise he
+    except file_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing upload: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+
+# --- Resumable Uploads ---
+# POST /sessions -> PUT /sessions/{id}/parts/{n} (any order, parallel) -> GET /sessions/{id} -> POST /sessions/{id}/complete
+
+@router.post("/sessions", response_model=schemas.UploadSession)
+def create_upload_session(session_in: schemas.UploadSessionCreate, db: Session = Depends(get_db)):
+    """
+    Starts a resumable upload. The response tells the client the part size and number of parts.
+    """
+    _find_existing(db, session_in.file_name, session_in.overwrite)
+    try:
+        session = upload_sessions.create(session_in.file_name, session_in.file_type, session_in.total_size,
+                                         session_in.part_size, session_in.overwrite)
+    except file_service.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidPartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return schemas.UploadSession(**session)
+
+@router.get("/sessions/{upload_id}", response_model=schemas.UploadSession)
+def read_upload_session(upload_id: str):
+    """Session state including received and missing part numbers (to resume after a failure)."""
+    try:
+        return schemas.UploadSession(**upload_sessions.status(upload_id))
+    except UploadSessionNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+@router.put("/sessions/{upload_id}/parts/{part_number}")
+async def upload_part(upload_id: str, part_number: int, request: Request):
+    """
+    Receives one part as the raw request body. Re-sending a part replaces it.
+    Returns the part's size and SHA-256 so the client can verify it.
+    """
+    try:
+        return await upload_sessions.write_part(upload_id, part_number, request.stream())
+    except UploadSessionNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except InvalidPartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/sessions/{upload_id}/complete", response_model=schemas.Attachment)
+async def complete_upload_session(upload_id: str, db: Session = Depends(get_db)):
+    """
+    Assembles the parts into the upload folder, creates the Attachment and hands it to ingestion.
+    """
+    try:
+        session = upload_sessions.get(upload_id)
+        existing_attachment = _find_existing(db, session["file_name"], session["overwrite"])
+        saved = await asyncio.to_thread(upload_sessions.assemble, upload_id)
+    except UploadSessionNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except InvalidPartError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    async def delete_session():
+        # Only once the Attachment exists; until then the client can retry the completion
+        await asyncio.to_thread(upload_sessions.delete, upload_id)
+
+    try:
+        attachment = await _attach_saved_file(db, session["file_name"], session["file_type"], saved,
+                                              existing_attachment, on_committed=delete_session)
+        return _attachment_response(attachment)
+    except Exception as e:
+        logger.error(f"Error processing upload: {e}", exc_info=True)
+        db.rollback()
+        await asyncio.to_thread(_remove_unreferenced, saved.file_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _remove_unreferenced(file_path: str):
+    """Removes an assembled file that no Attachment row points to (a failed completion)."""
+    db = SessionLocal()
+    try:
+        if db.query(models.Attachment.id).filter(models.Attachment.file_path == file_path).first():
+            return
+    finally:
+        db.close()
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove {file_path}: {e}")
+
+@router.delete("/sessions/{upload_id}")
+def abort_upload_session(upload_id: str):
+    try:
+        upload_sessions.get(upload_id)
+    except UploadSessionNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    upload_sessions.delete(upload_id)
+    return {"ok": True}
+
+@router.get("/{attachment_id}/text")
+def read_attachment_text(attachment_id: int, db: Session = Depends(get_db)):
+    """
+    Extracted text of an attachment, loaded lazily from the blob store.
+    """
+    row = db.query(models.Attachment.extracted_text, models.Attachment.text_digest).filter(
+        models.Attachment.id == attachment_id
+    ).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return {"id": attachment_id, "text": resolve_text(row.extracted_text or None, row.text_digest) or ""}
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from typing import Dict
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Local LLM Chat"
@@ -16,8 +17,133 @@ class Settings(BaseSettings):
     OLLAMA_BASE_URL_LOCAL: str = "http://localhost:11434"
     OLLAMA_WEB_SEARCH_KEY: str = ""
 
+    # LLM Scheduler (admission control in front of Ollama). Limits are totals for the deployment: the
+    # scheduler lives in each process, so each of the API_WORKERS processes enforces a 1/API_WORKERS share.
+    API_WORKERS: int = 1 # Must match `uvicorn --workers N`
+    LLM_MAX_CONCURRENT: int = 4 # Per backend (Ollama URL)
+    LLM_MAX_CONCURRENT_PER_MODEL: int = 2
+    LLM_BACKEND_CONCURRENCY: Dict[str, int] = {} # e.g. {"http://localhost:11434": 1}
+    LLM_MODEL_CONCURRENCY: Dict[str, int] = {} # e.g. {"llama3": 3}
+    LLM_MAX_QUEUE_DEPTH: int = 32 # Beyond this, new chat requests get 429
+    LLM_RETRY_AFTER_SECONDS: int = 5
+
+    # SSE Streaming
+    STREAM_COALESCE_MS: int = 40 # Merge tokens into one frame per window (0 = one frame per token)
+    STREAM_COALESCE_MAX_CHARS: int = 512 # Flush a frame early once it reaches this size
+    STREAM_DISCONNECT_POLL_MS: int = 250 # How often to check whether the client is still connected
+
+    # Debug logging of Ollama request payloads (sampled)
+    LOG_OLLAMA_PAYLOADS: bool = False
+    LOG_OLLAMA_PAYLOAD_SAMPLE_RATE: float = 0.05
+
+    # Retrieval
+    EMBEDDING_MODEL: str = "nomic-embed-text" # Model of the legacy document_chunks.embedding column (768 dims)
+    EMBEDDING_CACHE_SIZE: int = 1024 # LRU entries for query embeddings (0 = disabled)
+    EMBEDDING_SPACE_CACHE_SECONDS: int = 10 # How quickly processes notice an embedding space switch
+    REEMBED_BATCH_SIZE: int = 64
+    REEMBED_MAX_PER_SECOND: float = 20.0 # Throttle of the background re-embedding (0 = unthrottled)
+
     # Uploads
     UPLOAD_DIR: str = "storage/uploads"
+    MAX_UPLOAD_BYTES: int = 2 * 1024 ** 3 # 2 GB per file
+    UPLOAD_CHUNK_BYTES: int = 1024 ** 2 # Read/write granularity of the streaming writer
+    UPLOAD_PART_BYTES: int = 16 * 1024 ** 2 # Default part size of resumable uploads
+    UPLOAD_SESSION_TTL_HOURS: int = 24 # Unfinished resumable uploads are removed after this
+
+    # Content-addressed store for extracted text and context snippets
+    BLOB_STORE_ENABLED: bool = True # False = keep text inline in MSSQL (legacy)
+    BLOB_STORE_DIR: str = "storage/blobs"
+
+    # Ingest-time document summaries (map-reduce over chunk groups)
+    SUMMARIZE_ON_INGEST: bool = True
+    SUMMARY_MODEL: str = "llama3"
+    SUMMARY_CONCURRENCY: int = 4 # Parallel map requests per document
+    SUMMARY_GROUP_CHARS: int = 6000 # Text per map request
+    SUMMARY_MAX_TOKENS: int = 512 # num_predict per summary request
+    SUMMARY_SECTION_TOKENS: int = 1024 # Budget for section summaries injected per file (0 = top-level only)
+
+    # Converted DoclingDocuments (lossless JSON) keyed by content hash + pipeline profile
+    DOCLING_CACHE_ENABLED: bool = True
+    DOCLING_CACHE_DIR: str = "storage/docling_cache"
+
+    # Retrieval: "chunk" returns the matched chunks; "window" (small-to-big) returns each
+    # match with RETRIEVAL_WINDOW neighbouring chunks on each side, merged per document
+    RETRIEVAL_MODE: str = "window"
+    RETRIEVAL_WINDOW: int = 1
+
+    # Conversation memory: history is chosen by token budget; older turns are folded into a
+    # rolling per-chat summary (in the background) once the unsummarized tail exceeds the trigger
+    CHAT_HISTORY_TOKENS: int = 3000
+    CHAT_HISTORY_MAX_MESSAGES: int = 100 # Upper bound on messages loaded per turn
+    CHAT_SUMMARY_ENABLED: bool = True
+    CHAT_SUMMARY_MODEL: str = "" # Empty = SUMMARY_MODEL
+    CHAT_SUMMARY_TRIGGER_TOKENS: int = 2400
+    CHAT_SUMMARY_KEEP_TOKENS: int = 1000 # Most recent turns kept verbatim when folding
+    CHAT_SUMMARY_MESSAGE_TOKENS: int = 1500 # Cap per message in the summarization prompt
+    CHAT_SUMMARY_MAX_TOKENS: int = 400
+
+    # Semantic answer cache (app/services/answer_cache.py): reuse answers to similar questions over
+    # the same document set, model and flags. Needs vector migration 7.
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_MIN_SIMILARITY: float = 0.95 # Cosine similarity of the question embeddings
+    ANSWER_CACHE_TTL_HOURS: int = 72
+    ANSWER_CACHE_FIRST_TURN_ONLY: bool = True # Follow-up turns depend on the conversation
+
+    # Web-search query rewrite: a small model kept loaded (empty = use the chat model).
+    # Prompts of at most QUERY_REWRITE_BYPASS_WORDS keyword-like words skip the LLM call.
+    QUERY_REWRITE_MODEL: str = ""
+    QUERY_REWRITE_KEEP_ALIVE: str = "30m"
+    QUERY_REWRITE_MAX_TOKENS: int = 32
+    QUERY_REWRITE_TIMEOUT_SECONDS: float = 20.0
+    QUERY_REWRITE_CACHE_SIZE: int = 256
+    QUERY_REWRITE_BYPASS_WORDS: int = 6
+
+    # Web search: results are cached per normalized query; with WEB_SEARCH_FETCH_PAGES the top
+    # results' pages are fetched concurrently and their text (capped per page) replaces the snippet
+    WEB_SEARCH_MAX_RESULTS: int = 5
+    WEB_SEARCH_SNIPPET_CHARS: int = 500
+    WEB_SEARCH_CACHE_SECONDS: int = 900
+    WEB_SEARCH_CACHE_SIZE: int = 256
+    WEB_SEARCH_FETCH_PAGES: bool = False
+    WEB_SEARCH_FETCH_TOP: int = 3
+    WEB_SEARCH_FETCH_TIMEOUT_SECONDS: float = 5.0
+    WEB_SEARCH_FETCH_MAX_BYTES: int = 2 * 1024 ** 2
+    WEB_SEARCH_PAGE_TOKENS: int = 800
+    WEB_SEARCH_USER_AGENT: str = "OllamaRag/1.0 (+web search context)"
+
+    # How RAG contexts are recorded per message:
+    # "reference" = chunk id + score only (text resolved from the vector DB on demand),
+    # "snapshot" = copy of the chunk text (audit use)
+    CONTEXT_STORAGE_MODE: str = "reference"
+
+    # Schema migrations (app/core/migrations.py). When False, startup only warns about missing indexes.
+    AUTO_MIGRATE: bool = False
+
+    # Background purge of soft-deleted chats (vectors, files, rows)
+    CHAT_PURGE_INTERVAL_SECONDS: int = 60
+    CHAT_PURGE_BATCH_SIZE: int = 100
+    # Sweep of blob-store / Docling cache files no row references, run by the purger
+    STORAGE_GC_INTERVAL_SECONDS: int = 3600
+    STORAGE_GC_GRACE_SECONDS: int = 3600 # Files written or used this recently are kept (ingestion in flight)
+
+    # Deployment. INGESTION_MODE "inline" indexes uploads in the API process; "worker" queues them for
+    # ingest_worker.py so API workers never load Docling/torch and can be scaled with --workers N
+    # (with API_WORKERS = N).
+    INGESTION_MODE: str = "inline"
+    INGEST_QUEUE_DIR: str = "storage/ingest_queue"
+    INGEST_WAIT_SECONDS: float = 600.0 # How long an upload request waits for its job
+    INGEST_JOB_STALE_SECONDS: int = 300 # Running jobs without a heartbeat this long are requeued
+    INGEST_JOB_RETENTION_HOURS: int = 24
+    # Prometheus endpoint of each ingest worker process (port, port + 1, ... with --processes); 0 = off
+    INGEST_WORKER_METRICS_PORT: int = 0
+    INGEST_WORKER_METRICS_HOST: str = "127.0.0.1"
+    # State shared by all worker processes on this host (backend health, model list/capabilities, locks)
+    SHARED_STATE_DIR: str = "storage/shared_state"
+    OLLAMA_HEALTH_TTL_SECONDS: int = 30
+    MODEL_LIST_TTL_SECONDS: int = 60
+    MODEL_CAPABILITY_TTL_SECONDS: int = 86400
+    TAG_CACHE_TTL_SECONDS: int = 300 # Upper bound on staleness if a process misses a shared invalidation
+    SCHEMA_BOOTSTRAP: bool = True # create_all + schema check at startup (once per startup, under a lock)
 
     class Config:
         env_file = ".env"
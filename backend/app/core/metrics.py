@@ -0,0 +1,264 @@
+"""
+Minimal in-process metrics registry with Prometheus text exposition.
+Kept dependency-free; observations are a lock plus a few additions.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram. Use `.labels(*values).observe(x)` when labelnames are set,
+    otherwise `.observe(x)` directly.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> (bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def labels(self, *labelvalues: str) -> "_HistogramChild":
+        return _HistogramChild(self, tuple(str(v) for v in labelvalues))
+
+    def observe(self, value: float, labelvalues: Tuple[str, ...] = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[labelvalues] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for labelvalues, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _HistogramChild:
+    def __init__(self, parent: Histogram, labelvalues: Tuple[str, ...]):
+        self._parent = parent
+        self._labelvalues = labelvalues
+
+    def observe(self, value: float):
+        self._parent.observe(value, self._labelvalues)
+
+
+class Counter:
+    """Monotonic counter. Use `.labels(*values).inc()` when labelnames are set."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def labels(self, *labelvalues: str) -> "_ValueChild":
+        return _ValueChild(self, tuple(str(v) for v in labelvalues))
+
+    def inc(self, amount: float = 1.0, labelvalues: Tuple[str, ...] = ()):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            snapshot = list(self._values.items())
+        for labelvalues, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down. Alternatively `set_function` registers a callback
+    evaluated at scrape time, returning {labelvalues tuple: value}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Callable[[], Dict[Tuple[str, ...], float]] = None
+
+    def dec(self, amount: float = 1.0, labelvalues: Tuple[str, ...] = ()):
+        self.inc(-amount, labelvalues)
+
+    def set(self, value: float, labelvalues: Tuple[str, ...] = ()):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]):
+        self._function = function
+
+    def collect(self) -> List[str]:
+        if self._function is not None:
+            values = self._function()
+            with self._lock:
+                self._values = dict(values)
+        return super().collect()
+
+
+class _ValueChild:
+    def __init__(self, parent: Counter, labelvalues: Tuple[str, ...]):
+        self._parent = parent
+        self._labelvalues = labelvalues
+
+    def inc(self, amount: float = 1.0):
+        self._parent.inc(amount, self._labelvalues)
+
+    def dec(self, amount: float = 1.0):
+        self._parent.dec(amount, self._labelvalues)
+
+    def set(self, value: float):
+        self._parent.set(value, self._labelvalues)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                lines.append(f"# Error collecting {metric.name}: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+# --- Shared application metrics ---
+
+HTTP_REQUESTS = counter(
+    "http_requests_total", "HTTP requests by route, method and status.", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "HTTP request latency by route (until the response is fully sent).",
+    ("method", "route"))
+ACTIVE_STREAMS = gauge("sse_active_streams", "Chat SSE streams currently open.")
+CACHE_REQUESTS = counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def register_pool_metrics(engines: Dict[str, object]):
+    """
+    Exposes SQLAlchemy QueuePool usage for the given {name: engine} at scrape time.
+    """
+    def collect() -> Dict[Tuple[str, ...], float]:
+        values = {}
+        for name, engine in engines.items():
+            pool = getattr(engine, "pool", None)
+            if pool is None or not hasattr(pool, "checkedout"):
+                continue
+            values[(name, "size")] = pool.size()
+            values[(name, "checked_out")] = pool.checkedout()
+            values[(name, "checked_in")] = pool.checkedin()
+            values[(name, "overflow")] = pool.overflow()
+        return values
+
+    pool_gauge = gauge("db_pool_connections", "SQLAlchemy connection pool usage by engine.", ("engine", "state"))
+    pool_gauge.set_function(collect)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request count and latency per route template
+    (e.g. /api/chats/{chat_id}), so streamed responses are timed until their last byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label to keep cardinality bounded
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.labels(method, route_path, status_holder[0]).inc()
+            HTTP_REQUEST_SECONDS.labels(method, route_path).observe(time.perf_counter() - start)
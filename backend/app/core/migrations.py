@@ -0,0 +1,276 @@
+"""
+Versioned schema migrations for the MSSQL (chat) and PostgreSQL (vector) databases.
+
+Each database has an ordered list of Migrations. Applied versions are recorded
+in a `schema_migrations` table so every step runs once. Steps are written to be
+idempotent (they check the catalog first), so databases created by create_all
+or patched by hand converge to the same state.
+
+Run `python -m app.core.migrations` (or migrate_helpers.py) to apply.
+At startup, verify_schema() only logs missing hot-path indexes unless
+AUTO_MIGRATE is set.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    up: Callable[[Connection], None]
+
+
+# (table, index name, columns) that the hot paths rely on
+MSSQL_INDEXES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("Messages", "IX_Messages_chat_id_created_at", ("chat_id", "created_at")),
+    ("Attachments", "IX_Attachments_chat_id", ("chat_id",)),
+    ("Attachments", "IX_Attachments_message_id", ("message_id",)),
+    ("Attachments", "IX_Attachments_file_name", ("file_name",)),
+    ("MessageContext", "IX_MessageContext_message_id", ("message_id",)),
+    ("Chats", "IX_Chats_updated_at", ("updated_at",)),
+]
+
+# Added after the hot-path set (the column arrives in migration 9)
+CONTENT_HASH_INDEX = ("Attachments", "IX_Attachments_content_hash", ("content_hash",))
+
+VECTOR_INDEXES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("document_chunks", "ix_document_chunks_doc_id", ("doc_id",)),
+]
+
+# Neighbour-window lookups (the column arrives in vector migration 4)
+CHUNK_INDEX_INDEX = ("document_chunks", "ix_document_chunks_doc_id_chunk_index", ("doc_id", "chunk_index"))
+
+
+# --- Helpers ---
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"].lower() == column.lower() for c in inspect(conn).get_columns(table))
+
+
+def _has_index(conn: Connection, table: str, index: str) -> bool:
+    return any((i["name"] or "").lower() == index.lower() for i in inspect(conn).get_indexes(table))
+
+
+def _add_column(table: str, column: str, sql_type: str) -> Callable[[Connection], None]:
+    def up(conn: Connection):
+        if not _has_column(conn, table, column):
+            conn.execute(text(f"ALTER TABLE {table} ADD {column} {sql_type} NULL"))
+    return up
+
+
+def _create_indexes(indexes, if_not_exists: bool = False) -> Callable[[Connection], None]:
+    def up(conn: Connection):
+        for table, name, columns in indexes:
+            if _has_index(conn, table, name):
+                continue
+            clause = "IF NOT EXISTS " if if_not_exists else ""
+            conn.execute(text(f"CREATE INDEX {clause}{name} ON {table} ({', '.join(columns)})"))
+    return up
+
+
+def _create_tables(*table_names: str) -> Callable[[Connection], None]:
+    def up(conn: Connection):
+        from app.core.database import Base
+        import app.models.sql_models  # noqa: F401 (registers the tables)
+        Base.metadata.create_all(conn, tables=[Base.metadata.tables[name] for name in table_names])
+    return up
+
+
+def _enable_pgvector(conn: Connection):
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+
+def _create_embedding_space_tables(conn: Connection):
+    from app.models.vector_models import BaseVector, ChunkEmbedding, EmbeddingSpace
+    BaseVector.metadata.create_all(conn, tables=[EmbeddingSpace.__table__, ChunkEmbedding.__table__])
+
+
+def _create_answer_cache_table(conn: Connection):
+    from app.models.vector_models import AnswerCacheEntry, BaseVector
+    BaseVector.metadata.create_all(conn, tables=[AnswerCacheEntry.__table__])
+
+
+def _add_chunk_structure(conn: Connection):
+    for column, sql_type in (("chunk_index", "INTEGER"), ("page_start", "INTEGER"),
+                             ("page_end", "INTEGER"), ("heading_path", "TEXT")):
+        _add_column("document_chunks", column, sql_type)(conn)
+
+
+def _backfill_chunk_structure(conn: Connection, batch_size: int = 1000):
+    """Fills the structural columns of chunks indexed before they existed (ordinal = insert order)."""
+    import json
+    from app.models.vector_models import chunk_structure
+
+    conn.execute(text(
+        "UPDATE document_chunks AS c SET chunk_index = o.ordinal "
+        "FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY doc_id ORDER BY id) - 1 AS ordinal "
+        "      FROM document_chunks) AS o "
+        "WHERE c.id = o.id AND c.chunk_index IS NULL"
+    ))
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, metadata_json FROM document_chunks "
+            "WHERE id > :last_id AND metadata_json IS NOT NULL AND page_start IS NULL AND heading_path IS NULL "
+            "ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": batch_size}).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            try:
+                page_start, page_end, heading_path = chunk_structure(json.loads(row.metadata_json))
+            except (ValueError, AttributeError, TypeError):
+                continue
+            if page_start is not None or heading_path is not None:
+                updates.append({"id": row.id, "page_start": page_start, "page_end": page_end,
+                                "heading_path": heading_path})
+        if updates:
+            conn.execute(text(
+                "UPDATE document_chunks SET page_start = :page_start, page_end = :page_end, "
+                "heading_path = :heading_path WHERE id = :id"
+            ), updates)
+        last_id = rows[-1].id
+
+
+# --- Migration lists ---
+
+MSSQL_MIGRATIONS: List[Migration] = [
+    Migration(1, "messages_augmented_content", _add_column("Messages", "augmented_content", "NVARCHAR(MAX)")),
+    Migration(2, "messages_latency_json", _add_column("Messages", "latency_json", "NVARCHAR(MAX)")),
+    Migration(3, "attachments_text_digest", _add_column("Attachments", "text_digest", "VARCHAR(64)")),
+    Migration(4, "message_context_content_digest", _add_column("MessageContext", "content_digest", "VARCHAR(64)")),
+    Migration(5, "message_context_chunk_id", _add_column("MessageContext", "chunk_id", "INT")),
+    Migration(6, "message_context_score", _add_column("MessageContext", "score", "FLOAT")),
+    Migration(7, "hot_path_indexes", _create_indexes(MSSQL_INDEXES)),
+    Migration(8, "chats_deleted_at", _add_column("Chats", "deleted_at", "DATETIME")),
+    Migration(9, "attachments_content_hash", _add_column("Attachments", "content_hash", "VARCHAR(64)")),
+    Migration(10, "attachments_content_hash_index", _create_indexes([CONTENT_HASH_INDEX])),
+    Migration(11, "document_summaries", _create_tables("DocumentSummaries")),
+    Migration(12, "chat_summaries", _create_tables("ChatSummaries")),
+    Migration(13, "message_context_chunk_index", _add_column("MessageContext", "chunk_index", "INT")),
+    Migration(14, "message_context_chunk_index_end", _add_column("MessageContext", "chunk_index_end", "INT")),
+]
+
+VECTOR_MIGRATIONS: List[Migration] = [
+    Migration(1, "pgvector_extension", _enable_pgvector),
+    Migration(2, "hot_path_indexes", _create_indexes(VECTOR_INDEXES, if_not_exists=True)),
+    Migration(3, "embedding_spaces", _create_embedding_space_tables),
+    Migration(4, "document_chunks_structure", _add_chunk_structure),
+    Migration(5, "document_chunks_structure_backfill", _backfill_chunk_structure),
+    Migration(6, "document_chunks_chunk_index_index", _create_indexes([CHUNK_INDEX_INDEX], if_not_exists=True)),
+    Migration(7, "answer_cache", _create_answer_cache_table),
+]
+
+
+# --- Runner ---
+
+def _ensure_version_table(conn: Connection):
+    if not inspect(conn).has_table("schema_migrations"):
+        conn.execute(text(
+            "CREATE TABLE schema_migrations ("
+            "version INT NOT NULL PRIMARY KEY, "
+            "name VARCHAR(200) NOT NULL, "
+            "applied_at DATETIME NOT NULL)"
+            if conn.dialect.name == "mssql" else
+            "CREATE TABLE schema_migrations ("
+            "version INT NOT NULL PRIMARY KEY, "
+            "name VARCHAR(200) NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def applied_versions(engine: Engine) -> List[int]:
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return [row[0] for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+
+def migrate(engine: Engine, migrations: List[Migration]) -> List[int]:
+    """Applies pending migrations in order, each in its own transaction. Returns applied versions."""
+    done = set(applied_versions(engine))
+    newly_applied = []
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version in done:
+            continue
+        logger.info(f"Applying migration {migration.version}: {migration.name} ({engine.dialect.name})")
+        with engine.begin() as conn:
+            migration.up(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": migration.version, "n": migration.name, "t": datetime.utcnow()}
+            )
+        newly_applied.append(migration.version)
+    return newly_applied
+
+
+def pending_migrations(engine: Engine, migrations: List[Migration]) -> List[Migration]:
+    """Migrations not recorded in schema_migrations yet, in version order."""
+    done = set(applied_versions(engine))
+    return [m for m in sorted(migrations, key=lambda m: m.version) if m.version not in done]
+
+
+def missing_indexes(engine: Engine, indexes) -> List[str]:
+    """Returns "table.index" for every required index that does not exist (or whose table is missing)."""
+    missing = []
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        for table, name, _ in indexes:
+            if not inspector.has_table(table):
+                missing.append(f"{table}.{name}")
+                continue
+            if not any((i["name"] or "").lower() == name.lower() for i in inspector.get_indexes(table)):
+                missing.append(f"{table}.{name}")
+    return missing
+
+
+def migrate_all():
+    from app.core.database import engine, vector_engine
+    migrate(engine, MSSQL_MIGRATIONS)
+    if vector_engine:
+        migrate(vector_engine, VECTOR_MIGRATIONS)
+
+
+def verify_schema():
+    """
+    Startup check: applies migrations when AUTO_MIGRATE is set, then logs an error if any
+    migration is still unapplied and a warning for any missing hot-path index.
+    Never raises, so a read-only DB user does not block startup.
+    """
+    from app.core.database import engine, vector_engine
+    targets = [("MSSQL", engine, MSSQL_MIGRATIONS, MSSQL_INDEXES + [CONTENT_HASH_INDEX])]
+    if vector_engine:
+        targets.append(("Vector DB", vector_engine, VECTOR_MIGRATIONS, VECTOR_INDEXES + [CHUNK_INDEX_INDEX]))
+
+    for label, target_engine, migrations, indexes in targets:
+        try:
+            if settings.AUTO_MIGRATE:
+                migrate(target_engine, migrations)
+            pending = pending_migrations(target_engine, migrations)
+            if pending:
+                logger.error(f"❌ {label} schema is behind: migrations "
+                             f"{', '.join(f'{m.version} ({m.name})' for m in pending)} are not applied. "
+                             f"Requests using the new columns/tables will fail; "
+                             f"run `python -m app.core.migrations` (or set AUTO_MIGRATE).")
+            missing = missing_indexes(target_engine, indexes)
+            if missing:
+                logger.warning(f"⚠️ {label} is missing indexes: {', '.join(missing)}. "
+                               f"Run `python -m app.core.migrations` to create them.")
+        except Exception as e:
+            logger.error(f"Schema check failed for {label}: {e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate_all()
+    print("Migrations applied.")
@@ -0,0 +1,95 @@
+"""
+Small cross-process state shared by the API workers and ingestion workers on one host.
+
+Values are JSON files under SHARED_STATE_DIR, written atomically, each with the
+time it was stored so readers can apply their own max age. Used for state that
+every worker would otherwise rediscover on its own (which Ollama backend is up,
+the model list, which models lack "think" support).
+
+lock() is an exclusive lock file for one-at-a-time work across processes
+(schema bootstrap, the chat purge).
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str, suffix: str) -> str:
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        return os.path.join(self.root, f"{safe}{suffix}")
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """The stored value, or None if missing, unreadable or older than max_age seconds."""
+        try:
+            with open(self._path(key, ".json"), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if max_age is not None and time.time() - entry.get("stored_at", 0) > max_age:
+            return None
+        return entry.get("value")
+
+    def set(self, key: str, value: Any):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key, ".json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": time.time(), "value": value}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write shared state {key}: {e}")
+
+    @contextmanager
+    def lock(self, name: str, wait: float = 0.0, stale_after: float = 600.0):
+        """
+        Exclusive lock across processes. Yields True if acquired, False if another process
+        holds it (after waiting up to `wait` seconds). Lock files older than stale_after
+        (a crashed holder) are broken.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(name, ".lock")
+        deadline = time.monotonic() + wait
+        acquired = False
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode("ascii"))
+                os.close(fd)
+                acquired = True
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > stale_after:
+                        logger.warning(f"Breaking stale lock {path}")
+                        os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(0.2)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+shared_state = SharedState(settings.SHARED_STATE_DIR)
@@ -1,11 +1,18 @@
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.api.routers import chats, models, tags, upload
 from app.core.database import engine, Base, vector_engine
 from app.models.vector_models import BaseVector
 from app.core.config import settings
-from app.services.ollama_service import check_ollama_connection
+from app.core import metrics
+from app.core.migrations import verify_schema
+from app.core.shared_state import shared_state
+from app.services.ollama_service import monitor_ollama_backend, refresh_ollama_backend, warm_query_rewrite_model
+from app.services.persistence import write_behind
+from app.services.deletion import chat_purger
 import logging
 
 # Configure Logging
@@ -17,20 +24,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create Tables (MS SQL)
-Base.metadata.create_all(bind=engine)
+def bootstrap_schema():
+    """
+    Creates missing tables (MS SQL and Vector DB) and checks the schema.
+    Runs once per startup under a cross-process lock, so several uvicorn workers do not race.
+    """
+    with shared_state.lock("schema_bootstrap", wait=120) as acquired:
+        if not acquired:
+            logger.warning("Another worker is still bootstrapping the schema; skipping.")
+            return
+        # Create Tables (MS SQL)
+        Base.metadata.create_all(bind=engine)
 
-# Create Tables (Vector DB)
-if vector_engine:
-    from sqlalchemy import text
-    try:
-        with vector_engine.connect() as conn:
-            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-            conn.commit()
-    except Exception as e:
-        logger.error(f"Warning: Could not enable vector extension: {e}")
-    
-    BaseVector.metadata.create_all(bind=vector_engine)
+        # Create Tables (Vector DB)
+        if vector_engine:
+            from sqlalchemy import text
+            try:
+                with vector_engine.connect() as conn:
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+                    conn.commit()
+            except Exception as e:
+                logger.error(f"Warning: Could not enable vector extension: {e}")
+            
+            BaseVector.metadata.create_all(bind=vector_engine)
+
+        # Flag missing hot-path indexes (applies pending migrations if AUTO_MIGRATE)
+        verify_schema()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -38,9 +57,20 @@ async def lifespan(app: FastAPI):
     Lifespan context manager for the FastAPI application.
     Handles startup and shutdown events.
     """
-    # Check Ollama Connection on Startup
-    await check_ollama_connection()
+    # Ollama backend: reuse another worker's recent health check, else probe; re-checked periodically
+    await refresh_ollama_backend()
+    health_monitor = asyncio.create_task(monitor_ollama_backend())
+    warmup = asyncio.create_task(warm_query_rewrite_model()) # In the background; not needed to serve
+    if settings.SCHEMA_BOOTSTRAP:
+        await asyncio.to_thread(bootstrap_schema)
+    write_behind.start()
+    chat_purger.start()
     yield
+    health_monitor.cancel()
+    warmup.cancel()
+    chat_purger.stop()
+    # Drain pending chat writes before exiting
+    await asyncio.to_thread(write_behind.stop)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -59,6 +89,10 @@ origins = [
     "*"
 ]
 
+# Metrics (request rate/latency per route, DB pool usage)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.register_pool_metrics({"mssql": engine, "vector": vector_engine} if vector_engine else {"mssql": engine})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -79,3 +113,11 @@ def read_root():
     Root endpoint to verify backend status.
     """
     return {"message": "Local LLM Chat Backend Running"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """
+    Prometheus text exposition of this process's metrics. Under `uvicorn --workers N`
+    each scrape reaches one worker; ingest workers serve their own (see ingest_worker.py).
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Table, BigInteger, Unicode, UnicodeText
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Table, BigInteger, Unicode, UnicodeText, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -12,12 +12,14 @@ chat_tags = Table(
 
 class Chat(Base):
     __tablename__ = 'Chats'
+    __table_args__ = (Index('IX_Chats_updated_at', 'updated_at'),)
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(Unicode(255), default='New Chat')
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_archived = Column(Boolean, default=False)
+    deleted_at = Column(DateTime, nullable=True) # Soft delete; rows are purged in the background
     
     # Relationships
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
@@ -26,6 +28,7 @@ class Chat(Base):
 
 class Message(Base):
     __tablename__ = 'Messages'
+    __table_args__ = (Index('IX_Messages_chat_id_created_at', 'chat_id', 'created_at'),)
     
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey('Chats.id', ondelete='CASCADE'))
@@ -35,6 +38,7 @@ class Message(Base):
     thinking_process = Column(UnicodeText, nullable=True) # Stores model's internal reasoning
     augmented_content = Column(UnicodeText, nullable=True) # Full augmented prompt (System + RAG + User)
     routing_reason = Column(Unicode(500), nullable=True)
+    latency_json = Column(UnicodeText, nullable=True) # JSON latency breakdown (assistant messages)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     chat = relationship("Chat", back_populates="messages")
@@ -52,6 +56,12 @@ class Tag(Base):
 
 class Attachment(Base):
     __tablename__ = 'Attachments'
+    __table_args__ = (
+        Index('IX_Attachments_chat_id', 'chat_id'),
+        Index('IX_Attachments_message_id', 'message_id'),
+        Index('IX_Attachments_file_name', 'file_name'),
+        Index('IX_Attachments_content_hash', 'content_hash'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     message_id = Column(Integer, ForeignKey('Messages.id'), nullable=True)
@@ -61,7 +71,9 @@ class Attachment(Base):
     file_type = Column(Unicode(100))
     file_size = Column(BigInteger)
     file_path = Column(Unicode(500))
-    extracted_text = Column(UnicodeText, nullable=True) # NVARCHAR(MAX)
+    extracted_text = Column(UnicodeText, nullable=True) # NVARCHAR(MAX), legacy inline copy
+    text_digest = Column(String(64), nullable=True) # Blob store key of the extracted text
+    content_hash = Column(String(64), nullable=True) # SHA-256 of the file, set once it is fully indexed
     created_at = Column(DateTime, default=datetime.utcnow)
     
     message = relationship("Message", back_populates="attachments")
@@ -69,13 +81,42 @@ class Attachment(Base):
 
 class MessageContext(Base):
     __tablename__ = 'MessageContext'
+    __table_args__ = (Index('IX_MessageContext_message_id', 'message_id'),)
     
     id = Column(Integer, primary_key=True, index=True)
     message_id = Column(Integer, ForeignKey('Messages.id', ondelete='CASCADE'))
     document_id = Column(Unicode(255), nullable=True)
     document_name = Column(Unicode(255))
-    content = Column(UnicodeText) # Full text content
+    content = Column(UnicodeText) # Full text content (legacy inline copy)
+    content_digest = Column(String(64), nullable=True) # Blob store key of the content
+    chunk_id = Column(Integer, nullable=True) # document_chunks.id in the vector DB (reference mode)
+    chunk_index = Column(Integer, nullable=True) # Chunk ordinal within document_id (stable across re-indexing)
+    chunk_index_end = Column(Integer, nullable=True) # Last ordinal when the context is a window of chunks
+    score = Column(Float, nullable=True) # Retrieval distance (lower is closer)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     message = relationship("Message", back_populates="contexts")
+
+class DocumentSummary(Base):
+    """Precomputed map-reduce summary of an attachment, one per (attachment, model)."""
+    __tablename__ = 'DocumentSummaries'
+    __table_args__ = (Index('UX_DocumentSummaries_attachment_model', 'attachment_id', 'model', unique=True),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    attachment_id = Column(Integer, ForeignKey('Attachments.id', ondelete='CASCADE'), nullable=False)
+    model = Column(Unicode(255), nullable=False)
+    summary = Column(UnicodeText) # Final (top-level) summary
+    sections_json = Column(UnicodeText, nullable=True) # JSON list of section summaries (map step, in document order)
+    chunk_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ChatSummary(Base):
+    """Rolling summary of a chat's older turns (messages up to covered_until_message_id)."""
+    __tablename__ = 'ChatSummaries'
+    
+    chat_id = Column(Integer, ForeignKey('Chats.id', ondelete='CASCADE'), primary_key=True)
+    summary = Column(UnicodeText)
+    covered_until_message_id = Column(Integer, nullable=False)
+    model = Column(Unicode(255), nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,14 +1,87 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import declarative_base
 from pgvector.sqlalchemy import Vector
+from datetime import datetime
+from typing import Optional, Tuple
 
 BaseVector = declarative_base()
 
 class DocumentChunk(BaseVector):
     __tablename__ = 'document_chunks'
+    __table_args__ = (Index('ix_document_chunks_doc_id_chunk_index', 'doc_id', 'chunk_index'),)
 
     id = Column(Integer, primary_key=True, index=True)
     doc_id = Column(String, index=True) # Reference to Attachment ID (e.g., "att_123")
     text = Column(Text)
     embedding = Column(Vector(768)) # nomic-embed-text dimension
     metadata_json = Column(Text, nullable=True) # JSON string for page_no, bbox, etc.
+    # Structure, so neighbouring chunks can be fetched without parsing metadata_json
+    chunk_index = Column(Integer, nullable=True) # Position in the document (0-based)
+    page_start = Column(Integer, nullable=True)
+    page_end = Column(Integer, nullable=True)
+    heading_path = Column(Text, nullable=True) # "Chapter > Section > Subsection"
+
+def chunk_structure(meta: dict) -> Tuple[Optional[int], Optional[int], Optional[str]]:
+    """(page_start, page_end, heading_path) from a Docling chunk's exported metadata."""
+    pages = [
+        prov["page_no"]
+        for item in meta.get("doc_items") or []
+        for prov in item.get("prov") or []
+        if prov.get("page_no") is not None
+    ]
+    headings = meta.get("headings") or []
+    return (min(pages) if pages else None, max(pages) if pages else None,
+            " > ".join(headings) if headings else None)
+
+class EmbeddingSpace(BaseVector):
+    """
+    A versioned embedding space (model + dimensions). The original
+    document_chunks.embedding column is the implicit "legacy" space and is used
+    while no space is active.
+    status: building (being backfilled) -> active (serves queries) -> retired
+    """
+    __tablename__ = 'embedding_spaces'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), unique=True, nullable=False)
+    model = Column(String(200), nullable=False)
+    dimensions = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default='building')
+    created_at = Column(DateTime, default=datetime.utcnow)
+    activated_at = Column(DateTime, nullable=True)
+
+class ChunkEmbedding(BaseVector):
+    """Embedding of a chunk in a non-legacy space (dimensions vary per space)."""
+    __tablename__ = 'chunk_embeddings'
+    __table_args__ = (Index('ix_chunk_embeddings_space_chunk', 'space_id', 'chunk_id'),)
+
+    chunk_id = Column(Integer, ForeignKey('document_chunks.id', ondelete='CASCADE'), primary_key=True)
+    space_id = Column(Integer, ForeignKey('embedding_spaces.id', ondelete='CASCADE'), primary_key=True)
+    embedding = Column(Vector())
+
+class AnswerCacheEntry(BaseVector):
+    """
+    A generated answer, reusable for semantically similar questions over the same document set
+    (fingerprint), model and context flags. doc_ids lists the attachments whose re-indexing or
+    deletion invalidates the entry.
+    """
+    __tablename__ = 'answer_cache'
+    __table_args__ = (
+        Index('ix_answer_cache_lookup', 'fingerprint', 'model', 'flags'),
+        Index('ix_answer_cache_doc_ids', 'doc_ids', postgresql_using='gin'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False) # Hash of the document set (content hashes)
+    model = Column(String(255), nullable=False)
+    flags = Column(String(255), nullable=False)
+    embedding_model = Column(String(200), nullable=False)
+    query_embedding = Column(Vector())
+    query_text = Column(Text)
+    answer = Column(Text)
+    thinking = Column(Text, nullable=True)
+    doc_ids = Column(ARRAY(String), nullable=False, default=list)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, nullable=True)
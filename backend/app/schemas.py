@@ -16,6 +16,15 @@ class Tag(TagBase):
     class Config:
         from_attributes = True
 
+class BulkTagUpdate(BaseModel):
+    chat_ids: List[int]
+    tags: List[str]
+    mode: str = "replace" # replace | add | remove
+
+class BulkTagResult(BaseModel):
+    chat_count: int
+    tags: List[Tag] = []
+
 # --- Attachments ---
 class AttachmentBase(BaseModel):
     file_name: str
@@ -26,20 +35,45 @@ class AttachmentBase(BaseModel):
 class Attachment(AttachmentBase):
     id: int
     created_at: datetime
+    text_digest: Optional[str] = None # Set when the text lives in the blob store (GET /upload/{id}/text)
     
     class Config:
         from_attributes = True
 
+class UploadSessionCreate(BaseModel):
+    file_name: str
+    file_type: Optional[str] = None
+    total_size: int
+    part_size: Optional[int] = None # Defaults to UPLOAD_PART_BYTES
+    overwrite: bool = False
+
+class UploadSession(BaseModel):
+    upload_id: str
+    file_name: str
+    file_type: str
+    total_size: int
+    part_size: int
+    total_parts: int
+    overwrite: bool
+    created_at: datetime
+    received_parts: List[int] = []
+    missing_parts: List[int] = []
+
 # --- Message Context ---
 class MessageContextBase(BaseModel):
     document_name: str
-    content: str
+    content: Optional[str] = None
     is_active: bool = True
 
 class MessageContext(MessageContextBase):
     id: int
     message_id: int
     document_id: Optional[str] = None
+    content_digest: Optional[str] = None
+    chunk_id: Optional[int] = None # Reference to the vector chunk (text resolved on demand)
+    chunk_index: Optional[int] = None # Its ordinal within document_id
+    chunk_index_end: Optional[int] = None # Last ordinal of a window (small-to-big retrieval)
+    score: Optional[float] = None
     created_at: datetime
     
     class Config:
@@ -70,6 +104,7 @@ class Message(MessageBase):
     content: str
     thinking_process: Optional[str] = None
     augmented_content: Optional[str] = None
+    latency_json: Optional[str] = None
     attachments: List[Attachment] = []
     contexts: List[MessageContext] = []
 
@@ -88,6 +123,14 @@ class ChatUpdate(BaseModel):
     is_archived: Optional[bool] = None
     tags: Optional[List[str]] = None
 
+class BulkChatAction(BaseModel):
+    chat_ids: List[int]
+    action: str # delete | archive | unarchive
+
+class BulkChatActionResult(BaseModel):
+    action: str
+    affected: int
+
 class Chat(ChatBase):
     id: int
     created_at: datetime
@@ -102,6 +145,63 @@ class Chat(ChatBase):
 class ChatWithMessages(Chat):
     messages: List[Message] = []
 
+class ChatListItem(ChatBase):
+    """Lightweight sidebar projection: no attachment payloads, only names and a count."""
+    id: int
+    created_at: datetime
+    updated_at: datetime
+    is_archived: bool
+    tags: List[Tag] = []
+    attachment_count: int = 0
+    attachment_names: List[str] = []
+
+class ChatListPage(BaseModel):
+    items: List[ChatListItem] = []
+    next_cursor: Optional[str] = None # Pass back as ?cursor= to fetch the next page
+
+# --- Message History (paginated, heavy fields on demand) ---
+class AttachmentSummary(BaseModel):
+    id: int
+    file_name: str
+    file_type: str
+    file_size: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class MessageContextSummary(BaseModel):
+    id: int
+    message_id: int
+    document_id: Optional[str] = None
+    document_name: str
+    is_active: bool = True
+    created_at: datetime
+    content: Optional[str] = None # Only with fields=context_text
+    content_digest: Optional[str] = None
+    chunk_id: Optional[int] = None
+    chunk_index: Optional[int] = None
+    chunk_index_end: Optional[int] = None
+    score: Optional[float] = None
+
+class MessageHistoryItem(BaseModel):
+    id: int
+    chat_id: int
+    role: str
+    content: str
+    model_used: Optional[str] = None
+    created_at: datetime
+    has_thinking: bool = False
+    thinking_process: Optional[str] = None # Only with fields=thinking_process
+    augmented_content: Optional[str] = None # Only with fields=augmented_content
+    latency_json: Optional[str] = None # Only with fields=latency
+    attachments: List[AttachmentSummary] = []
+    contexts: List[MessageContextSummary] = []
+
+class MessagePage(BaseModel):
+    items: List[MessageHistoryItem] = [] # Newest first
+    next_cursor: Optional[str] = None # Pass back as ?cursor= to fetch older messages
+
 # --- Custom Responses ---
 class ChatStreamResponse(BaseModel):
     chunk: str
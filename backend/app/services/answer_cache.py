@@ -0,0 +1,183 @@
+"""
+Opt-in semantic answer cache (ANSWER_CACHE_ENABLED).
+
+A finished answer is stored with the embedding of its question and keyed by:
+  - the document-set fingerprint (hash of the content hashes of the chat's
+    attachments with use_documents, and always of the files attached to the
+    message itself, whose text goes into the prompt; identical files uploaded
+    to different chats share entries),
+  - the chat model,
+  - the context flags plus the retrieval configuration (active embedding space,
+    retrieval mode) that shaped the answer.
+A later question with the same key whose embedding is at least
+ANSWER_CACHE_MIN_SIMILARITY (cosine) close is answered from the cache, without
+retrieval or generation.
+
+Entries expire after ANSWER_CACHE_TTL_HOURS and are deleted when any document
+in their set is re-indexed or deleted (invalidate_documents). Invalidation runs
+whenever the table exists, even with the cache disabled, so entries stored
+before it was switched off cannot be served stale once it is switched back on. Turns with web
+search are never cached, and by default only the first turn of a chat is
+(ANSWER_CACHE_FIRST_TURN_ONLY), since follow-ups depend on the conversation.
+"""
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from sqlalchemy import delete, text, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import VectorSessionLocal
+from app.core import metrics
+from app.models import sql_models as models
+from app.models.vector_models import AnswerCacheEntry
+from app.services import embedding_spaces
+from app.services.persistence import run_unit_of_work
+import logging
+
+logger = logging.getLogger(__name__)
+
+_tasks: Set[asyncio.Task] = set()
+_table_exists = False # Set once seen; the table appears with vector migration 7
+
+
+@dataclass
+class CacheProbe:
+    fingerprint: str
+    model: str
+    flags: str
+    embedding_model: str
+    embedding: List[float]
+    query_text: str
+    doc_ids: List[str]
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    thinking: Optional[str]
+    query_text: str
+    similarity: float
+
+
+def document_fingerprint(keys: List[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(keys)).encode("utf-8")).hexdigest()
+
+
+def context_flags(use_llm_data: bool, use_documents: bool) -> str:
+    space = embedding_spaces.active_space()
+    window = settings.RETRIEVAL_WINDOW if settings.RETRIEVAL_MODE == "window" else 0
+    return f"llm={int(bool(use_llm_data))};docs={int(bool(use_documents))};space={space.name};window={window}"
+
+
+async def prepare(chat_id: int, user_msg_id: int, query: str, model: str,
+                  use_llm_data: bool, use_documents: bool,
+                  message_attachment_ids: Optional[List[int]] = None) -> Optional[CacheProbe]:
+    """
+    Builds the cache key for a turn, or returns None when the turn is not cacheable
+    (cache disabled, empty query, or earlier messages in the chat with FIRST_TURN_ONLY).
+    """
+    if not settings.ANSWER_CACHE_ENABLED or not VectorSessionLocal or not query.strip():
+        return None
+
+    def load(db: Session):
+        if settings.ANSWER_CACHE_FIRST_TURN_ONLY and db.query(models.Message.id).filter(
+                models.Message.chat_id == chat_id, models.Message.id != user_msg_id).first():
+            return None
+        return db.query(models.Attachment.id, models.Attachment.content_hash).filter(
+            models.Attachment.chat_id == chat_id).all()
+    attachments = await run_unit_of_work(load)
+    if attachments is None:
+        return None
+
+    from app.services import vector_index  # Imports this module
+    # Both may read the vector DB / shared state: keep them off the event loop
+    space = await asyncio.to_thread(embedding_spaces.active_space)
+    flags = await asyncio.to_thread(context_flags, use_llm_data, use_documents)
+    # Same model + text as the retrieval query, so retrieval reuses this embedding on a miss
+    embedding = await asyncio.to_thread(vector_index.get_query_embedding, query, space.model)
+    attached = set(message_attachment_ids or [])
+    keys = [att.content_hash or f"att:{att.id}" for att in attachments if use_documents or att.id in attached]
+    return CacheProbe(
+        fingerprint=document_fingerprint(keys), model=model,
+        flags=flags, embedding_model=space.model,
+        embedding=embedding, query_text=query, doc_ids=[str(att.id) for att in attachments]
+    )
+
+
+def lookup(probe: CacheProbe) -> Optional[CachedAnswer]:
+    """Closest cached answer for the probe's key if it is similar enough, else None."""
+    vector_db = VectorSessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(hours=settings.ANSWER_CACHE_TTL_HOURS)
+        distance = AnswerCacheEntry.query_embedding.cosine_distance(probe.embedding).label("distance")
+        row = vector_db.query(AnswerCacheEntry.id, AnswerCacheEntry.answer, AnswerCacheEntry.thinking,
+                              AnswerCacheEntry.query_text, distance).filter(
+            AnswerCacheEntry.fingerprint == probe.fingerprint,
+            AnswerCacheEntry.model == probe.model,
+            AnswerCacheEntry.flags == probe.flags,
+            AnswerCacheEntry.embedding_model == probe.embedding_model,
+            AnswerCacheEntry.created_at >= cutoff
+        ).order_by(distance).first()
+
+        hit = row is not None and 1.0 - float(row.distance) >= settings.ANSWER_CACHE_MIN_SIMILARITY
+        metrics.record_cache("answer", hit)
+        if not hit:
+            return None
+        vector_db.execute(update(AnswerCacheEntry).where(AnswerCacheEntry.id == row.id).values(
+            hit_count=AnswerCacheEntry.hit_count + 1, last_hit_at=datetime.utcnow()))
+        vector_db.commit()
+        return CachedAnswer(answer=row.answer, thinking=row.thinking, query_text=row.query_text,
+                            similarity=1.0 - float(row.distance))
+    except Exception as e:
+        vector_db.rollback()
+        logger.error(f"Answer cache lookup failed: {e}")
+        return None
+    finally:
+        vector_db.close()
+
+
+def store(probe: CacheProbe, answer: str, thinking: Optional[str] = None):
+    """Stores an answer (and drops expired entries)."""
+    vector_db = VectorSessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(hours=settings.ANSWER_CACHE_TTL_HOURS)
+        vector_db.execute(delete(AnswerCacheEntry).where(AnswerCacheEntry.created_at < cutoff))
+        vector_db.add(AnswerCacheEntry(
+            fingerprint=probe.fingerprint, model=probe.model, flags=probe.flags,
+            embedding_model=probe.embedding_model, query_embedding=probe.embedding,
+            query_text=probe.query_text, answer=answer, thinking=thinking, doc_ids=probe.doc_ids
+        ))
+        vector_db.commit()
+    except Exception as e:
+        vector_db.rollback()
+        logger.error(f"Answer cache store failed: {e}")
+    finally:
+        vector_db.close()
+
+
+def schedule_store(probe: CacheProbe, answer: str, thinking: Optional[str] = None):
+    """store() in a worker thread, without delaying the response."""
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(store, probe, answer, thinking))
+    _tasks.add(task) # Keep a reference until done
+    task.add_done_callback(_tasks.discard)
+
+
+def invalidate_documents(vector_db: Session, doc_ids: List[str]):
+    """
+    Deletes cached answers that used any of the documents, in the caller's transaction.
+    Called wherever chunks are replaced or deleted, whether or not the cache is enabled.
+    No-op until the answer_cache table exists.
+    """
+    global _table_exists
+    if not doc_ids:
+        return
+    if not _table_exists:
+        # A failing DELETE would abort the caller's transaction, so check first
+        _table_exists = vector_db.execute(text("SELECT to_regclass('answer_cache') IS NOT NULL")).scalar()
+        if not _table_exists:
+            return
+    vector_db.execute(delete(AnswerCacheEntry).where(AnswerCacheEntry.doc_ids.overlap([str(d) for d in doc_ids])))
@@ -0,0 +1,149 @@
+"""
+Content-addressed, compressed text store on local disk.
+
+Texts are keyed by the SHA-256 of their UTF-8 bytes and stored zlib-compressed
+under BLOB_STORE_DIR/<first two hex chars>/<digest>.z, so identical documents
+and context snippets are stored once. SQL rows keep only the digest.
+Reads memory-map the file and keep a small LRU of recently decompressed texts.
+"""
+import hashlib
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from app.core.config import settings
+from app.core import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BlobNotFoundError(Exception):
+    pass
+
+
+class BlobStore:
+    def __init__(self, root: str, compression_level: int = 6, cache_size: int = 256):
+        self.root = root
+        self.compression_level = compression_level
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock() # Directories are created on the first put()
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.z")
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def put(self, text: str) -> str:
+        """Stores text (if not already present) and returns its digest."""
+        digest = self.digest(text)
+        path = self._path(digest)
+        if os.path.exists(path):
+            try:
+                os.utime(path) # A fresh mtime keeps the storage GC off a blob that is about to be referenced
+                return digest
+            except FileNotFoundError:
+                pass # Collected in between: write it again
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(text.encode("utf-8"), self.compression_level)
+        # Write to a unique temp file and rename, so readers never see partial blobs
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> str:
+        with self._lock:
+            cached = self._cache.get(digest)
+            if cached is not None:
+                self._cache.move_to_end(digest)
+        metrics.record_cache("blob", cached is not None)
+        if cached is not None:
+            return cached
+
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    text = zlib.decompress(mm).decode("utf-8")
+        except FileNotFoundError:
+            raise BlobNotFoundError(digest)
+
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[digest] = text
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return text
+
+    def get_many(self, digests: Iterable[str]) -> Dict[str, str]:
+        """Resolves several digests at once (missing blobs are skipped and logged)."""
+        result = {}
+        for digest in set(d for d in digests if d):
+            try:
+                result[digest] = self.get(digest)
+            except BlobNotFoundError:
+                logger.warning(f"Blob not found: {digest}")
+        return result
+
+    def delete(self, digest: str, older_than: Optional[float] = None) -> bool:
+        """
+        Removes a blob. Callers must make sure no row references it anymore. With
+        older_than (a timestamp), blobs written or re-put since then are kept.
+        Returns whether the blob was removed.
+        """
+        path = self._path(digest)
+        try:
+            if older_than is not None and os.path.getmtime(path) >= older_than:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._cache.pop(digest, None)
+        return True
+
+    def iter_digests(self) -> Iterator[Tuple[str, float]]:
+        """Yields (digest, mtime) for every stored blob."""
+        for digest, path in _iter_files(self.root, ".z"):
+            try:
+                yield digest, os.path.getmtime(path)
+            except FileNotFoundError:
+                pass
+
+
+def _iter_files(root: str, suffix: str) -> Iterator[Tuple[str, str]]:
+    """Yields (name without suffix, path) for the files of a <root>/<2 hex>/ layout."""
+    try:
+        shards = [entry for entry in os.scandir(root) if entry.is_dir()]
+    except FileNotFoundError:
+        return
+    for shard in shards:
+        for entry in os.scandir(shard.path):
+            if entry.is_file() and entry.name.endswith(suffix):
+                yield entry.name[:-len(suffix)], entry.path
+
+
+blob_store = BlobStore(settings.BLOB_STORE_DIR)
+
+
+def resolve_text(inline: Optional[str], digest: Optional[str]) -> Optional[str]:
+    """Returns inline text if present, otherwise loads it from the blob store."""
+    if inline is not None or not digest:
+        return inline
+    try:
+        return blob_store.get(digest)
+    except BlobNotFoundError:
+        logger.warning(f"Blob not found: {digest}")
+        return None
@@ -0,0 +1,46 @@
+"""
+Resolves the text of MessageContext entries that are not stored inline.
+
+Contexts may hold their text inline (legacy), as a blob store digest
+(snapshot mode) or only as a reference to a vector chunk (reference mode).
+References are resolved by (document_id, chunk_index[..chunk_index_end]),
+which survives re-indexing and covers whole retrieval windows; older rows
+without an ordinal fall back to the chunk id.
+Texts are loaded in bulk: one blob pass and at most two vector DB queries per call.
+"""
+from typing import Iterable
+
+from app.services.blob_store import blob_store
+
+
+def _position(ctx) -> tuple:
+    end = ctx.chunk_index_end if ctx.chunk_index_end is not None else ctx.chunk_index
+    return ctx.document_id, ctx.chunk_index, end
+
+
+def resolve_context_texts(contexts: Iterable) -> None:
+    """Fills `content` in place on context objects (schemas) that have no inline text."""
+    pending = [ctx for ctx in contexts if ctx.content is None]
+    if not pending:
+        return
+
+    texts = blob_store.get_many(ctx.content_digest for ctx in pending if ctx.content_digest)
+
+    references = [ctx for ctx in pending if not ctx.content_digest]
+    positioned = [ctx for ctx in references if ctx.chunk_index is not None and ctx.document_id]
+    by_id = [ctx for ctx in references if ctx.chunk_index is None and ctx.chunk_id is not None]
+    chunks_by_position, chunks_by_id = {}, {}
+    if positioned or by_id:
+        from app.services import vector_index
+        if positioned:
+            chunks_by_position = vector_index.get_chunks_by_position([_position(ctx) for ctx in positioned])
+        if by_id:
+            chunks_by_id = vector_index.get_chunks_by_ids([ctx.chunk_id for ctx in by_id])
+
+    for ctx in pending:
+        if ctx.content_digest:
+            ctx.content = texts.get(ctx.content_digest)
+        elif ctx.chunk_index is not None and _position(ctx) in chunks_by_position:
+            ctx.content = chunks_by_position[_position(ctx)]["text"]
+        elif ctx.chunk_id is not None and ctx.chunk_id in chunks_by_id:
+            ctx.content = chunks_by_id[ctx.chunk_id]["text"]
@@ -0,0 +1,214 @@
+"""
+Conversation memory for chat turns.
+
+History is selected by token budget (CHAT_HISTORY_TOKENS) rather than a fixed
+message count. Older turns are folded into a rolling per-chat summary
+(ChatSummaries), refreshed in the background after an assistant reply once the
+unsummarized tail grows past CHAT_SUMMARY_TRIGGER_TOKENS.
+
+To let Ollama reuse its prompt cache, the prompt prefix (system message +
+summary + history) only changes when the summary is refreshed: between
+refreshes, history always starts at the first message after the summary and
+grows by appending turns. Only when that tail no longer fits the budget (the
+refresh is lagging) does selection fall back to a sliding window.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core import metrics
+from app.models import sql_models as models
+from app.services import ollama_service
+from app.services.persistence import run_unit_of_work, write_behind
+from app.services.scheduler import Priority, llm_scheduler
+from app.utils_tokens import estimate_tokens, truncate_to_tokens
+import logging
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKENS = metrics.histogram(
+    "chat_history_tokens", "Estimated tokens of history (summary + messages) sent per turn.",
+    buckets=(0, 250, 500, 1000, 2000, 4000, 8000, 16000))
+SUMMARY_REFRESHES = metrics.counter("chat_summary_refreshes_total", "Rolling chat summary refreshes by result.",
+                                    ("result",))
+
+SUMMARY_PROMPT = (
+    "You maintain the running summary of a conversation between a user and an assistant. "
+    "Update the summary with the new messages. Keep facts, decisions, names, numbers and open "
+    "questions; drop pleasantries. Reply with the updated summary only.\n\n"
+    "Current summary:\n{summary}\n\nNew messages:\n{messages}"
+)
+
+_tasks: Set[asyncio.Task] = set()
+_in_progress: Set[int] = set()
+
+
+@dataclass
+class ConversationHistory:
+    summary: Optional[str] = None
+    messages: List[dict] = field(default_factory=list) # {"role", "content"}, oldest first
+
+    def system_suffix(self) -> str:
+        """Text appended to the system message (part of the stable prefix)."""
+        if not self.summary:
+            return ""
+        return f"\n\nSummary of the earlier conversation:\n{self.summary}"
+
+
+def _message_tokens(role: str, content: str) -> int:
+    return estimate_tokens(content or "") + 4 # Role / template overhead
+
+
+def _load_tail(db: Session, chat_id: int, after_id: int, exclude_message_id: Optional[int], limit: int,
+               oldest_first: bool = False):
+    """Messages after `after_id`: the newest `limit` (newest first), or the oldest ones with oldest_first."""
+    query = db.query(models.Message.id, models.Message.role, models.Message.content).filter(
+        models.Message.chat_id == chat_id, models.Message.id > after_id
+    )
+    if exclude_message_id is not None:
+        query = query.filter(models.Message.id != exclude_message_id)
+    if oldest_first:
+        return query.order_by(models.Message.created_at, models.Message.id).limit(limit).all()
+    return query.order_by(models.Message.created_at.desc(), models.Message.id.desc()).limit(limit).all()
+
+
+def load_history(db: Session, chat_id: int, exclude_message_id: Optional[int] = None,
+                 budget_tokens: Optional[int] = None) -> ConversationHistory:
+    """History for the next prompt: rolling summary plus as many recent messages as fit the budget."""
+    write_behind.wait_for(chat_id) # The previous reply may still be queued write-behind
+    budget = budget_tokens or settings.CHAT_HISTORY_TOKENS
+    summary_row = db.query(models.ChatSummary).filter(models.ChatSummary.chat_id == chat_id).first()
+    covered = summary_row.covered_until_message_id if summary_row else 0
+    summary = summary_row.summary if summary_row else None
+
+    budget -= estimate_tokens(summary or "")
+    rows = _load_tail(db, chat_id, covered, exclude_message_id, settings.CHAT_HISTORY_MAX_MESSAGES)
+
+    # Stable case: the whole tail since the summary fits, so the prefix only grows by appending
+    tail_tokens = sum(_message_tokens(row.role, row.content) for row in rows)
+    if tail_tokens <= budget:
+        selected = [{"role": row.role, "content": row.content or ""} for row in rows]
+    else:
+        # Refresh is lagging: newest messages first until the budget is used; the newest
+        # message is always kept (truncated if it alone exceeds the budget)
+        selected = []
+        for row in rows:
+            tokens = _message_tokens(row.role, row.content)
+            if tokens > budget:
+                if not selected:
+                    selected.append({"role": row.role,
+                                     "content": truncate_to_tokens(row.content or "", max(budget, 0))})
+                break
+            selected.append({"role": row.role, "content": row.content or ""})
+            budget -= tokens
+
+    history = ConversationHistory(summary=summary, messages=list(reversed(selected)))
+    HISTORY_TOKENS.observe(estimate_tokens(summary or "") +
+                           sum(_message_tokens(m["role"], m["content"]) for m in history.messages))
+    return history
+
+
+# --- Rolling summary ---
+
+def _fold_split(rows) -> int:
+    """
+    Index (in oldest-first `rows`) up to which messages are folded into the summary,
+    keeping the most recent CHAT_SUMMARY_KEEP_TOKENS verbatim. Never splits a user turn
+    from the assistant reply that follows it.
+    """
+    keep = 0
+    split = len(rows)
+    for i in range(len(rows) - 1, -1, -1):
+        keep += _message_tokens(rows[i].role, rows[i].content)
+        if keep > settings.CHAT_SUMMARY_KEEP_TOKENS:
+            break
+        split = i
+    while 0 < split < len(rows) and rows[split].role != "user":
+        split += 1
+    return split
+
+
+async def refresh_summary(chat_id: int, model: Optional[str] = None) -> bool:
+    """
+    Folds older messages into the chat's rolling summary when the unsummarized tail
+    exceeds CHAT_SUMMARY_TRIGGER_TOKENS. Messages are folded oldest first, at most
+    CHAT_HISTORY_MAX_MESSAGES * 2 per call, so nothing is skipped in a long backlog.
+    Returns True if the summary changed.
+    """
+    model = model or settings.CHAT_SUMMARY_MODEL or settings.SUMMARY_MODEL
+    batch_size = settings.CHAT_HISTORY_MAX_MESSAGES * 2
+
+    def load(db: Session):
+        write_behind.wait_for(chat_id) # Scheduled right after the reply was queued
+        row = db.query(models.ChatSummary).filter(models.ChatSummary.chat_id == chat_id).first()
+        covered = row.covered_until_message_id if row else 0
+        tail = _load_tail(db, chat_id, covered, None, batch_size + 1, oldest_first=True)
+        return (row.summary if row else None), covered, tail
+    summary, covered, tail = await run_unit_of_work(load)
+
+    if len(tail) > batch_size:
+        # Backlog beyond this batch: fold the whole batch, ending before its last user turn
+        # (its reply may be outside the batch)
+        tail = tail[:batch_size]
+        split = max((i for i, row in enumerate(tail) if row.role == "user"), default=0) or len(tail)
+    else:
+        if sum(_message_tokens(row.role, row.content) for row in tail) <= settings.CHAT_SUMMARY_TRIGGER_TOKENS:
+            return False
+        split = _fold_split(tail)
+    if split == 0:
+        return False
+    folded = tail[:split]
+
+    transcript = "\n\n".join(
+        f"{row.role.capitalize()}: {truncate_to_tokens(row.content or '', settings.CHAT_SUMMARY_MESSAGE_TOKENS)}"
+        for row in folded
+    )
+    prompt = SUMMARY_PROMPT.format(summary=summary or "(none yet)", messages=transcript)
+    ticket = llm_scheduler.submit(model, ollama_service.OLLAMA_URL, "chat-memory", f"chat-{chat_id}",
+                                  Priority.BACKGROUND, shed=False)
+    async with ticket:
+        new_summary = (await ollama_service.chat_completion(
+            model, [{"role": "user", "content": prompt}],
+            options={"num_predict": settings.CHAT_SUMMARY_MAX_TOKENS, "temperature": 0.2}
+        )).strip()
+    if not new_summary:
+        SUMMARY_REFRESHES.labels("empty").inc()
+        return False
+    covered_until = folded[-1].id
+
+    def save(db: Session):
+        row = db.query(models.ChatSummary).filter(models.ChatSummary.chat_id == chat_id).first()
+        if row is None:
+            db.add(models.ChatSummary(chat_id=chat_id, summary=new_summary,
+                                      covered_until_message_id=covered_until, model=model))
+        elif row.covered_until_message_id == covered:  # Skip if another refresh got there first
+            row.summary, row.covered_until_message_id, row.model = new_summary, covered_until, model
+    await run_unit_of_work(save)
+    SUMMARY_REFRESHES.labels("ok").inc()
+    logger.info(f"Chat {chat_id}: folded {len(folded)} messages into the rolling summary.")
+    return True
+
+
+def schedule_summary_refresh(chat_id: int, model: Optional[str] = None):
+    """Runs refresh_summary in the background (at most one per chat at a time)."""
+    if not settings.CHAT_SUMMARY_ENABLED or chat_id in _in_progress:
+        return
+    _in_progress.add(chat_id)
+
+    async def run():
+        try:
+            # Repeat while there is more to fold (long chats catch up batch by batch)
+            while await refresh_summary(chat_id, model):
+                pass
+        except Exception as e:
+            SUMMARY_REFRESHES.labels("error").inc()
+            logger.error(f"Rolling summary failed for chat {chat_id}: {e}")
+        finally:
+            _in_progress.discard(chat_id)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _tasks.add(task) # Keep a reference until done
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,279 @@
+"""
+Chat deletion pipeline.
+
+Deleting a chat only marks it (Chats.deleted_at), which is one cheap UPDATE in
+the request. ChatPurger, a background thread, later reclaims everything the
+chat owned in batches: vector chunks (one DELETE ... WHERE doc_id = ANY(...) per
+batch), uploaded files on disk, and finally the MSSQL rows with set-based deletes.
+Rows go last, so a batch that fails half-way is simply retried on the next pass.
+
+Blobs and Docling cache entries are content-addressed and may be shared, so a
+purge does not delete them. Instead, every STORAGE_GC_INTERVAL_SECONDS the
+purger sweeps them (mark and sweep, under the same cross-process lock): blobs no
+Attachment.text_digest / MessageContext.content_digest references and cache
+entries whose content hash no Attachment has are removed. Files touched within
+STORAGE_GC_GRACE_SECONDS are kept, since ingestion writes them before the row
+that references them is committed.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, Iterator, List
+
+from sqlalchemy import delete, select, text, update
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import VectorSessionLocal
+from app.core.shared_state import shared_state
+from app.models import sql_models as models
+from app.services import answer_cache
+from app.services.persistence import run_in_session
+import logging
+
+logger = logging.getLogger(__name__)
+
+PURGED_CHATS = metrics.counter("chat_purge_chats_total", "Soft-deleted chats purged.")
+PURGED_CHUNKS = metrics.counter("chat_purge_vector_chunks_total", "Vector chunks deleted by the purger.")
+PURGED_FILES = metrics.counter("chat_purge_files_total", "Uploaded files removed by the purger.")
+PURGE_FAILURES = metrics.counter("chat_purge_failures_total", "Purge batches that failed (retried later).")
+PURGE_SECONDS = metrics.histogram("chat_purge_batch_seconds", "Time to purge one batch of chats.")
+GC_BLOBS = metrics.counter("storage_gc_blobs_total", "Unreferenced blobs removed by the storage sweep.")
+GC_DOCLING = metrics.counter("storage_gc_docling_entries_total", "Unreferenced Docling cache entries removed.")
+
+
+# MSSQL allows 2100 parameters per statement
+_IN_BATCH = 1000
+
+
+def _update_chats(db: Session, chat_ids: Iterable[int], **values) -> int:
+    chat_ids = list(dict.fromkeys(chat_ids))
+    affected = 0
+    for i in range(0, len(chat_ids), _IN_BATCH):
+        conditions = [models.Chat.id.in_(chat_ids[i:i + _IN_BATCH]), models.Chat.deleted_at.is_(None)]
+        result = db.execute(update(models.Chat).where(*conditions).values(**values)
+                            .execution_options(synchronize_session=False))
+        affected += result.rowcount
+    return affected
+
+
+def soft_delete_chats(db: Session, chat_ids: Iterable[int]) -> int:
+    """Marks chats as deleted. Returns the number of chats newly marked. Does not commit."""
+    return _update_chats(db, chat_ids, deleted_at=datetime.utcnow())
+
+
+def set_chats_archived(db: Session, chat_ids: Iterable[int], archived: bool) -> int:
+    """Archives/unarchives many chats (skips deleted ones). Does not commit."""
+    return _update_chats(db, chat_ids, is_archived=archived)
+
+
+def delete_vector_chunks(doc_ids: List[str]) -> int:
+    """Deletes the chunks of many documents in one statement."""
+    if not VectorSessionLocal or not doc_ids:
+        return 0
+    vector_db = VectorSessionLocal()
+    try:
+        result = vector_db.execute(
+            text("DELETE FROM document_chunks WHERE doc_id = ANY(:doc_ids)"), {"doc_ids": list(doc_ids)}
+        )
+        answer_cache.invalidate_documents(vector_db, list(doc_ids))
+        vector_db.commit()
+        return result.rowcount
+    except Exception:
+        vector_db.rollback()
+        raise
+    finally:
+        vector_db.close()
+
+
+def _purge_batch(chat_ids: List[int]):
+    start = time.perf_counter()
+
+    # 1. Collect what the chats own (attachments linked by chat or by one of its messages)
+    def collect(db: Session):
+        message_ids = select(models.Message.id).where(models.Message.chat_id.in_(chat_ids))
+        owned = db.query(models.Attachment.id, models.Attachment.file_path).filter(
+            models.Attachment.chat_id.in_(chat_ids) | models.Attachment.message_id.in_(message_ids)
+        ).all()
+        # Same name + same content is stored at the same path: keep files another attachment still uses
+        owned_ids = {att.id for att in owned}
+        paths = list({att.file_path for att in owned if att.file_path})
+        shared = set()
+        for i in range(0, len(paths), _IN_BATCH):
+            rows = db.query(models.Attachment.id, models.Attachment.file_path).filter(
+                models.Attachment.file_path.in_(paths[i:i + _IN_BATCH])).all()
+            shared.update(row.file_path for row in rows if row.id not in owned_ids)
+        return owned, shared
+    attachments, shared_paths = run_in_session(collect)
+
+    # 2. Vectors, one statement for the whole batch
+    PURGED_CHUNKS.inc(delete_vector_chunks([str(att.id) for att in attachments]))
+
+    # 3. Files on disk
+    for att in attachments:
+        if att.file_path and att.file_path not in shared_paths and os.path.exists(att.file_path):
+            try:
+                os.remove(att.file_path)
+                PURGED_FILES.inc()
+            except OSError as e:
+                logger.warning(f"Could not remove {att.file_path}: {e}")
+
+    # 4. MSSQL rows, children first
+    def remove_rows(db: Session):
+        message_ids = select(models.Message.id).where(models.Message.chat_id.in_(chat_ids))
+        db.execute(delete(models.MessageContext).where(models.MessageContext.message_id.in_(message_ids))
+                   .execution_options(synchronize_session=False))
+        attachment_ids = select(models.Attachment.id).where(
+            models.Attachment.chat_id.in_(chat_ids) | models.Attachment.message_id.in_(message_ids))
+        db.execute(delete(models.DocumentSummary).where(models.DocumentSummary.attachment_id.in_(attachment_ids))
+                   .execution_options(synchronize_session=False))
+        db.execute(delete(models.Attachment).where(
+            models.Attachment.chat_id.in_(chat_ids) | models.Attachment.message_id.in_(message_ids)
+        ).execution_options(synchronize_session=False))
+        db.execute(delete(models.chat_tags).where(models.chat_tags.c.chat_id.in_(chat_ids)))
+        db.execute(delete(models.ChatSummary).where(models.ChatSummary.chat_id.in_(chat_ids))
+                   .execution_options(synchronize_session=False))
+        db.execute(delete(models.Message).where(models.Message.chat_id.in_(chat_ids))
+                   .execution_options(synchronize_session=False))
+        db.execute(delete(models.Chat).where(models.Chat.id.in_(chat_ids))
+                   .execution_options(synchronize_session=False))
+    run_in_session(remove_rows)
+
+    PURGED_CHATS.inc(len(chat_ids))
+    PURGE_SECONDS.observe(time.perf_counter() - start)
+    logger.info(f"Purged {len(chat_ids)} chats ({len(attachments)} attachments).")
+
+
+def purge_deleted_chats(batch_size: int = None, max_batches: int = None) -> int:
+    """Purges soft-deleted chats batch by batch. Returns the number of chats purged."""
+    batch_size = batch_size or settings.CHAT_PURGE_BATCH_SIZE
+    purged = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        chat_ids = run_in_session(lambda db: [row.id for row in db.query(models.Chat.id).filter(
+            models.Chat.deleted_at.isnot(None)
+        ).order_by(models.Chat.deleted_at).limit(batch_size).all()])
+        if not chat_ids:
+            break
+        _purge_batch(chat_ids)
+        purged += len(chat_ids)
+        batches += 1
+    return purged
+
+
+def _batched(items: Iterable, size: int = _IN_BATCH) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def sweep_blobs(grace_seconds: float = None, stop: threading.Event = None) -> int:
+    """Removes blobs that no row references (and not touched within grace_seconds). Returns the count."""
+    from app.services.blob_store import blob_store
+    grace_seconds = settings.STORAGE_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = time.time() - grace_seconds
+    candidates = (digest for digest, mtime in blob_store.iter_digests() if mtime < cutoff)
+    removed = 0
+    for digests in _batched(candidates):
+        if stop is not None and stop.is_set():
+            break
+
+        def referenced(db: Session):
+            used = {row[0] for row in db.query(models.Attachment.text_digest).filter(
+                models.Attachment.text_digest.in_(digests)).distinct()}
+            used.update(row[0] for row in db.query(models.MessageContext.content_digest).filter(
+                models.MessageContext.content_digest.in_(digests)).distinct())
+            return used
+        used = run_in_session(referenced)
+        removed += sum(blob_store.delete(digest, older_than=cutoff) for digest in digests if digest not in used)
+    GC_BLOBS.inc(removed)
+    return removed
+
+
+def sweep_docling_cache(grace_seconds: float = None, stop: threading.Event = None) -> int:
+    """Removes Docling cache entries whose content hash no Attachment has. Returns the count."""
+    from app.services.docling_cache import docling_cache
+    if not docling_cache:
+        return 0
+    grace_seconds = settings.STORAGE_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = time.time() - grace_seconds
+    candidates = ((profile, content_hash) for profile, content_hash, mtime in docling_cache.iter_entries()
+                  if mtime < cutoff)
+    removed = 0
+    for entries in _batched(candidates):
+        if stop is not None and stop.is_set():
+            break
+        hashes = list({content_hash for _, content_hash in entries})
+        used = run_in_session(lambda db: {row[0] for row in db.query(models.Attachment.content_hash).filter(
+            models.Attachment.content_hash.in_(hashes)).distinct()})
+        removed += sum(docling_cache.delete(profile, content_hash, older_than=cutoff)
+                       for profile, content_hash in entries if content_hash not in used)
+    GC_DOCLING.inc(removed)
+    return removed
+
+
+class ChatPurger:
+    """Background thread that runs purge_deleted_chats periodically, or right after wake()."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="chat-purger", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def _collect_garbage(self):
+        """Sweeps unreferenced blobs / Docling cache entries, at most once per interval across processes."""
+        if shared_state.get("storage_gc", max_age=settings.STORAGE_GC_INTERVAL_SECONDS) is not None:
+            return
+        blobs = sweep_blobs(stop=self._stop)
+        entries = sweep_docling_cache(stop=self._stop)
+        if not self._stop.is_set():
+            shared_state.set("storage_gc", {"blobs": blobs, "docling_entries": entries})
+        if blobs or entries:
+            logger.info(f"Storage GC removed {blobs} blobs and {entries} Docling cache entries.")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                # One process purges at a time (several API workers each run a purger)
+                with shared_state.lock("chat_purge", stale_after=self.interval * 10 + 600) as acquired:
+                    # One batch at a time so stop() is honoured promptly
+                    while acquired and not self._stop.is_set() and purge_deleted_chats(max_batches=1):
+                        pass
+                    if acquired and not self._stop.is_set():
+                        self._collect_garbage()
+            except Exception as e:
+                PURGE_FAILURES.inc()
+                logger.error(f"Chat purge failed (will retry): {e}")
+
+
+chat_purger = ChatPurger(settings.CHAT_PURGE_INTERVAL_SECONDS)
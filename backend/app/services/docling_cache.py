@@ -0,0 +1,117 @@
+"""
+Persistent cache of converted documents.
+
+Docling conversion (OCR, layout and table analysis) is by far the most expensive
+ingestion stage. The converted DoclingDocument is stored in Docling's lossless
+JSON form, zlib-compressed, under
+
+    DOCLING_CACHE_DIR/<pipeline profile>/<first two hex chars>/<content sha256>.json.z
+
+The pipeline profile is a short hash of the converter options (plus the Docling
+version), so changing OCR/table settings naturally misses the cache, while
+changing chunking or the embedding model reuses it.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import zlib
+from typing import Iterator, Optional, Tuple
+
+from app.core.config import settings
+from app.core import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_BYTES = 1024 ** 2
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_pipeline_profile(options: dict) -> str:
+    """Stable short id for a set of conversion options."""
+    encoded = json.dumps(options, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class DoclingDocumentCache:
+    def __init__(self, root: str, compression_level: int = 6):
+        self.root = root
+        self.compression_level = compression_level
+
+    def _path(self, profile: str, content_hash: str) -> str:
+        return os.path.join(self.root, profile, content_hash[:2], f"{content_hash}.json.z")
+
+    def exists(self, profile: str, content_hash: str) -> bool:
+        return os.path.exists(self._path(profile, content_hash))
+
+    def get(self, profile: str, content_hash: str):
+        """Returns the cached DoclingDocument, or None (missing or unreadable entries count as misses)."""
+        from docling_core.types.doc import DoclingDocument
+        path = self._path(profile, content_hash)
+        try:
+            with open(path, "rb") as f:
+                data = zlib.decompress(f.read())
+            doc = DoclingDocument.model_validate_json(data)
+            with contextlib.suppress(OSError):
+                os.utime(path) # In use: keeps the storage GC off it until the attachment is indexed
+        except FileNotFoundError:
+            doc = None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable Docling cache entry {path}: {e}")
+            doc = None
+        metrics.record_cache("docling_document", doc is not None)
+        return doc
+
+    def put(self, profile: str, content_hash: str, doc):
+        path = self._path(profile, content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(doc.model_dump_json().encode("utf-8"), self.compression_level)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, profile: str, content_hash: str, older_than: Optional[float] = None) -> bool:
+        """Removes an entry; with older_than (a timestamp), entries written or read since then are kept."""
+        path = self._path(profile, content_hash)
+        try:
+            if older_than is not None and os.path.getmtime(path) >= older_than:
+                return False
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def iter_entries(self) -> Iterator[Tuple[str, str, float]]:
+        """Yields (profile, content_hash, mtime) for every cached document."""
+        try:
+            profiles = [entry for entry in os.scandir(self.root) if entry.is_dir()]
+        except FileNotFoundError:
+            return
+        for profile in profiles:
+            for shard in os.scandir(profile.path):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and entry.name.endswith(".json.z"):
+                        try:
+                            yield profile.name, entry.name[:-len(".json.z")], entry.stat().st_mtime
+                        except FileNotFoundError:
+                            pass
+
+
+docling_cache: Optional[DoclingDocumentCache] = (
+    DoclingDocumentCache(settings.DOCLING_CACHE_DIR) if settings.DOCLING_CACHE_ENABLED else None
+)
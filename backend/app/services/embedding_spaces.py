@@ -0,0 +1,303 @@
+"""
+Versioned embedding spaces.
+
+Retrieval always runs in the *active* space: the legacy document_chunks.embedding
+column (settings.EMBEDDING_MODEL) until another space is activated, then that
+space's rows in chunk_embeddings. Changing models without downtime:
+
+  1. create_space(name, model, dims)     -> status "building"; new chunks are
+                                            dual-written into it from now on
+                                            (within the cache window)
+  2. backfill(name)                      -> throttled re-embedding of existing chunks
+  3. activate(name)                      -> one transaction flips the statuses;
+                                            refused while chunks are still missing
+
+New chunks are embedded into the active space and the building ones only;
+once another space is active the legacy column is no longer written, so the
+legacy model can be retired (going back to it needs re-embedding).
+
+Processes cache the active space for EMBEDDING_SPACE_CACHE_SECONDS, so every
+process switches within that window after activation.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import ollama
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import VectorSessionLocal
+from app.models.vector_models import ChunkEmbedding, DocumentChunk, EmbeddingSpace
+import logging
+
+logger = logging.getLogger(__name__)
+
+REEMBEDDED = metrics.counter("embedding_backfill_chunks_total", "Chunks re-embedded into a new space.", ("space",))
+
+
+class EmbeddingSpaceError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class SpaceInfo:
+    id: Optional[int] # None = legacy document_chunks.embedding column
+    name: str
+    model: str
+
+    @property
+    def is_legacy(self) -> bool:
+        return self.id is None
+
+
+LEGACY_SPACE = SpaceInfo(None, "legacy", settings.EMBEDDING_MODEL)
+
+
+def embed_text(text: str, model: Optional[str] = None) -> list[float]:
+    response = ollama.embeddings(model=model or settings.EMBEDDING_MODEL, prompt=text)
+    return response["embedding"]
+
+
+# --- Active / building space lookup (cached per process) ---
+
+_cache_lock = threading.Lock()
+_cached_at = 0.0
+_cached_active: SpaceInfo = LEGACY_SPACE
+_cached_building: List[SpaceInfo] = []
+
+
+def _refresh():
+    global _cached_at, _cached_active, _cached_building
+    active, building = LEGACY_SPACE, []
+    if VectorSessionLocal:
+        vector_db = VectorSessionLocal()
+        try:
+            rows = vector_db.query(EmbeddingSpace.id, EmbeddingSpace.name, EmbeddingSpace.model,
+                                   EmbeddingSpace.status).filter(
+                EmbeddingSpace.status.in_(("active", "building"))
+            ).all()
+            for row in rows:
+                info = SpaceInfo(row.id, row.name, row.model)
+                if row.status == "active":
+                    active = info
+                else:
+                    building.append(info)
+        except Exception as e:
+            logger.error(f"Could not load embedding spaces (using legacy): {e}")
+        finally:
+            vector_db.close()
+    _cached_active, _cached_building, _cached_at = active, building, time.monotonic()
+
+
+def _ensure_fresh():
+    with _cache_lock:
+        if time.monotonic() - _cached_at > settings.EMBEDDING_SPACE_CACHE_SECONDS:
+            _refresh()
+
+
+def active_space() -> SpaceInfo:
+    _ensure_fresh()
+    return _cached_active
+
+
+def building_spaces() -> List[SpaceInfo]:
+    _ensure_fresh()
+    return list(_cached_building)
+
+
+def invalidate_cache():
+    global _cached_at
+    with _cache_lock:
+        _cached_at = 0.0
+
+
+# --- Writes ---
+
+def storage_spaces() -> List[SpaceInfo]:
+    """Spaces new chunks are embedded into: the active space and every building space."""
+    return [active_space()] + [space for space in building_spaces() if space != active_space()]
+
+
+def embed_chunks(texts: List[str], map_fn: Callable = map) -> Dict[SpaceInfo, List[list]]:
+    """
+    Embeddings of new chunk texts for every storage space. Call before opening the
+    vector transaction (these are Ollama calls); `map_fn` may be an executor's map.
+    """
+    return {space: list(map_fn(lambda text, model=space.model: embed_text(text, model), texts))
+            for space in storage_spaces()}
+
+
+def legacy_embeddings(embeddings: Dict[SpaceInfo, List[list]]) -> Optional[List[list]]:
+    """Values for document_chunks.embedding, or None when the legacy space is not written."""
+    return next((vectors for space, vectors in embeddings.items() if space.is_legacy), None)
+
+
+def write_embeddings(vector_db, chunk_ids: List[int], embeddings: Dict[SpaceInfo, List[list]]):
+    """Inserts the non-legacy embeddings of freshly stored chunks, in the caller's transaction."""
+    for space, vectors in embeddings.items():
+        if space.is_legacy:
+            continue
+        rows = [{"chunk_id": chunk_id, "space_id": space.id, "embedding": vector}
+                for chunk_id, vector in zip(chunk_ids, vectors)]
+        if rows:
+            vector_db.execute(insert(ChunkEmbedding).on_conflict_do_nothing(), rows)
+
+
+# --- Lifecycle ---
+
+def create_space(name: str, model: str, dimensions: int) -> int:
+    vector_db = VectorSessionLocal()
+    try:
+        if vector_db.query(EmbeddingSpace.id).filter(EmbeddingSpace.name == name).first():
+            raise EmbeddingSpaceError(f"Embedding space '{name}' already exists.")
+        probe = embed_text("dimension probe", model)
+        if len(probe) != dimensions:
+            raise EmbeddingSpaceError(f"Model {model} returns {len(probe)} dimensions, not {dimensions}.")
+        space = EmbeddingSpace(name=name, model=model, dimensions=dimensions, status="building")
+        vector_db.add(space)
+        vector_db.commit()
+        invalidate_cache()
+        return space.id
+    finally:
+        vector_db.close()
+
+
+def _get_space(vector_db, name: str) -> EmbeddingSpace:
+    space = vector_db.query(EmbeddingSpace).filter(EmbeddingSpace.name == name).first()
+    if not space:
+        raise EmbeddingSpaceError(f"Unknown embedding space '{name}'.")
+    return space
+
+
+def missing_count(vector_db, space_id: int) -> int:
+    """Number of chunks without an embedding in the space."""
+    return vector_db.query(func.count(DocumentChunk.id)).outerjoin(
+        ChunkEmbedding, and_(ChunkEmbedding.chunk_id == DocumentChunk.id, ChunkEmbedding.space_id == space_id)
+    ).filter(ChunkEmbedding.chunk_id.is_(None)).scalar()
+
+
+def backfill(name: str, batch_size: Optional[int] = None, max_per_second: Optional[float] = None,
+             should_stop: Callable[[], bool] = lambda: False) -> int:
+    """
+    Embeds every chunk that has no embedding in the space yet, in batches.
+    Throttled to max_per_second embeddings so live traffic keeps its share of Ollama.
+    Resumable: it always picks up the chunks that are still missing. Returns chunks embedded.
+    """
+    batch_size = batch_size or settings.REEMBED_BATCH_SIZE
+    max_per_second = max_per_second if max_per_second is not None else settings.REEMBED_MAX_PER_SECOND
+    done = 0
+    vector_db = VectorSessionLocal()
+    try:
+        space = _get_space(vector_db, name)
+        if space.status != "building":
+            raise EmbeddingSpaceError(f"Space '{name}' is {space.status}, not building.")
+        space_id, model = space.id, space.model
+        vector_db.commit()
+
+        while not should_stop():
+            batch = vector_db.execute(
+                select(DocumentChunk.id, DocumentChunk.text).outerjoin(
+                    ChunkEmbedding,
+                    and_(ChunkEmbedding.chunk_id == DocumentChunk.id, ChunkEmbedding.space_id == space_id)
+                ).where(ChunkEmbedding.chunk_id.is_(None)).order_by(DocumentChunk.id).limit(batch_size)
+            ).all()
+            if not batch:
+                break
+
+            started = time.perf_counter()
+            rows = [{"chunk_id": row.id, "space_id": space_id, "embedding": embed_text(row.text, model)}
+                    for row in batch]
+            # Chunks deleted meanwhile would violate the FK; skip them by re-checking existence
+            existing = set(vector_db.execute(
+                select(DocumentChunk.id).where(DocumentChunk.id.in_([r["chunk_id"] for r in rows]))
+            ).scalars())
+            rows = [r for r in rows if r["chunk_id"] in existing]
+            if rows:
+                vector_db.execute(insert(ChunkEmbedding).on_conflict_do_nothing(), rows)
+            vector_db.commit()
+            done += len(rows)
+            REEMBEDDED.labels(name).inc(len(rows))
+
+            if max_per_second and max_per_second > 0:
+                pause = len(batch) / max_per_second - (time.perf_counter() - started)
+                if pause > 0:
+                    time.sleep(pause)
+        return done
+    except Exception:
+        vector_db.rollback()
+        raise
+    finally:
+        vector_db.close()
+
+
+def activate(name: str, force: bool = False):
+    """
+    Makes `name` the active space in one transaction (the previous one is retired).
+    Refuses while chunks are missing from the space unless force=True.
+    Use name="legacy" to go back to document_chunks.embedding (chunks stored while another
+    space was active have no legacy embedding; refused unless force=True).
+    """
+    vector_db = VectorSessionLocal()
+    try:
+        target_id = None
+        if name == LEGACY_SPACE.name:
+            if not force:
+                missing = vector_db.query(func.count(DocumentChunk.id)).filter(
+                    DocumentChunk.embedding.is_(None)).scalar()
+                if missing:
+                    raise EmbeddingSpaceError(f"{missing} chunks have no legacy embedding; re-index them first.")
+        else:
+            space = _get_space(vector_db, name)
+            target_id = space.id
+            if not force:
+                missing = missing_count(vector_db, space.id)
+                if missing:
+                    raise EmbeddingSpaceError(f"Space '{name}' is missing {missing} chunks; run the backfill first.")
+
+        vector_db.execute(update(EmbeddingSpace).where(EmbeddingSpace.status == "active")
+                          .values(status="retired"))
+        if target_id is not None:
+            vector_db.execute(update(EmbeddingSpace).where(EmbeddingSpace.id == target_id)
+                              .values(status="active", activated_at=datetime.utcnow()))
+        vector_db.commit()
+        invalidate_cache()
+        logger.info(f"Embedding space '{name}' is now active.")
+    except Exception:
+        vector_db.rollback()
+        raise
+    finally:
+        vector_db.close()
+
+
+def drop_space(name: str):
+    """Deletes a non-active space and its embeddings."""
+    vector_db = VectorSessionLocal()
+    try:
+        space = _get_space(vector_db, name)
+        if space.status == "active":
+            raise EmbeddingSpaceError("Activate another space before dropping the active one.")
+        vector_db.query(ChunkEmbedding).filter(ChunkEmbedding.space_id == space.id).delete(synchronize_session=False)
+        vector_db.delete(space)
+        vector_db.commit()
+        invalidate_cache()
+    finally:
+        vector_db.close()
+
+
+def list_spaces() -> List[dict]:
+    vector_db = VectorSessionLocal()
+    try:
+        result = []
+        for space in vector_db.query(EmbeddingSpace).order_by(EmbeddingSpace.id).all():
+            result.append({
+                "name": space.name, "model": space.model, "dimensions": space.dimensions,
+                "status": space.status, "missing": missing_count(vector_db, space.id),
+            })
+        return result
+    finally:
+        vector_db.close()
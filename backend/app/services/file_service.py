@@ -1,9 +1,12 @@
 import os
-from app.services.ingestion import extract_text_content
+import asyncio
+import hashlib
+import time
+import uuid
 from fastapi import UploadFile
-from typing import Tuple
+from typing import NamedTuple, Optional
 from app.core.config import settings
-import shutil
+from app.core import metrics
 from datetime import datetime
 import logging
 
@@ -15,25 +18,156 @@ UPLOAD_DIR = settings.UPLOAD_DIR
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-async def save_upload_file(upload_file: UploadFile) -> Tuple[str, int]:
+UPLOAD_BYTES = metrics.counter("upload_bytes_total", "Bytes written by the upload writer.")
+UPLOAD_THROUGHPUT = metrics.histogram(
+    "upload_throughput_bytes_per_second", "Write throughput per completed upload.",
+    buckets=(1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9))
+UPLOAD_REJECTED = metrics.counter("upload_rejected_total", "Uploads rejected by reason.", ("reason",))
+
+
+class UploadTooLargeError(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"File exceeds the maximum upload size of {limit} bytes.")
+        self.limit = limit
+
+
+class SavedFile(NamedTuple):
+    file_path: str
+    file_size: int
+    content_hash: str # SHA-256 hex digest of the content
+
+
+def upload_target_dir() -> str:
+    """Date-based subdirectory of UPLOAD_DIR for today's uploads."""
+    target_dir = os.path.join(UPLOAD_DIR, datetime.now().strftime("%Y-%m-%d"))
+    os.makedirs(target_dir, exist_ok=True)
+    return target_dir
+
+
+def safe_file_name(file_name: Optional[str]) -> str:
+    """Strips any directory part of a client-supplied name."""
+    name = os.path.basename((file_name or "").replace("\\", "/")).strip()
+    return name or "upload"
+
+
+def place_file(tmp_path: str, target_dir: str, file_name: str, content_hash: str) -> str:
     """
-    Saves file to disk and returns (file_path, file_size).
+    Moves a finished temp file into place without clobbering another upload:
+    the plain name is claimed with an atomic hard link; if it is taken, the file
+    gets a content-hash suffix (same name + same content lands on the same path).
     """
+    final_path = os.path.join(target_dir, file_name)
     try:
-        # Create date-based subdirectory
-        today = datetime.now().strftime("%Y-%m-%d")
-        target_dir = os.path.join(UPLOAD_DIR, today)
-        os.makedirs(target_dir, exist_ok=True)
-        
-        file_path = os.path.join(target_dir, upload_file.filename)
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
-            
-        file_size = os.path.getsize(file_path)
-        return file_path, file_size
+        os.link(tmp_path, final_path)
+        os.remove(tmp_path)
+        return final_path
+    except FileExistsError:
+        pass
+    except OSError:
+        # Hard links unsupported here: only rename onto the plain name if it is free
+        if not os.path.exists(final_path):
+            os.replace(tmp_path, final_path)
+            return final_path
+
+    stem, ext = os.path.splitext(file_name)
+    final_path = os.path.join(target_dir, f"{stem}_{content_hash[:12]}{ext}")
+    os.replace(tmp_path, final_path)
+    return final_path
+
+
+class HashingFileWriter:
+    """
+    Streams chunks into a temp file next to the destination, hashing them on the way.
+    All file I/O runs in a worker thread; the size limit is checked per chunk, so
+    oversized uploads are rejected as soon as they cross it.
+    """
+
+    def __init__(self, target_dir: str, max_bytes: Optional[int] = None):
+        self.target_dir = target_dir
+        self.max_bytes = max_bytes if max_bytes is not None else settings.MAX_UPLOAD_BYTES
+        self.tmp_path = os.path.join(target_dir, f".{uuid.uuid4().hex}.part")
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = None
+        self._started = time.perf_counter()
+
+    def _write_sync(self, chunk: bytes):
+        if self._file is None:
+            self._file = open(self.tmp_path, "wb")
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    async def write(self, chunk: bytes):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            UPLOAD_REJECTED.labels("too_large").inc()
+            raise UploadTooLargeError(self.max_bytes)
+        await asyncio.to_thread(self._write_sync, chunk)
+        UPLOAD_BYTES.inc(len(chunk))
+
+    def _close_sync(self):
+        if self._file is None:
+            self._file = open(self.tmp_path, "wb") # Empty upload
+        self._file.close()
+
+    async def commit(self, file_name: str) -> SavedFile:
+        """Moves the file into target_dir under file_name (see place_file)."""
+        await asyncio.to_thread(self._close_sync)
+        content_hash = self._hash.hexdigest()
+        final_path = await asyncio.to_thread(place_file, self.tmp_path, self.target_dir,
+                                             safe_file_name(file_name), content_hash)
+        return self._finished(final_path, content_hash)
+
+    async def commit_to(self, path: str) -> SavedFile:
+        """Atomically replaces `path` with the written file."""
+        await asyncio.to_thread(self._close_sync)
+        await asyncio.to_thread(os.replace, self.tmp_path, path)
+        return self._finished(path, self._hash.hexdigest())
+
+    def _finished(self, final_path: str, content_hash: str) -> SavedFile:
+        elapsed = time.perf_counter() - self._started
+        if elapsed > 0:
+            UPLOAD_THROUGHPUT.observe(self.size / elapsed)
+        logger.info(f"Saved {final_path} ({self.size} bytes in {elapsed:.2f}s, "
+                    f"{self.size / max(elapsed, 1e-6) / 1024 ** 2:.1f} MB/s)")
+        return SavedFile(final_path, self.size, content_hash)
+
+    def _abort_sync(self):
+        if self._file is not None:
+            self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    async def abort(self):
+        await asyncio.to_thread(self._abort_sync)
+
+
+async def save_upload_file(upload_file: UploadFile, max_bytes: Optional[int] = None) -> SavedFile:
+    """
+    Streams an upload to disk and returns SavedFile(file_path, file_size, content_hash).
+    Raises UploadTooLargeError (before writing anything if the size is already known).
+    """
+    writer = HashingFileWriter(upload_target_dir(), max_bytes)
+    try:
+        declared_size = getattr(upload_file, "size", None)
+        if declared_size is not None and declared_size > writer.max_bytes:
+            UPLOAD_REJECTED.labels("too_large").inc()
+            raise UploadTooLargeError(writer.max_bytes)
+        while True:
+            chunk = await upload_file.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            await writer.write(chunk)
+        return await writer.commit(upload_file.filename)
+    except BaseException:
+        await writer.abort()
+        raise
     finally:
-        upload_file.file.close()
+        await upload_file.close()
 
 
 
@@ -44,7 +178,32 @@ def extract_text_from_file(file_path: str, file_type: str) -> str:
     Delegates to app.services.ingestion.extract_text_content.
     """
     try:
+        from app.services.ingestion import extract_text_content  # Docling; only loaded when used
         return extract_text_content(file_path)
     except Exception as e:
         logger.error(f"Extraction error: {e}")
         return ""
+
+
+def store_extracted_text(attachment, markdown_text: str):
+    """Keeps extracted text in the blob store (digest on the row) or inline, per BLOB_STORE_ENABLED."""
+    from app.services.blob_store import blob_store
+    if settings.BLOB_STORE_ENABLED and markdown_text:
+        attachment.text_digest = blob_store.put(markdown_text)
+        attachment.extracted_text = None
+    else:
+        attachment.text_digest = None
+        attachment.extracted_text = markdown_text
+
+
+def index_attachment(db, attachment, file_path: str, content_hash: Optional[str]):
+    """
+    Converts, chunks and indexes an attachment's file, then stores its text and content hash.
+    Loads Docling, so it runs in the API process only with INGESTION_MODE="inline";
+    otherwise in ingest_worker.py.
+    """
+    from app.services import ingestion
+    markdown_text = ingestion.process_and_index_document(file_path, str(attachment.id), content_hash)
+    store_extracted_text(attachment, markdown_text)
+    attachment.content_hash = content_hash # Marks the content as indexed (bulk import skips it)
+    db.commit()
@@ -0,0 +1,161 @@
+"""
+Local ingestion job queue (INGESTION_MODE = "worker").
+
+The API enqueues one job per uploaded file; ingest_worker.py processes (one or
+several of them) claim and run the jobs, so Docling, torch and the OCR/layout
+models are only loaded in the worker processes. Jobs are JSON files moved
+between state directories under INGEST_QUEUE_DIR:
+
+    pending/ -> running/ -> done/ | failed/
+
+Claiming is an atomic rename, so any number of workers can share the queue.
+Workers touch their running job file periodically; jobs whose file stops being
+touched for INGEST_JOB_STALE_SECONDS (a crashed worker) are put back in pending.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+from app.core.config import settings
+from app.core import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOBS = metrics.counter("ingest_jobs_total", "Ingestion jobs by event.", ("event",))
+
+STATES = ("pending", "running", "done", "failed")
+
+
+class IngestJobError(Exception):
+    pass
+
+
+class IngestQueue:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _dir(self, state: str) -> str:
+        path = os.path.join(self.root, state)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _path(self, state: str, job_id: str) -> str:
+        return os.path.join(self._dir(state), f"{job_id}.json")
+
+    def _write(self, path: str, data: dict):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def submit(self, job: dict) -> str:
+        """Enqueues a job; ids sort by submission time, so workers take jobs FIFO."""
+        job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        self._write(self._path("pending", job_id), {**job, "id": job_id, "submitted_at": time.time()})
+        JOBS.labels("submitted").inc()
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, dict]]:
+        """Takes the oldest pending job, or returns None if there is none."""
+        pending_dir = self._dir("pending")
+        for name in sorted(n for n in os.listdir(pending_dir) if n.endswith(".json")):
+            job_id = name[:-len(".json")]
+            running_path = self._path("running", job_id)
+            try:
+                os.rename(os.path.join(pending_dir, name), running_path)
+            except (FileNotFoundError, PermissionError):
+                continue # Claimed by another worker
+            os.utime(running_path)
+            with open(running_path, "r", encoding="utf-8") as f:
+                JOBS.labels("claimed").inc()
+                return job_id, json.load(f)
+        return None
+
+    def heartbeat(self, job_id: str):
+        try:
+            os.utime(self._path("running", job_id))
+        except FileNotFoundError:
+            pass
+
+    def _finish(self, job_id: str, state: str, extra: dict):
+        running_path = self._path("running", job_id)
+        try:
+            with open(running_path, "r", encoding="utf-8") as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            job = {"id": job_id}
+        self._write(self._path(state, job_id), {**job, **extra, "status": state, "finished_at": time.time()})
+        try:
+            os.remove(running_path)
+        except FileNotFoundError:
+            pass
+        JOBS.labels(state).inc()
+
+    def complete(self, job_id: str, result: Optional[dict] = None):
+        self._finish(job_id, "done", {"result": result or {}})
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, "failed", {"error": error})
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """The job with its status (pending/running/done/failed), or None if unknown."""
+        for state in STATES:
+            try:
+                with open(self._path(state, job_id), "r", encoding="utf-8") as f:
+                    return {**json.load(f), "status": state}
+            except (FileNotFoundError, ValueError):
+                continue
+        return None
+
+    async def wait(self, job_id: str, timeout: float, poll_seconds: float = 0.5) -> Optional[dict]:
+        """Waits for the job to finish; returns it (done or failed), or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = await asyncio.to_thread(self.status, job_id)
+            if job and job["status"] in ("done", "failed"):
+                return job
+            await asyncio.sleep(poll_seconds)
+        return None
+
+    def requeue_stale(self, stale_after: Optional[float] = None) -> int:
+        """Moves running jobs without a recent heartbeat back to pending. Returns the count."""
+        stale_after = stale_after or settings.INGEST_JOB_STALE_SECONDS
+        running_dir = self._dir("running")
+        requeued = 0
+        for name in os.listdir(running_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(running_dir, name)
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    os.rename(path, os.path.join(self._dir("pending"), name))
+                    requeued += 1
+                    JOBS.labels("requeued").inc()
+                    logger.warning(f"Requeued stale ingestion job {name[:-len('.json')]}")
+            except (FileNotFoundError, PermissionError):
+                continue
+        return requeued
+
+    def cleanup(self, max_age_seconds: float) -> int:
+        """Deletes finished job files older than max_age_seconds."""
+        removed = 0
+        cutoff = time.time() - max_age_seconds
+        for state in ("done", "failed"):
+            state_dir = self._dir(state)
+            for name in os.listdir(state_dir):
+                path = os.path.join(state_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+ingest_queue = IngestQueue(settings.INGEST_QUEUE_DIR)
@@ -6,12 +6,19 @@ from docling_core.types.io import DocumentStream
 from io import BytesIO
 import pathlib
 
-from sqlalchemy.orm import Session
 from app.core.database import VectorSessionLocal
-from app.models.vector_models import DocumentChunk
 from app.core.config import settings
-import ollama
+from app.core import metrics
+from app.services import embedding_spaces
+from app.services.docling_cache import docling_cache, file_sha256, make_pipeline_profile
+# Embedding, storage and retrieval live in vector_index (no Docling); re-exported for existing callers
+from app.services.vector_index import (  # noqa: F401
+    get_embedding, get_query_embedding, store_chunks, retrieve_relevant_chunks, expand_to_windows,
+    get_chunks_by_ids, delete_document_chunks
+)
+import threading
 import json
+import time
 import logging
 
 # Configure Logging
@@ -39,20 +46,54 @@ converter = DocumentConverter(
     }
 )
 
+# Identifies the conversion settings above in the Docling document cache
+from importlib.metadata import version as _package_version
+PIPELINE_PROFILE = make_pipeline_profile({
+    "docling": _package_version("docling"),
+    "pdf": pdfpipeline_options.model_dump(mode="json"),
+})
+
 
 import os
 # ... (existing imports)
 
 # ... (converter init)
 
-def get_embedding(text: str) -> list[float]:
-    response = ollama.embeddings(model="nomic-embed-text", prompt=text)
-    return response["embedding"]
+# Ingestion metrics (rates such as pages/s come from rate() over the counters)
+INGEST_IN_PROGRESS = metrics.gauge("ingestion_documents_in_progress", "Documents currently being converted/indexed.")
+INGEST_DOCUMENTS = metrics.counter("ingestion_documents_total", "Documents processed by result.", ("result",))
+INGEST_PAGES = metrics.counter("ingestion_pages_total", "Pages converted by Docling.")
+INGEST_CHUNKS = metrics.counter("ingestion_chunks_total", "Chunks produced by the chunker.")
+INGEST_EMBEDDINGS = metrics.counter("ingestion_embeddings_total", "Embeddings computed for chunks.")
+INGEST_STAGE_SECONDS = metrics.histogram(
+    "ingestion_stage_duration_seconds", "Duration of ingestion stages per document.", ("stage",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+
+def get_docling_document(file_path: str, content_hash: str = None):
+    """
+    Centralized function to get a Docling Document from a file path.
+    Served from the Docling document cache when this content was converted before
+    with the same pipeline profile; otherwise converted and cached.
+    """
+    if not docling_cache:
+        return _convert_document(file_path)
 
+    content_hash = content_hash or file_sha256(file_path)
+    doc = docling_cache.get(PIPELINE_PROFILE, content_hash)
+    if doc is not None:
+        logger.info(f"Loaded converted document from cache for {file_path}")
+        return doc
 
-def get_docling_document(file_path: str):
+    doc = _convert_document(file_path)
+    try:
+        docling_cache.put(PIPELINE_PROFILE, content_hash, doc)
+    except Exception as e:
+        logger.warning(f"Could not cache converted document for {file_path}: {e}")
+    return doc
+
+def _convert_document(file_path: str):
     """
-    Centralized function to get a Docling Document from a file path.
+    Runs Docling on a file.
     Handles supported file types via Docling and falls back to plain text read -> DocumentStream for others.
     """
     path_obj = pathlib.Path(file_path)
@@ -102,29 +143,66 @@ def extract_text_content(file_path: str) -> str:
         logger.error(f"Failed to extract text from {file_path}: {e}")
         return ""
 
-def process_and_index_document(file_path: str, doc_id: str):
+def process_and_index_document(file_path: str, doc_id: str, content_hash: str = None):
     """
     Process a document from file_path, converting it, chunking it, and indexing it into the Vector DB.
     """
     logger.info(f"Processing file: {file_path}")
-    
-    # 1. Convert Document (Docling)
+    INGEST_IN_PROGRESS.inc()
     try:
-        doc = get_docling_document(file_path)
+        markdown = _process_and_index_document(file_path, doc_id, content_hash)
+        INGEST_DOCUMENTS.labels("ok").inc()
+        return markdown
+    except Exception:
+        INGEST_DOCUMENTS.labels("error").inc()
+        raise
+    finally:
+        INGEST_IN_PROGRESS.dec()
+
+_chunker = None
+_chunker_lock = threading.Lock()
+
+def get_chunker() -> HybridChunker:
+    """Shared HybridChunker (loading the tokenizer is expensive, so it is built once per process)."""
+    global _chunker
+    with _chunker_lock:
+        if _chunker is None:
+            _chunker = HybridChunker(
+                tokenizer="nomic-ai/nomic-embed-text-v1.5", 
+                max_tokens=350 # Approx 1500-1600 characters
+            )
+        return _chunker
+
+def chunk_document(doc) -> list[tuple[str, dict]]:
+    """Chunks a DoclingDocument into (text, metadata) pairs."""
+    return [(chunk.text, chunk.meta.export_json_dict()) for chunk in get_chunker().chunk(doc)]
+
+def convert_and_chunk(file_path: str, content_hash: str = None) -> tuple[str, int, list[tuple[str, dict]]]:
+    """
+    Conversion + chunking only, returning plain data (markdown, page count, chunks),
+    so it can run in a separate process (see bulk_import.py).
+    """
+    doc = get_docling_document(file_path, content_hash)
+    return doc.export_to_markdown(), len(doc.pages), chunk_document(doc)
+
+def _process_and_index_document(file_path: str, doc_id: str, content_hash: str = None):
+    # 1. Convert Document (Docling, or the converted-document cache)
+    try:
+        t0 = time.perf_counter()
+        doc = get_docling_document(file_path, content_hash)
+        INGEST_STAGE_SECONDS.labels("convert").observe(time.perf_counter() - t0)
+        INGEST_PAGES.inc(len(doc.pages))
         
         logger.info(f"Document converted. Pages: {len(doc.pages)}")
-        logger.info(f"Document converted. Pages: {len(doc.pages)}")
     except Exception as e:
         logger.error(f"Docling conversion failed: {e}")
         raise e
 
     # 2. Chunking (Hybrid)
-    chunker = HybridChunker(
-        tokenizer="nomic-ai/nomic-embed-text-v1.5", 
-        max_tokens=350 # Approx 1500-1600 characters
-    )
-    chunks_iter = chunker.chunk(doc)
-    chunks = list(chunks_iter)
+    t0 = time.perf_counter()
+    chunks = chunk_document(doc)
+    INGEST_STAGE_SECONDS.labels("chunk").observe(time.perf_counter() - t0)
+    INGEST_CHUNKS.inc(len(chunks))
     logger.info(f"Generated {len(chunks)} chunks.")
 
     # 3. Embedding & Storage
@@ -132,94 +210,36 @@ def process_and_index_document(file_path: str, doc_id: str):
         logger.warning("Vector DB not configured. Skipping indexing.")
         return
 
-    vector_db = VectorSessionLocal()
-    try:
-        for i, chunk in enumerate(chunks):
-            logger.info(f"\n--------------Processing chunk {i+1}/{len(chunks)}")
-            text_content = chunk.text
-            meta = chunk.meta.export_json_dict()
-            
-            # Embed
-            embedding = get_embedding(text_content)
-            
-            # Store
-            db_chunk = DocumentChunk(
-                doc_id=doc_id,
-                text=text_content,
-                embedding=embedding,
-                metadata_json=json.dumps(meta)
-            )
-            vector_db.add(db_chunk)
-        
-        vector_db.commit()
-        vector_db.commit()
-        logger.info(f"Indexed {len(chunks)} chunks to Vector DB.")
-    except Exception as e:
-        vector_db.rollback()
-        logger.error(f"Indexing failed: {e}")
-        raise e
-    finally:
-        vector_db.close()
+    t0 = time.perf_counter()
+    # One embedding per chunk and storage space (the active one, plus any being built)
+    embeddings = embedding_spaces.embed_chunks([text_content for text_content, _ in chunks])
+    INGEST_EMBEDDINGS.inc(sum(len(vectors) for vectors in embeddings.values()))
+    store_chunks(doc_id, chunks, embeddings)
+    INGEST_STAGE_SECONDS.labels("embed_and_store").observe(time.perf_counter() - t0)
+    logger.info(f"Indexed {len(chunks)} chunks to Vector DB.")
 
     return doc.export_to_markdown() # Return full text/markdown for MS SQL if needed
 
-def retrieve_relevant_chunks(query: str, doc_ids: list[str], top_k: int = 5) -> list[dict]:
+def reindex_document(file_path: str, doc_id: str, content_hash: str = None) -> int:
     """
-    Retrieve relevant chunks from the Vector DB for a given query and set of document IDs.
+    Re-chunks and re-embeds a document, replacing its chunks atomically.
+    The converted document comes from the Docling cache, so OCR/layout analysis
+    only runs again if the cache has no entry for the current pipeline profile.
+    Returns the number of chunks written.
     """
-    if not VectorSessionLocal or not doc_ids:
-        return []
-
-    vector_db = VectorSessionLocal()
-    try:
-        if not query or not query.strip():
-            logger.info("Empty query for retrieval. Skipping.")
-            return []
-
-        query_embedding = get_embedding(query)
-        
-        # PGVector search: Use L2 distance (or cosine if normalized)
-        # Using l2_distance operator <->
-        results = vector_db.query(DocumentChunk).filter(
-            DocumentChunk.doc_id.in_(doc_ids)
-        ).order_by(
-            DocumentChunk.embedding.l2_distance(query_embedding)
-        ).limit(top_k).all()
-        
-        return [
-            {
-                "text": chunk.text,
-                "doc_id": chunk.doc_id,
-                "val_score": 0.0, # Placeholder or actual distance if we can get it
-                "meta": json.loads(chunk.metadata_json) if chunk.metadata_json else {}
-            }
-            for chunk in results
-        ]
-    except Exception as e:
-        logger.error(f"Retrieval failed: {e}")
-        return []
-    finally:
-        vector_db.close()
-
-def delete_document_chunks(doc_id: str):
-    """
-    Deletes all chunks associated with a specific doc_id from the Vector DB.
-    """
-    if not VectorSessionLocal:
-        logger.warning("Vector DB not configured. Skipping deletion.")
-        return
-
-    vector_db = VectorSessionLocal()
-    try:
-        # Delete chunks with matching doc_id
-        # Note: Depending on your vector DB/ORM, this might need adjustment.
-        # For PGVector with SQLAlchemy:
-        deleted_count = vector_db.query(DocumentChunk).filter(DocumentChunk.doc_id == doc_id).delete()
-        vector_db.commit()
-        logger.info(f"Deleted {deleted_count} chunks for doc_id: {doc_id}")
-    except Exception as e:
-        vector_db.rollback()
-        logger.error(f"Deletion failed for doc_id {doc_id}: {e}")
-        raise e
-    finally:
-        vector_db.close()
+    t0 = time.perf_counter()
+    doc = get_docling_document(file_path, content_hash)
+    INGEST_STAGE_SECONDS.labels("load").observe(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    chunks = chunk_document(doc)
+    INGEST_STAGE_SECONDS.labels("chunk").observe(time.perf_counter() - t0)
+    INGEST_CHUNKS.inc(len(chunks))
+
+    t0 = time.perf_counter()
+    embeddings = embedding_spaces.embed_chunks([text_content for text_content, _ in chunks])
+    INGEST_EMBEDDINGS.inc(sum(len(vectors) for vectors in embeddings.values()))
+    store_chunks(doc_id, chunks, embeddings, replace=True)
+    INGEST_STAGE_SECONDS.labels("embed_and_store").observe(time.perf_counter() - t0)
+    logger.info(f"Re-indexed doc_id {doc_id}: {len(chunks)} chunks.")
+    return len(chunks)
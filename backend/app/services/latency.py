@@ -0,0 +1,108 @@
+"""
+Per-turn latency breakdown for chat messages.
+
+A LatencyTracker is created when a message arrives, collects the backend's own
+stage timings plus Ollama's timing fields from the final `done` frame, and is
+stored as JSON on the assistant Message and exported as histograms.
+"""
+import json
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from app.core import metrics
+
+STAGE_SECONDS = metrics.histogram(
+    "chat_stage_duration_seconds",
+    "Duration of each stage of a chat turn.",
+    labelnames=("stage",),
+)
+TIME_TO_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "chat_time_to_first_token_seconds",
+    "Time from message receipt to the first streamed token.",
+    labelnames=("model",),
+)
+DECODE_TOKENS_PER_SECOND = metrics.histogram(
+    "chat_decode_tokens_per_second",
+    "Ollama decode throughput per chat turn.",
+    labelnames=("model",),
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 100, 150, 200),
+)
+
+# Ollama reports durations in nanoseconds
+_OLLAMA_DURATIONS = {
+    "load_duration": "model_load",
+    "prompt_eval_duration": "prefill",
+    "eval_duration": "decode",
+    "total_duration": "ollama_total",
+}
+
+
+class LatencyTracker:
+    def __init__(self, model: str):
+        self.model = model
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {} # stage -> seconds
+        self.ttft: Optional[float] = None
+        self.ollama: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float):
+        """Adds seconds to a stage (stages hit several times accumulate)."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def add_ollama_stats(self, stats: Dict):
+        """Takes the timing fields of Ollama's final `done` frame."""
+        for key in ("total_duration", "load_duration", "prompt_eval_count",
+                    "prompt_eval_duration", "eval_count", "eval_duration"):
+            if stats.get(key) is not None:
+                self.ollama[key] = stats[key]
+        for key, stage in _OLLAMA_DURATIONS.items():
+            if key in self.ollama:
+                self.stages[stage] = self.ollama[key] / 1e9
+
+    @property
+    def decode_tokens_per_second(self) -> Optional[float]:
+        eval_count = self.ollama.get("eval_count")
+        eval_duration = self.ollama.get("eval_duration")
+        if not eval_count or not eval_duration:
+            return None
+        return eval_count / (eval_duration / 1e9)
+
+    def to_dict(self) -> Dict:
+        data = {f"{stage}_ms": round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        if self.ttft is not None:
+            data["ttft_ms"] = round(self.ttft * 1000, 1)
+        if "prompt_eval_count" in self.ollama:
+            data["prompt_tokens"] = self.ollama["prompt_eval_count"]
+        if "eval_count" in self.ollama:
+            data["completion_tokens"] = self.ollama["eval_count"]
+        tps = self.decode_tokens_per_second
+        if tps is not None:
+            data["decode_tokens_per_s"] = round(tps, 2)
+        data["total_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return data
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def observe(self):
+        """Exports the breakdown to the histograms."""
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.labels(stage).observe(seconds)
+        if self.ttft is not None:
+            TIME_TO_FIRST_TOKEN_SECONDS.labels(self.model).observe(self.ttft)
+        tps = self.decode_tokens_per_second
+        if tps is not None:
+            DECODE_TOKENS_PER_SECOND.labels(self.model).observe(tps)
@@ -1,7 +1,15 @@
+import asyncio
 import httpx
 import json
+import random
+import re
+from collections import OrderedDict
 from typing import List, Dict, AsyncGenerator
 from app.core.config import settings
+from app.core import metrics
+from app.core.shared_state import shared_state
+from app.services.scheduler import llm_scheduler, Priority
+from app import utils_json
 import logging
 
 # Configure Logging
@@ -9,7 +17,10 @@ logger = logging.getLogger(__name__)
 
 OLLAMA_URL = settings.OLLAMA_BASE_URL
 
+QUERY_REWRITES = metrics.counter("query_rewrite_total", "Search query generation by path.", ("path",))
+
 async def check_ollama_connection():
+    """Probes the primary backend (falling back to the local one) and shares the choice with other workers."""
     global OLLAMA_URL
     primary_url = settings.OLLAMA_BASE_URL
     local_url = settings.OLLAMA_BASE_URL_LOCAL
@@ -21,30 +32,88 @@ async def check_ollama_connection():
             if response.status_code == 200:
                 OLLAMA_URL = primary_url
                 logger.info(f"✅ Primary Ollama ({primary_url}) is ONLINE. Using primary.")
+                shared_state.set("ollama_backend", {"url": OLLAMA_URL})
                 return
     except Exception as e:
         logger.warning(f"⚠️ Primary Ollama unavailable ({str(e)}).")
 
     logger.info(f"🔄 Switching to Local Ollama at: {local_url}...")
     OLLAMA_URL = local_url
+    shared_state.set("ollama_backend", {"url": OLLAMA_URL})
+
+async def refresh_ollama_backend():
+    """
+    Adopts the backend another worker checked within OLLAMA_HEALTH_TTL_SECONDS;
+    probes only when that shared result is stale (so N workers do not all probe).
+    """
+    global OLLAMA_URL
+    backend = shared_state.get("ollama_backend", max_age=settings.OLLAMA_HEALTH_TTL_SECONDS)
+    if backend:
+        if backend["url"] != OLLAMA_URL:
+            logger.info(f"Using Ollama backend {backend['url']} (shared health check).")
+        OLLAMA_URL = backend["url"]
+        return
+    await check_ollama_connection()
+
+async def monitor_ollama_backend():
+    """Keeps OLLAMA_URL current for the life of the process (fails over to the local backend and back)."""
+    while True:
+        await asyncio.sleep(settings.OLLAMA_HEALTH_TTL_SECONDS)
+        try:
+            await refresh_ollama_backend()
+        except Exception as e:
+            logger.error(f"Ollama health check failed: {e}")
 
 async def list_local_models() -> List[Dict]:
     """
-    Fetch list of available models from Ollama.
+    Fetch list of available models from Ollama (shared between workers for MODEL_LIST_TTL_SECONDS).
     """
+    cache_key = f"ollama_models:{OLLAMA_URL}"
+    cached = shared_state.get(cache_key, max_age=settings.MODEL_LIST_TTL_SECONDS)
+    metrics.record_cache("ollama_models", cached is not None)
+    if cached is not None:
+        return cached
     async with httpx.AsyncClient() as client:
         try:
             response = await client.get(f"{OLLAMA_URL}/api/tags")
             response.raise_for_status()
             data = response.json()
-            return data.get("models", [])
+            models = data.get("models", [])
+            shared_state.set(cache_key, models)
+            return models
         except Exception as e:
             logger.error(f"Error fetching models: {e}")
             return []
 
+def supports_thinking(model: str) -> bool:
+    """False once any worker has seen Ollama reject "think" for the model."""
+    return not shared_state.get(f"no_think:{model}", max_age=settings.MODEL_CAPABILITY_TTL_SECONDS)
+
+
+def log_payload(payload: Dict):
+    """
+    Logs a preview of a chat payload (each message truncated to 500 chars).
+    """
+    logger.info("--- Stream Chat Payload Debug ---")
+    for key, value in payload.items():
+        if key == "messages" and isinstance(value, list):
+            logger.info(f"Key: {key} (List with {len(value)} items):")
+            for i, msg in enumerate(value):
+                role = msg.get('role', 'unknown')
+                content = str(msg.get('content', ''))
+                logger.info(f"  [{i}] Role: {role}, Content: {content[:500]}...")
+        else:
+            val_str = str(value)
+            logger.info(f"Key: {key}, Value: {val_str[:500]}...")
+    logger.info("---------------------------------")
+
 
 # Reworking generator for robustness using line iteration
 async def stream_chat(model: str, messages: List[Dict], enable_think: bool = False) -> AsyncGenerator[Dict[str, str], None]:
+    """
+    Streams a chat completion as {"type": "think"|"content", "content": "..."} chunks,
+    followed by one {"type": "stats", "stats": {...}} chunk with Ollama's timing fields.
+    """
     url = f"{OLLAMA_URL}/api/chat"
     
     # 1. Prepare initial payload
@@ -58,23 +127,13 @@ async def stream_chat(model: str, messages: List[Dict], enable_think: bool = Fal
     # But if the user WANTS to support reasoning models automatically, we should defaults to True *but fallback*.
     # If user explicitly requested thinking, enable it.
     
-    use_thinking = enable_think
-    if enable_think:
+    use_thinking = enable_think and supports_thinking(model)
+    if use_thinking:
          payload["think"] = True
 
-    # Debug: Log payload preview (User Request)
-    logger.info("--- Stream Chat Payload Debug ---")
-    for key, value in payload.items():
-        if key == "messages" and isinstance(value, list):
-            logger.info(f"Key: {key} (List with {len(value)} items):")
-            for i, msg in enumerate(value):
-                role = msg.get('role', 'unknown')
-                content = str(msg.get('content', ''))
-                logger.info(f"  [{i}] Role: {role}, Content: {content[:500]}...")
-        else:
-            val_str = str(value)
-            logger.info(f"Key: {key}, Value: {val_str[:500]}...")
-    logger.info("---------------------------------")
+    # Debug: Log payload preview (optional and sampled, it is expensive for long prompts)
+    if settings.LOG_OLLAMA_PAYLOADS and random.random() < settings.LOG_OLLAMA_PAYLOAD_SAMPLE_RATE:
+        log_payload(payload)
 
     async with httpx.AsyncClient(timeout=120.0) as client:
         should_retry_without_think = False
@@ -93,6 +152,7 @@ async def stream_chat(model: str, messages: List[Dict], enable_think: bool = Fal
                         
                     if "does not support thinking" in err_msg:
                         logger.info(f"Model '{model}' does not support thinking. Retrying without 'think' param.")
+                        shared_state.set(f"no_think:{model}", True)
                         should_retry_without_think = True
                     else:
                         raise Exception(f"Ollama Error ({response.status_code}): {err_msg}")
@@ -105,7 +165,7 @@ async def stream_chat(model: str, messages: List[Dict], enable_think: bool = Fal
                     async for line in response.aiter_lines():
                         if line:
                             try:
-                                data = json.loads(line)
+                                data = utils_json.loads(line)
                                 if 'error' in data:
                                      raise Exception(f"Ollama Stream Error: {data['error']}")
                                      
@@ -120,8 +180,10 @@ async def stream_chat(model: str, messages: List[Dict], enable_think: bool = Fal
                                         yield {"type": "content", "content": val_content}
 
                                 if data.get('done', False):
+                                    # Final frame carries Ollama's timing fields
+                                    yield {"type": "stats", "content": "", "stats": data}
                                     break
-                            except json.JSONDecodeError:
+                            except utils_json.JSONDecodeError:
                                 continue
         except httpx.ConnectError as e:
              raise Exception(f"Could not connect to Ollama: {e}")
@@ -137,7 +199,7 @@ async def stream_chat(model: str, messages: List[Dict], enable_think: bool = Fal
                 async for line in response.aiter_lines():
                         if line:
                             try:
-                                data = json.loads(line)
+                                data = utils_json.loads(line)
                                 if 'error' in data:
                                      raise Exception(f"Ollama Stream Error: {data['error']}")
 
@@ -149,47 +211,123 @@ async def stream_chat(model: str, messages: List[Dict], enable_think: bool = Fal
                                         yield {"type": "content", "content": val_content}
 
                                 if data.get('done', False):
+                                    # Final frame carries Ollama's timing fields
+                                    yield {"type": "stats", "content": "", "stats": data}
                                     break
-                            except json.JSONDecodeError:
+                            except utils_json.JSONDecodeError:
                                 continue
 
-async def generate_search_query(model: str, user_query: str) -> str:
+async def chat_completion(model: str, messages: List[Dict], options: Dict = None, timeout: float = 300.0,
+                          keep_alive: str = None) -> str:
+    """
+    Non-streaming chat call; returns the assistant content.
+    `options` are passed to Ollama as-is (e.g. {"num_predict": 64, "temperature": 0}).
+    `keep_alive` (e.g. "30m") keeps the model loaded after the call.
+    Callers are responsible for holding a scheduler ticket.
+    """
+    payload = {"model": model, "messages": messages, "stream": False}
+    if options:
+        payload["options"] = options
+    if keep_alive:
+        payload["keep_alive"] = keep_alive
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        try:
+            response = await client.post(f"{OLLAMA_URL}/api/chat", json=payload)
+        except httpx.ConnectError as e:
+            raise Exception(f"Could not connect to Ollama: {e}")
+        if response.status_code != 200:
+            raise Exception(f"Ollama Error ({response.status_code}): {response.text}")
+        data = utils_json.loads(response.content)
+        return data.get("message", {}).get("content", "")
+
+# --- Search query rewrite ---
+
+QUERY_REWRITE_PROMPT = ("Generate a single, concise web search query for the user's request. "
+                        "Return ONLY the query text, no quotes or explanations.")
+
+# Words that mark a conversational request rather than a keyword query
+_CONVERSATIONAL_WORDS = {
+    "i", "me", "my", "we", "our", "you", "your", "please", "can", "could", "would", "should",
+    "tell", "explain", "help", "this", "that", "it", "above", "previous",
+}
+
+_rewrite_cache: "OrderedDict[tuple, str]" = OrderedDict()
+
+def query_rewrite_model(chat_model: str) -> str:
+    """The dedicated rewrite model when configured, else the chat model."""
+    return settings.QUERY_REWRITE_MODEL or chat_model
+
+def is_keyword_query(query: str) -> bool:
+    """Short single-line queries without conversational words are searched as they are."""
+    if "\n" in query.strip():
+        return False
+    words = re.findall(r"[\w'-]+", query.lower())
+    return 0 < len(words) <= settings.QUERY_REWRITE_BYPASS_WORDS and not _CONVERSATIONAL_WORDS.intersection(words)
+
+def _clean_query(text: str) -> str:
+    lines = [line.strip() for line in text.strip().splitlines() if line.strip()]
+    query = lines[0] if lines else ""
+    query = re.sub(r"^(search query|query)\s*:\s*", "", query, flags=re.IGNORECASE)
+    return query.strip().strip("\"'`").strip()[:200]
+
+async def generate_search_query(model: str, user_query: str, user_key: str = "anonymous", chat_key: str = "default") -> str:
     """
     Generate a concise search query based on the user's prompt.
+    Keyword-like prompts are used as they are; otherwise a non-streaming call to the
+    query-rewrite model (QUERY_REWRITE_MODEL, kept loaded via keep_alive; falls back to the
+    chat model) with a small num_predict. Recent rewrites are cached.
+    Runs at QUERY_REWRITE priority; it is part of an already admitted turn, so it is never shed.
+    If the rewrite fails, the user's prompt is searched as is.
     """
+    if is_keyword_query(user_query):
+        QUERY_REWRITES.labels("bypass").inc()
+        return user_query.strip().rstrip("?.!")
+
+    model = query_rewrite_model(model)
+    key = (model, " ".join(user_query.lower().split()))
+    cached = _rewrite_cache.get(key)
+    metrics.record_cache("query_rewrite", cached is not None)
+    if cached is not None:
+        _rewrite_cache.move_to_end(key)
+        QUERY_REWRITES.labels("cache").inc()
+        return cached
+
     messages = [
-        {"role": "system", "content": "You are a helpfull assistant. Generate a single, concise web search query for the user's request. Return ONLY the query text, no quotes or explanations."},
+        {"role": "system", "content": QUERY_REWRITE_PROMPT},
         {"role": "user", "content": user_query}
     ]
-    # Non-streaming call
-    full_resp = ""
-    async for chunk_data in stream_chat(model, messages, enable_think=False):
-        if chunk_data["type"] == "content":
-            full_resp += chunk_data["content"]
-    return full_resp.strip()
-
-async def execute_web_search(query: str) -> str:
-    """
-    Execute web search using Ollama Web Search API (as per user requirements).
-    """
-    if not settings.OLLAMA_WEB_SEARCH_KEY:
-        return "Error: OLLAMA_WEB_SEARCH_KEY not configured."
-    
-    url = "https://ollama.com/api/web_search"
-    headers = {
-        "Authorization": f"Bearer {settings.OLLAMA_WEB_SEARCH_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {"query": query}
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            if response.status_code == 200:
-                # Assuming response format, usually "results" list
-                # Return a summary string
-                return response.text 
-            else:
-                return f"Web search failed: {response.status_code} {response.text}"
-        except Exception as e:
-            return f"Web search error: {str(e)}"
+    try:
+        ticket = llm_scheduler.submit(model, OLLAMA_URL, user_key, chat_key, Priority.QUERY_REWRITE, shed=False)
+        async with ticket:
+            response = await chat_completion(
+                model, messages,
+                options={"num_predict": settings.QUERY_REWRITE_MAX_TOKENS, "temperature": 0},
+                timeout=settings.QUERY_REWRITE_TIMEOUT_SECONDS,
+                keep_alive=settings.QUERY_REWRITE_KEEP_ALIVE if settings.QUERY_REWRITE_MODEL else None
+            )
+        query = _clean_query(response)
+    except Exception as e:
+        logger.warning(f"Search query rewrite failed, using the prompt as is: {e}")
+        query = ""
+    if not query:
+        QUERY_REWRITES.labels("fallback").inc()
+        return " ".join(user_query.split())[:200]
+
+    QUERY_REWRITES.labels("llm").inc()
+    _rewrite_cache[key] = query
+    while len(_rewrite_cache) > settings.QUERY_REWRITE_CACHE_SIZE:
+        _rewrite_cache.popitem(last=False)
+    return query
+
+async def warm_query_rewrite_model():
+    """Loads QUERY_REWRITE_MODEL at startup so the first web-search turn does not wait for it."""
+    if not settings.QUERY_REWRITE_MODEL:
+        return
+    try:
+        async with httpx.AsyncClient(timeout=120.0) as client:
+            await client.post(f"{OLLAMA_URL}/api/generate", json={
+                "model": settings.QUERY_REWRITE_MODEL, "keep_alive": settings.QUERY_REWRITE_KEEP_ALIVE
+            })
+        logger.info(f"Query rewrite model {settings.QUERY_REWRITE_MODEL} loaded.")
+    except Exception as e:
+        logger.warning(f"Could not preload query rewrite model {settings.QUERY_REWRITE_MODEL}: {e}")
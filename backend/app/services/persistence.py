@@ -0,0 +1,237 @@
+"""
+Persistence helpers for the streaming chat pipeline.
+
+- run_unit_of_work: runs a function against a fresh MSSQL session in a worker
+  thread and commits once, so the event loop never waits on the database.
+- ChatTurnWriter: collects the writes of one chat turn (contexts, augmented
+  prompt, assistant reply) and flushes them as a single transaction.
+- WriteBehindQueue: a background thread that applies queued units of work in
+  order, batching several into one commit, so saving never delays tokens.
+  Readers that must see a chat's own writes (history, rolling summary) call
+  write_behind.wait_for(chat_id) first.
+"""
+import asyncio
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import sql_models as models
+from app.services.blob_store import blob_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Work = Callable[[Session], None]
+
+WRITE_BEHIND_DEPTH = metrics.gauge("db_write_behind_queue_depth", "Units of work waiting in the write-behind queue.")
+WRITE_BEHIND_SECONDS = metrics.histogram(
+    "db_write_behind_batch_seconds", "Time to apply and commit one write-behind batch.")
+WRITE_BEHIND_FAILURES = metrics.counter("db_write_behind_failures_total", "Units of work that failed to persist.")
+
+
+def run_in_session(work: Callable[[Session], T]) -> T:
+    """Runs work(db) in its own session and commits once (rolls back on error)."""
+    db = SessionLocal()
+    try:
+        result = work(db)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_unit_of_work(work: Callable[[Session], T]) -> T:
+    """run_in_session in a worker thread, off the event loop."""
+    return await asyncio.to_thread(run_in_session, work)
+
+
+class WriteBehindQueue:
+    _STOP = object()
+
+    def __init__(self, max_batch: int = 50):
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pending: Dict[Hashable, int] = {} # key -> queued units not yet applied
+        self._applied = threading.Condition()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Drains pending work and stops the worker."""
+        if not self._thread:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, work: Work, key: Optional[Hashable] = None):
+        """Queues a unit of work; `key` (e.g. the chat id) lets readers wait_for() it."""
+        if not self._thread or not self._thread.is_alive():
+            # Not started (e.g. scripts): apply synchronously rather than dropping the write
+            self._apply([work])
+            return
+        if key is not None:
+            with self._applied:
+                self._pending[key] = self._pending.get(key, 0) + 1
+        self._queue.put((work, key))
+        WRITE_BEHIND_DEPTH.inc()
+
+    def wait_for(self, key: Hashable, timeout: float = 5.0) -> bool:
+        """
+        Blocks until all units queued under `key` are applied (or timeout).
+        Call from worker threads only. Returns False on timeout.
+        """
+        with self._applied:
+            return self._applied.wait_for(lambda: not self._pending.get(key), timeout)
+
+    def _mark_applied(self, keys: List[Hashable]):
+        with self._applied:
+            for key in keys:
+                if key is None:
+                    continue
+                self._pending[key] -= 1
+                if not self._pending[key]:
+                    del self._pending[key]
+            self._applied.notify_all()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch: List[Tuple[Work, Optional[Hashable]]] = []
+            stop = item is self._STOP
+            if not stop:
+                batch.append(item)
+            # Drain whatever else is ready into the same transaction
+            while not stop and len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                WRITE_BEHIND_DEPTH.dec(len(batch))
+                try:
+                    self._apply([work for work, _ in batch])
+                finally:
+                    self._mark_applied([key for _, key in batch])
+            if stop:
+                return
+
+    def _apply(self, batch: List[Work]):
+        start = time.perf_counter()
+        try:
+            def apply_all(db: Session):
+                for work in batch:
+                    work(db)
+            run_in_session(apply_all)
+        except Exception as e:
+            if len(batch) == 1:
+                WRITE_BEHIND_FAILURES.inc()
+                logger.error(f"Write-behind failed: {e}")
+            else:
+                # Retry one by one so a single bad unit does not lose the others
+                logger.warning(f"Write-behind batch of {len(batch)} failed ({e}); retrying individually.")
+                for work in batch:
+                    self._apply([work])
+        finally:
+            WRITE_BEHIND_SECONDS.observe(time.perf_counter() - start)
+
+
+write_behind = WriteBehindQueue()
+
+
+class ChatTurnWriter:
+    """
+    Collects the writes of one chat turn. flush() hands everything collected so far
+    to the write-behind queue as one unit of work (one transaction).
+    """
+
+    def __init__(self, chat_id: int, user_msg_id: int):
+        self.chat_id = chat_id
+        self.user_msg_id = user_msg_id
+        self._contexts: List[dict] = []
+        self._augmented_content: Optional[str] = None
+        self._assistant: Optional[dict] = None
+
+    def add_context(self, document_name: str, content: Optional[str], document_id: Optional[str] = None,
+                    chunk_id: Optional[int] = None, score: Optional[float] = None,
+                    chunk_index: Optional[int] = None, chunk_index_end: Optional[int] = None):
+        """
+        Pass content=None with document_id + chunk_index to record only a reference to the
+        vector chunk, or to the window chunk_index..chunk_index_end (chunk_id is kept as
+        well, but changes when the document is re-indexed).
+        """
+        self._contexts.append({
+            "message_id": self.user_msg_id,
+            "document_id": document_id,
+            "document_name": document_name,
+            "content": content,
+            "content_digest": None,
+            "chunk_id": chunk_id,
+            "chunk_index": chunk_index,
+            "chunk_index_end": chunk_index_end,
+            "score": score,
+            "is_active": True,
+        })
+
+    def set_augmented_content(self, content: str):
+        self._augmented_content = content
+
+    def set_assistant_message(self, content: str, thinking_process: Optional[str],
+                              model_used: Optional[str], latency_json: Optional[str] = None,
+                              routing_reason: Optional[str] = None):
+        self._assistant = {
+            "chat_id": self.chat_id,
+            "role": "assistant",
+            "content": content,
+            "thinking_process": thinking_process,
+            "model_used": model_used,
+            "latency_json": latency_json,
+            "routing_reason": routing_reason,
+        }
+
+    def flush(self):
+        contexts, augmented, assistant = self._contexts, self._augmented_content, self._assistant
+        self._contexts, self._augmented_content, self._assistant = [], None, None
+        if not contexts and augmented is None and assistant is None:
+            return
+        chat_id, user_msg_id = self.chat_id, self.user_msg_id
+
+        def work(db: Session):
+            if contexts:
+                if settings.BLOB_STORE_ENABLED:
+                    # Snippets go to the content-addressed store; rows keep only the digest
+                    for ctx in contexts:
+                        if ctx["content"] is not None:
+                            ctx["content_digest"] = blob_store.put(ctx["content"])
+                            ctx["content"] = None
+                db.bulk_insert_mappings(models.MessageContext, contexts)
+            if augmented is not None:
+                db.execute(update(models.Message).where(models.Message.id == user_msg_id)
+                           .values(augmented_content=augmented))
+            if assistant is not None:
+                db.add(models.Message(**assistant))
+                db.execute(update(models.Chat).where(models.Chat.id == chat_id)
+                           .values(updated_at=datetime.utcnow()))
+
+        write_behind.submit(work, key=chat_id)
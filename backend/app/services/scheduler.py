@@ -0,0 +1,376 @@
+"""
+Admission control and fair scheduling for Ollama requests.
+
+Every LLM call takes a Ticket from the scheduler before it talks to Ollama.
+Tickets are granted when both the backend (Ollama URL) and the model have a
+free slot. Waiting tickets are served by priority class first, then
+round-robin across users and, within a user, across chats, so one user
+running long summaries cannot starve everyone else.
+
+Limits and queues live in each process: under `uvicorn --workers N` each worker
+schedules its own requests. The LLM_* settings are totals for the deployment and
+from_settings() gives every process an API_WORKERS share of them (rounded down,
+at least 1), so set API_WORKERS to N. The scheduler metrics are per process too.
+
+Chat turns are admitted (admit()) before their context preparation and only
+queue their ticket afterwards; admitted turns count towards the queue depth
+in the meantime, so a burst is shed at the door and not after the prep work.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from app.core.config import settings
+from app.core import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Priority classes, lower value is served first."""
+    INTERACTIVE = 0     # User-facing chat turns
+    QUERY_REWRITE = 1   # Search-query generation for web search
+    BACKGROUND = 2      # Summarization and other batch work
+
+
+class QueueFullError(Exception):
+    """Raised when the queue is too deep to accept another request."""
+
+    def __init__(self, depth: int, retry_after: int):
+        super().__init__(f"LLM queue is full ({depth} requests waiting). Please retry shortly.")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    A single request waiting for (or holding) an LLM slot.
+    Use `async for position in ticket.wait()` to follow the queue position,
+    or `async with ticket` to just wait. Always call release() when done.
+    """
+
+    def __init__(self, scheduler: "LLMScheduler", model: str, backend: str,
+                 user_key: str, chat_key: str, priority: Priority):
+        self.scheduler = scheduler
+        self.model = model
+        self.backend = backend
+        self.user_key = user_key
+        self.chat_key = chat_key
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._changed = asyncio.Event()
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+    @property
+    def wait_seconds(self) -> float:
+        """Time spent in the queue (so far, if still waiting)."""
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    async def wait(self) -> AsyncIterator[int]:
+        """Yields the 1-based queue position whenever it changes, until the slot is granted."""
+        last_position = None
+        while not self.granted:
+            position = self.scheduler.position(self)
+            if position != last_position:
+                last_position = position
+                yield position
+            self._changed.clear()
+            if self.granted:
+                break
+            await self._changed.wait()
+
+    def release(self):
+        self.scheduler.release(self)
+
+    async def __aenter__(self) -> "Ticket":
+        try:
+            async for _ in self.wait():
+                pass
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class Admission:
+    """
+    A turn admitted by the scheduler that has not queued its ticket yet (context
+    preparation). It counts towards the queue depth until submit() or release().
+    """
+
+    def __init__(self, scheduler: "LLMScheduler"):
+        self.scheduler = scheduler
+        self.active = True
+
+    def submit(self, model: str, backend: str, user_key: str = "anonymous",
+               chat_key: str = "default", priority: Priority = Priority.INTERACTIVE) -> Ticket:
+        """Turns the admission into a queued ticket (never shed, the turn was already admitted)."""
+        self.release()
+        return self.scheduler.submit(model, backend, user_key, chat_key, priority, shed=False)
+
+    def release(self):
+        if self.active:
+            self.active = False
+            self.scheduler._admitted -= 1
+
+    def __del__(self):
+        # A response generator that never started (client gone) must not leak its admission
+        self.release()
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        backend_limit: int,
+        model_limit: int,
+        backend_limits: Optional[Dict[str, int]] = None,
+        model_limits: Optional[Dict[str, int]] = None,
+        max_queue_depth: int = 64,
+        retry_after: int = 5,
+    ):
+        self.backend_limit = backend_limit
+        self.model_limit = model_limit
+        self.backend_limits = backend_limits or {}
+        self.model_limits = model_limits or {}
+        self.max_queue_depth = max_queue_depth
+        self.retry_after = retry_after
+
+        # priority -> user -> chat -> FIFO of waiting tickets
+        self._queues: Dict[Priority, "OrderedDict[str, OrderedDict[str, Deque[Ticket]]]"] = {
+            p: OrderedDict() for p in Priority
+        }
+        self._depth = 0
+        self._admitted = 0 # Admitted turns still preparing context (no ticket yet)
+        self._running_by_backend: Dict[str, int] = {}
+        self._running_by_model: Dict[tuple, int] = {}
+
+    @classmethod
+    def from_settings(cls) -> "LLMScheduler":
+        """A scheduler enforcing this process's share of the configured (deployment-wide) limits."""
+        workers = max(1, settings.API_WORKERS)
+
+        def share(limit: int) -> int:
+            return max(1, limit // workers)
+        return cls(
+            backend_limit=share(settings.LLM_MAX_CONCURRENT),
+            model_limit=share(settings.LLM_MAX_CONCURRENT_PER_MODEL),
+            backend_limits={url: share(limit) for url, limit in settings.LLM_BACKEND_CONCURRENCY.items()},
+            model_limits={model: share(limit) for model, limit in settings.LLM_MODEL_CONCURRENCY.items()},
+            max_queue_depth=share(settings.LLM_MAX_QUEUE_DEPTH),
+            retry_after=settings.LLM_RETRY_AFTER_SECONDS,
+        )
+
+    # --- Introspection ---
+
+    @property
+    def depth(self) -> int:
+        """Number of tickets waiting for a slot."""
+        return self._depth
+
+    @property
+    def admitted(self) -> int:
+        """Number of admitted turns that have not queued their ticket yet."""
+        return self._admitted
+
+    @property
+    def running(self) -> int:
+        """Number of tickets currently holding a slot."""
+        return sum(self._running_by_backend.values())
+
+    # --- Admission ---
+
+    def check_admission(self):
+        """Raises QueueFullError if a new interactive request should be shed."""
+        pending = self._depth + self._admitted
+        if pending >= self.max_queue_depth:
+            raise QueueFullError(pending, self.retry_after)
+
+    def admit(self) -> Admission:
+        """
+        Admits a turn (or raises QueueFullError). Hold the Admission through context
+        preparation, then queue with admission.submit(); release() it if the turn ends early.
+        """
+        self.check_admission()
+        self._admitted += 1
+        return Admission(self)
+
+    def submit(
+        self,
+        model: str,
+        backend: str,
+        user_key: str = "anonymous",
+        chat_key: str = "default",
+        priority: Priority = Priority.INTERACTIVE,
+        shed: bool = True,
+    ) -> Ticket:
+        """
+        Enqueue a request and return its Ticket.
+        With shed=True the request is rejected (QueueFullError) when the queue is too deep;
+        sub-steps of an already admitted turn should pass shed=False.
+        """
+        if shed:
+            self.check_admission()
+
+        ticket = Ticket(self, model, backend, user_key, chat_key, priority)
+        users = self._queues[priority]
+        chats = users.setdefault(user_key, OrderedDict())
+        chats.setdefault(chat_key, deque()).append(ticket)
+        self._depth += 1
+        self._dispatch()
+        return ticket
+
+    def release(self, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted:
+            self._running_by_backend[ticket.backend] -= 1
+            self._running_by_model[(ticket.backend, ticket.model)] -= 1
+        else:
+            self._remove_waiting(ticket)
+        self._dispatch()
+
+    # --- Internals ---
+
+    def _limit_for_backend(self, backend: str) -> int:
+        return self.backend_limits.get(backend, self.backend_limit)
+
+    def _limit_for_model(self, model: str) -> int:
+        return self.model_limits.get(model, self.model_limit)
+
+    def _has_capacity(self, ticket: Ticket) -> bool:
+        return (
+            self._running_by_backend.get(ticket.backend, 0) < self._limit_for_backend(ticket.backend)
+            and self._running_by_model.get((ticket.backend, ticket.model), 0) < self._limit_for_model(ticket.model)
+        )
+
+    def _remove_waiting(self, ticket: Ticket):
+        users = self._queues[ticket.priority]
+        chats = users.get(ticket.user_key)
+        if not chats or ticket.chat_key not in chats:
+            return
+        queue = chats[ticket.chat_key]
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        self._depth -= 1
+        if not queue:
+            del chats[ticket.chat_key]
+        if not chats:
+            del users[ticket.user_key]
+
+    def _next_eligible(self, priority: Priority) -> Optional[Ticket]:
+        """Round-robin over users, then chats; returns the first head-of-line ticket with capacity."""
+        users = self._queues[priority]
+        for user_key in list(users):
+            chats = users[user_key]
+            for chat_key in list(chats):
+                queue = chats[chat_key]
+                head = queue[0]
+                if not self._has_capacity(head):
+                    continue
+                queue.popleft()
+                if queue:
+                    chats.move_to_end(chat_key)
+                else:
+                    del chats[chat_key]
+                if chats:
+                    users.move_to_end(user_key)
+                else:
+                    del users[user_key]
+                return head
+        return None
+
+    def _grant(self, ticket: Ticket):
+        self._depth -= 1
+        ticket.granted_at = time.monotonic()
+        self._running_by_backend[ticket.backend] = self._running_by_backend.get(ticket.backend, 0) + 1
+        key = (ticket.backend, ticket.model)
+        self._running_by_model[key] = self._running_by_model.get(key, 0) + 1
+        ticket._changed.set()
+
+    def _dispatch(self):
+        changed = False
+        while True:
+            ticket = None
+            for priority in Priority:
+                ticket = self._next_eligible(priority)
+                if ticket:
+                    break
+            if not ticket:
+                break
+            self._grant(ticket)
+            changed = True
+
+        if changed:
+            # Positions of everyone still waiting may have moved
+            for users in self._queues.values():
+                for chats in users.values():
+                    for queue in chats.values():
+                        for waiting in queue:
+                            waiting._changed.set()
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        Estimated 1-based queue position, simulating the round-robin order
+        (ignores tickets skipped because their model is at capacity).
+        """
+        if ticket.granted:
+            return 0
+
+        ahead = 0
+        for priority in Priority:
+            if priority >= ticket.priority:
+                break
+            for chats in self._queues[priority].values():
+                ahead += sum(len(q) for q in chats.values())
+
+        users = self._queues[ticket.priority]
+        chats = users.get(ticket.user_key)
+        if not chats or ticket.chat_key not in chats:
+            return ahead + 1
+
+        # Rank inside the user's own chats (chat round-robin)
+        chat_order = list(chats)
+        my_chat_index = chat_order.index(ticket.chat_key)
+        k = chats[ticket.chat_key].index(ticket)
+        rank_in_user = k
+        for i, chat_key in enumerate(chat_order):
+            if i == my_chat_index:
+                continue
+            turns = k + (1 if i < my_chat_index else 0)
+            rank_in_user += min(len(chats[chat_key]), turns)
+
+        # Other users get one turn per round (user round-robin)
+        user_order = list(users)
+        my_user_index = user_order.index(ticket.user_key)
+        ahead += rank_in_user
+        for i, user_key in enumerate(user_order):
+            if i == my_user_index:
+                continue
+            turns = rank_in_user + (1 if i < my_user_index else 0)
+            ahead += min(sum(len(q) for q in users[user_key].values()), turns)
+
+        return ahead + 1
+
+
+llm_scheduler = LLMScheduler.from_settings()
+
+metrics.gauge("llm_scheduler_requests", "LLM requests by scheduler state.", ("state",)).set_function(
+    lambda: {("admitted",): llm_scheduler.admitted, ("waiting",): llm_scheduler.depth,
+             ("running",): llm_scheduler.running}
+)
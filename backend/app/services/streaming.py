@@ -0,0 +1,157 @@
+"""
+Helpers for the Server-Sent Events (SSE) chat stream.
+"""
+import asyncio
+import contextlib
+from typing import AsyncGenerator, AsyncIterable, Dict
+
+from app import utils_json
+from app.core import metrics
+
+COALESCED_TYPES = ("think", "content")
+
+
+def format_sse(data: Dict) -> str:
+    """Formats a payload as a single SSE `data:` frame."""
+    return f"data: {utils_json.dumps(data)}\n\n"
+
+
+async def coalesce_chunks(
+    source: AsyncIterable[Dict[str, str]],
+    window_ms: int,
+    max_chars: int,
+) -> AsyncGenerator[Dict[str, str], None]:
+    """
+    Merges consecutive "think"/"content" chunks of the same type into larger ones;
+    other chunk types (e.g. "stats") are passed through as-is.
+    A merged chunk is emitted when the type changes, when it reaches max_chars,
+    or when window_ms has passed since its first token (even if the upstream stalls).
+    With window_ms <= 0 every chunk is passed through unchanged.
+    """
+    if window_ms <= 0:
+        async for chunk in source:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000.0
+    iterator = source.__aiter__()
+    pending = None
+    buf_type = None
+    buf = []
+    size = 0
+    deadline = 0.0
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = max(0.0, deadline - loop.time()) if buf else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Window elapsed while waiting for the next token
+                yield {"type": buf_type, "content": "".join(buf)}
+                buf, size = [], 0
+                continue
+
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            except Exception:
+                # Hand out what we already have before surfacing the upstream error
+                pending = None
+                if buf:
+                    yield {"type": buf_type, "content": "".join(buf)}
+                raise
+            pending = None
+
+            if chunk["type"] not in COALESCED_TYPES:
+                if buf:
+                    yield {"type": buf_type, "content": "".join(buf)}
+                    buf, size = [], 0
+                yield chunk
+                continue
+
+            if buf and chunk["type"] != buf_type:
+                yield {"type": buf_type, "content": "".join(buf)}
+                buf, size = [], 0
+
+            if not buf:
+                buf_type = chunk["type"]
+                deadline = loop.time() + window
+            buf.append(chunk["content"])
+            size += len(chunk["content"])
+
+            if max_chars > 0 and size >= max_chars:
+                yield {"type": buf_type, "content": "".join(buf)}
+                buf, size = [], 0
+
+        if buf:
+            yield {"type": buf_type, "content": "".join(buf)}
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            with contextlib.suppress(BaseException):
+                await pending
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+_END = object()
+
+
+async def cancel_on_disconnect(request, frames: AsyncGenerator[str, None], poll_ms: int,
+                               max_buffered: int = 32) -> AsyncGenerator[str, None]:
+    """
+    Runs the `frames` generator in its own task and forwards its output.
+    The client connection is polled every poll_ms; once it is gone the task is
+    cancelled, aborting whatever it is awaiting (Ollama stream, web search, retrieval)
+    instead of waiting for the next yield to notice.
+    At most max_buffered frames are held: a slow client makes the generator wait
+    instead of buffering the whole answer in memory.
+    """
+    loop = asyncio.get_running_loop()
+    poll_interval = poll_ms / 1000.0
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_buffered))
+
+    async def pump():
+        try:
+            async for frame in frames:
+                await queue.put(frame) # Backpressure: waits while the consumer is behind
+        finally:
+            # Never block here (cancelled while the queue is full); the consumer also
+            # stops once the task is done and the queue is drained
+            with contextlib.suppress(asyncio.QueueFull):
+                queue.put_nowait(_END)
+
+    task = asyncio.create_task(pump())
+    next_check = loop.time() + poll_interval
+    metrics.ACTIVE_STREAMS.inc()
+    try:
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), timeout=max(0.0, next_check - loop.time()))
+            except asyncio.TimeoutError:
+                frame = None
+
+            if loop.time() >= next_check:
+                if await request.is_disconnected():
+                    break
+                next_check = loop.time() + poll_interval
+
+            if frame is _END:
+                break
+            if frame is not None:
+                yield frame
+            elif task.done() and queue.empty():
+                break
+    finally:
+        metrics.ACTIVE_STREAMS.dec()
+        if not task.done():
+            task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
@@ -0,0 +1,220 @@
+"""
+Ingest-time hierarchical summaries.
+
+After a document is indexed, its chunks (in document order) are grouped into
+~SUMMARY_GROUP_CHARS sections and summarized in parallel (map), then the
+section summaries are combined level by level until one summary remains
+(reduce). Requests go through the LLM scheduler at BACKGROUND priority, so
+interactive chats always come first; SUMMARY_CONCURRENCY bounds the fan-out
+per document. Results are stored per (attachment, model) in DocumentSummaries
+and used for "summarise the attached document" turns instead of the full text.
+
+A summary belongs to the content it was built from: tasks are keyed by the
+attachment's content_hash and a result is only saved if the attachment still
+has that hash (an overwrite during the build discards it).
+"""
+import asyncio
+import json
+from typing import Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.core.database import VectorSessionLocal
+from app.core import metrics
+from app.models import sql_models as models
+from app.models.vector_models import DocumentChunk
+from app.services import ollama_service
+from app.services.persistence import run_unit_of_work
+from app.services.scheduler import Priority, llm_scheduler
+from app.utils_tokens import estimate_tokens, truncate_to_tokens
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SECONDS = metrics.histogram(
+    "document_summary_seconds", "Time to build a document summary.",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+SUMMARY_REQUESTS = metrics.counter("document_summary_llm_requests_total", "Summary LLM requests by step.", ("step",))
+
+MAP_PROMPT = ("Summarize the following section of the document '{name}'. Keep key facts, figures, "
+              "names and conclusions. Be concise.\n\n{text}")
+REDUCE_PROMPT = ("The following are summaries of consecutive sections of the document '{name}'. "
+                 "Combine them into one coherent summary that keeps the key facts.\n\n{text}")
+
+_tasks: Set[asyncio.Task] = set()
+_in_progress: Set[tuple] = set()
+
+
+def _load_chunk_texts(doc_id: str) -> List[str]:
+    if not VectorSessionLocal:
+        return []
+    vector_db = VectorSessionLocal()
+    try:
+        rows = vector_db.query(DocumentChunk.text).filter(DocumentChunk.doc_id == doc_id).order_by(
+            DocumentChunk.chunk_index, DocumentChunk.id).all()
+        return [row.text for row in rows]
+    finally:
+        vector_db.close()
+
+
+def _group(texts: List[str], max_chars: int) -> List[str]:
+    groups, current, size = [], [], 0
+    for text in texts:
+        if current and size + len(text) > max_chars:
+            groups.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(text)
+        size += len(text)
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+
+async def _summarize(model: str, prompt: str, step: str, semaphore: asyncio.Semaphore, key: str) -> str:
+    async with semaphore:
+        ticket = llm_scheduler.submit(model, ollama_service.OLLAMA_URL, "summarizer", key,
+                                      Priority.BACKGROUND, shed=False)
+        async with ticket:
+            SUMMARY_REQUESTS.labels(step).inc()
+            result = await ollama_service.chat_completion(
+                model, [{"role": "user", "content": prompt}],
+                options={"num_predict": settings.SUMMARY_MAX_TOKENS, "temperature": 0.2}
+            )
+    return result.strip()
+
+
+async def build_summary(attachment_id: int, model: Optional[str] = None,
+                        content_hash: Optional[str] = None) -> Optional[dict]:
+    """
+    Computes the summary of one attachment for `model` (None if it already exists).
+    With content_hash, only if the attachment still has that content; the summary is
+    discarded if the content changes while it is being built.
+    """
+    model = model or settings.SUMMARY_MODEL
+    loop = asyncio.get_running_loop()
+
+    def load(db):
+        att = db.query(models.Attachment.id, models.Attachment.file_name, models.Attachment.content_hash).filter(
+            models.Attachment.id == attachment_id).first()
+        existing = db.query(models.DocumentSummary.id).filter(
+            models.DocumentSummary.attachment_id == attachment_id, models.DocumentSummary.model == model).first()
+        return att, existing is not None
+    att, exists = await run_unit_of_work(load)
+    # No content_hash yet: not indexed (or being overwritten)
+    if not att or exists or not att.content_hash or (content_hash and att.content_hash != content_hash):
+        return None
+    content_hash = att.content_hash
+
+    start = loop.time()
+    texts = await asyncio.to_thread(_load_chunk_texts, str(attachment_id))
+    if not texts:
+        return None
+
+    semaphore = asyncio.Semaphore(max(1, settings.SUMMARY_CONCURRENCY))
+    key = f"doc-{attachment_id}"
+
+    # Map: one summary per section, in parallel (bounded)
+    sections = await asyncio.gather(*[
+        _summarize(model, MAP_PROMPT.format(name=att.file_name, text=group), "map", semaphore, key)
+        for group in _group(texts, settings.SUMMARY_GROUP_CHARS)
+    ])
+
+    # Reduce: combine summaries level by level until one is left
+    level = list(sections)
+    while len(level) > 1:
+        groups = _group(level, settings.SUMMARY_GROUP_CHARS)
+        if len(groups) == len(level) and len(level) > 1:
+            groups = ["\n\n".join(level[i:i + 2]) for i in range(0, len(level), 2)] # Force progress
+        level = await asyncio.gather(*[
+            _summarize(model, REDUCE_PROMPT.format(name=att.file_name, text=group), "reduce", semaphore, key)
+            for group in groups
+        ])
+    summary = level[0]
+
+    def save(db) -> bool:
+        current = db.query(models.Attachment.content_hash).filter(models.Attachment.id == attachment_id).scalar()
+        if current != content_hash:
+            return False # Overwritten while summarizing
+        if db.query(models.DocumentSummary.id).filter(
+                models.DocumentSummary.attachment_id == attachment_id,
+                models.DocumentSummary.model == model).first():
+            return False
+        db.add(models.DocumentSummary(
+            attachment_id=attachment_id, model=model, summary=summary,
+            sections_json=json.dumps(sections), chunk_count=len(texts)
+        ))
+        return True
+    if not await run_unit_of_work(save):
+        logger.info(f"Discarded summary of attachment {attachment_id}: content changed or already summarized.")
+        return None
+    SUMMARY_SECONDS.observe(loop.time() - start)
+    logger.info(f"Summarized attachment {attachment_id} with {model}: {len(sections)} sections.")
+    return {"summary": summary, "sections": sections}
+
+
+def schedule_summary(attachment_id: int, content_hash: Optional[str], model: Optional[str] = None):
+    """
+    Starts build_summary in the background (no-op if disabled or already running for this
+    content; a build for content that was overwritten since does not block it).
+    """
+    if not settings.SUMMARIZE_ON_INGEST or not content_hash:
+        return
+    key = (attachment_id, model or settings.SUMMARY_MODEL, content_hash)
+    if key in _in_progress:
+        return
+    _in_progress.add(key)
+
+    async def run():
+        try:
+            await build_summary(*key)
+        except Exception as e:
+            logger.error(f"Summary failed for attachment {attachment_id}: {e}")
+        finally:
+            _in_progress.discard(key)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _tasks.add(task) # Keep a reference until done
+    task.add_done_callback(_tasks.discard)
+
+
+def load_summaries(db, attachment_ids: List[int], model: str) -> Dict[int, models.DocumentSummary]:
+    """
+    Stored summaries per attachment, preferring `model` and falling back to any other
+    model's summary (e.g. the ingest-time SUMMARY_MODEL).
+    """
+    if not attachment_ids:
+        return {}
+    rows = db.query(models.DocumentSummary).filter(
+        models.DocumentSummary.attachment_id.in_(attachment_ids)
+    ).order_by(models.DocumentSummary.created_at).all()
+    result = {}
+    for row in rows:
+        if row.attachment_id not in result or row.model == model:
+            result[row.attachment_id] = row
+    return result
+
+
+def format_summary(file_name: str, summary: models.DocumentSummary, section_tokens: int = None) -> str:
+    """
+    The top-level summary, plus section summaries in document order while they fit
+    in section_tokens (SUMMARY_SECTION_TOKENS), so long documents keep a bounded prompt.
+    """
+    section_tokens = settings.SUMMARY_SECTION_TOKENS if section_tokens is None else section_tokens
+    sections = json.loads(summary.sections_json) if summary.sections_json else []
+    body = f"Summary:\n{summary.summary}"
+    if len(sections) > 1 and section_tokens > 0:
+        lines = []
+        used = 0
+        for i, section in enumerate(sections):
+            line = f"{i + 1}. {section}"
+            cost = estimate_tokens(line) + 1
+            if used + cost > section_tokens:
+                if not lines: # A single oversized section still gets a truncated entry
+                    lines.append(truncate_to_tokens(line, section_tokens))
+                break
+            lines.append(line)
+            used += cost
+        omitted = len(sections) - len(lines)
+        if omitted:
+            lines.append(f"({omitted} more sections omitted)")
+        body += "\n\nSection summaries:\n" + "\n".join(lines)
+    return f"\n\n--- FILE: {file_name} (precomputed summary) ---\n{body}\n--- END FILE ---\n"
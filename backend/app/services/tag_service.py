@@ -0,0 +1,170 @@
+"""
+Set-based tag handling.
+
+- ensure_tags: resolves many tag names in one query and bulk-inserts the missing ones.
+- set_chat_tags: replaces/adds/removes tags on many chats with a handful of statements.
+- tag_cache: in-memory copy of the Tags table for read_tags, invalidated on write
+  in every worker process through a version stamp in shared_state.
+"""
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.shared_state import shared_state
+from app.models import sql_models as models
+import logging
+
+logger = logging.getLogger(__name__)
+
+# MSSQL allows 2100 parameters per statement; stay well below it
+_IN_BATCH = 1000
+
+
+def normalize_tag_names(names: Iterable[str]) -> List[str]:
+    """Strips names, drops empties and duplicates (keeps first-seen order)."""
+    seen = {}
+    for name in names:
+        name = (name or "").strip()
+        if name and name not in seen:
+            seen[name] = None
+    return list(seen)
+
+
+def _chunks(items: List, size: int = _IN_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _load_by_name(db: Session, names: List[str]) -> Dict[str, models.Tag]:
+    found = {}
+    for batch in _chunks(names):
+        for tag in db.query(models.Tag).filter(models.Tag.name.in_(batch)).all():
+            found[tag.name] = tag
+    return found
+
+
+def ensure_tags(db: Session, names: Iterable[str]) -> List[models.Tag]:
+    """
+    Returns Tag rows for all names, creating the missing ones in one bulk insert.
+    A concurrent insert of the same name (unique violation) falls back to per-row
+    inserts inside savepoints, so the caller's transaction is never lost.
+    Does not commit; callers should invalidate tag_cache after committing.
+    """
+    names = normalize_tag_names(names)
+    if not names:
+        return []
+
+    found = _load_by_name(db, names)
+    missing = [name for name in names if name not in found]
+    if missing:
+        try:
+            with db.begin_nested():
+                db.execute(insert(models.Tag), [{"name": name} for name in missing])
+        except IntegrityError:
+            for name in missing:
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(models.Tag), [{"name": name}])
+                except IntegrityError:
+                    pass  # Created by someone else in the meantime
+        found.update(_load_by_name(db, missing))
+
+    return [found[name] for name in names if name in found]
+
+
+def set_chat_tags(db: Session, chat_ids: Iterable[int], names: Iterable[str], mode: str = "replace") -> List[models.Tag]:
+    """
+    Updates the tags of many chats at once.
+    mode: "replace" (chats end up with exactly these tags), "add", or "remove".
+    Does not commit.
+    """
+    chat_ids = list(dict.fromkeys(chat_ids))
+    if not chat_ids:
+        return []
+    if mode not in ("replace", "add", "remove"):
+        raise ValueError(f"Unknown tag mode: {mode}")
+
+    if mode == "remove":
+        tags = list(_load_by_name(db, normalize_tag_names(names)).values())
+    else:
+        tags = ensure_tags(db, names)
+    tag_ids = [tag.id for tag in tags]
+    link = models.chat_tags
+
+    for batch in _chunks(chat_ids):
+        if mode == "replace":
+            db.execute(delete(link).where(link.c.chat_id.in_(batch)))
+        elif tag_ids:
+            # add/remove: clear the affected pairs first (keeps add idempotent)
+            db.execute(delete(link).where(link.c.chat_id.in_(batch), link.c.tag_id.in_(tag_ids)))
+
+        if mode != "remove" and tag_ids:
+            db.execute(insert(link), [{"chat_id": chat_id, "tag_id": tag_id}
+                                      for chat_id in batch for tag_id in tag_ids])
+    return tags
+
+
+class TagCache:
+    """
+    In-memory list of all tags. A generation counter guards against a reload
+    that raced with a write storing stale rows. Writers also bump a version stamp
+    in shared_state, so other worker processes drop their copy on the next read;
+    TAG_CACHE_TTL_SECONDS bounds the staleness if the stamp cannot be read.
+    """
+
+    VERSION_KEY = "tag_cache_version"
+
+    def __init__(self):
+        self._tags: Optional[List[dict]] = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._tags = None
+            self._generation += 1
+        shared_state.set(self.VERSION_KEY, uuid.uuid4().hex)
+
+    def all(self, db: Optional[Session] = None) -> List[dict]:
+        version = shared_state.get(self.VERSION_KEY)
+        with self._lock:
+            if self._tags is not None and (self._version != version or
+                                           time.monotonic() - self._loaded_at > settings.TAG_CACHE_TTL_SECONDS):
+                self._tags = None # Invalidated by another process, or expired
+                self._generation += 1
+            tags, generation = self._tags, self._generation
+        metrics.record_cache("tags", tags is not None)
+        if tags is not None:
+            return tags
+
+        def load(session: Session) -> List[dict]:
+            rows = session.execute(select(models.Tag.id, models.Tag.name, models.Tag.color)
+                                   .order_by(models.Tag.name)).all()
+            return [{"id": row.id, "name": row.name, "color": row.color} for row in rows]
+
+        if db is not None:
+            tags = load(db)
+        else:
+            session = SessionLocal()
+            try:
+                tags = load(session)
+            finally:
+                session.close()
+
+        with self._lock:
+            if self._generation == generation:
+                self._tags, self._version, self._loaded_at = tags, version, time.monotonic()
+        return tags
+
+
+tag_cache = TagCache()
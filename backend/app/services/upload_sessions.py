@@ -0,0 +1,185 @@
+"""
+Resumable, chunked uploads.
+
+A session is a directory under UPLOAD_DIR/.sessions/<upload_id> holding a
+session.json manifest and one file per received part (<n>.part). Parts can be
+sent in any order and in parallel; each is written to a temp file and renamed,
+so a retried part simply replaces the previous attempt. complete() concatenates
+the parts into the usual date folder (hashing on the way) and removes the session.
+Sessions live on disk, so they survive API restarts.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from app.core.config import settings
+from app.services.file_service import (HashingFileWriter, SavedFile, UploadTooLargeError,
+                                       place_file, safe_file_name, upload_target_dir)
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_DIR = os.path.join(settings.UPLOAD_DIR, ".sessions")
+
+
+class UploadSessionNotFoundError(Exception):
+    pass
+
+
+class InvalidPartError(ValueError):
+    pass
+
+
+class UploadSessionStore:
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, upload_id: str) -> str:
+        # upload_id is generated by us (hex); reject anything else to keep paths inside root
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadSessionNotFoundError(upload_id)
+        return os.path.join(self.root, upload_id)
+
+    def _part_path(self, upload_id: str, part_number: int) -> str:
+        return os.path.join(self._dir(upload_id), f"{part_number}.part")
+
+    # --- Session lifecycle ---
+
+    def create(self, file_name: str, file_type: str, total_size: int,
+               part_size: Optional[int] = None, overwrite: bool = False) -> dict:
+        if total_size > settings.MAX_UPLOAD_BYTES:
+            raise UploadTooLargeError(settings.MAX_UPLOAD_BYTES)
+        part_size = part_size or settings.UPLOAD_PART_BYTES
+        self.cleanup_expired()
+        if part_size <= 0 or total_size < 0:
+            raise InvalidPartError("part_size must be positive and total_size non-negative.")
+
+        session = {
+            "upload_id": uuid.uuid4().hex,
+            "file_name": safe_file_name(file_name),
+            "file_type": file_type or "application/octet-stream",
+            "total_size": total_size,
+            "part_size": part_size,
+            "total_parts": max(1, math.ceil(total_size / part_size)),
+            "overwrite": overwrite,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        session_dir = self._dir(session["upload_id"])
+        os.makedirs(session_dir)
+        with open(os.path.join(session_dir, "session.json"), "w", encoding="utf-8") as f:
+            json.dump(session, f)
+        return session
+
+    def get(self, upload_id: str) -> dict:
+        try:
+            with open(os.path.join(self._dir(upload_id), "session.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionNotFoundError(upload_id)
+
+    def delete(self, upload_id: str):
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def expected_part_size(self, session: dict, part_number: int) -> int:
+        if part_number < 1 or part_number > session["total_parts"]:
+            raise InvalidPartError(f"Part number must be between 1 and {session['total_parts']}.")
+        if part_number < session["total_parts"]:
+            return session["part_size"]
+        return session["total_size"] - session["part_size"] * (session["total_parts"] - 1)
+
+    def received_parts(self, upload_id: str) -> List[int]:
+        parts = []
+        for name in os.listdir(self._dir(upload_id)):
+            stem, ext = os.path.splitext(name)
+            if ext == ".part" and stem.isdigit():
+                parts.append(int(stem))
+        return sorted(parts)
+
+    def status(self, upload_id: str) -> dict:
+        session = self.get(upload_id)
+        received = self.received_parts(upload_id)
+        received_set = set(received)
+        return {
+            **session,
+            "received_parts": received,
+            "missing_parts": [n for n in range(1, session["total_parts"] + 1) if n not in received_set],
+        }
+
+    # --- Parts ---
+
+    async def write_part(self, upload_id: str, part_number: int, stream) -> dict:
+        """Streams one part (an async iterator of bytes) into the session. Returns its size and SHA-256."""
+        session = self.get(upload_id)
+        expected = self.expected_part_size(session, part_number)
+
+        writer = HashingFileWriter(self._dir(upload_id), max_bytes=expected)
+        try:
+            async for chunk in stream:
+                await writer.write(chunk)
+            if writer.size != expected:
+                raise InvalidPartError(f"Part {part_number} must be {expected} bytes, got {writer.size}.")
+            saved = await writer.commit_to(self._part_path(upload_id, part_number))
+        except UploadTooLargeError:
+            await writer.abort()
+            raise InvalidPartError(f"Part {part_number} must be {expected} bytes.")
+        except BaseException:
+            await writer.abort()
+            raise
+        return {"part_number": part_number, "size": saved.file_size, "sha256": saved.content_hash}
+
+    # --- Completion ---
+
+    def assemble(self, upload_id: str) -> SavedFile:
+        """
+        Concatenates all parts into the date folder (blocking; run in a worker thread).
+        Raises InvalidPartError if parts are missing.
+        """
+        status = self.status(upload_id)
+        if status["missing_parts"]:
+            raise InvalidPartError(f"Missing parts: {status['missing_parts'][:20]}")
+
+        target_dir = upload_target_dir()
+        tmp_path = os.path.join(target_dir, f".{upload_id}.part")
+        content_hash = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as out:
+                for part_number in range(1, status["total_parts"] + 1):
+                    with open(self._part_path(upload_id, part_number), "rb") as part:
+                        while True:
+                            chunk = part.read(settings.UPLOAD_CHUNK_BYTES)
+                            if not chunk:
+                                break
+                            content_hash.update(chunk)
+                            out.write(chunk)
+                            size += len(chunk)
+            digest = content_hash.hexdigest()
+            final_path = place_file(tmp_path, target_dir, status["file_name"], digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return SavedFile(final_path, size, digest)
+
+    def cleanup_expired(self, max_age: Optional[timedelta] = None) -> int:
+        """Removes abandoned sessions older than max_age. Returns how many were removed."""
+        removed = 0
+        cutoff = datetime.utcnow() - (max_age or timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS))
+        for upload_id in os.listdir(self.root):
+            try:
+                created_at = datetime.fromisoformat(self.get(upload_id)["created_at"])
+            except (UploadSessionNotFoundError, ValueError, KeyError):
+                continue
+            if created_at < cutoff:
+                self.delete(upload_id)
+                removed += 1
+        return removed
+
+
+upload_sessions = UploadSessionStore(SESSIONS_DIR)
@@ -0,0 +1,296 @@
+"""
+Vector DB reads and writes that need no Docling (and no torch): embeddings,
+chunk storage, retrieval and lookups. The API process imports only this module;
+app.services.ingestion (conversion + chunking) re-exports these names for the
+ingestion worker and CLI tools.
+"""
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import VectorSessionLocal
+from app.core import metrics
+from app.models.vector_models import ChunkEmbedding, DocumentChunk, chunk_structure
+from app.services import answer_cache, embedding_spaces
+from app.services.embedding_spaces import embed_text
+import logging
+
+logger = logging.getLogger(__name__)
+
+def get_embedding(text: str, model: str = None) -> list[float]:
+    """Embedding for the legacy document_chunks.embedding column (or another model's space)."""
+    return embed_text(text, model)
+
+_query_embedding_cache: "OrderedDict[tuple[str, str], list[float]]" = OrderedDict()
+_query_embedding_lock = threading.Lock()
+
+def get_query_embedding(text: str, model: str = None) -> list[float]:
+    """
+    get_embedding with a small LRU cache for retrieval queries (repeated questions, retries).
+    """
+    if settings.EMBEDDING_CACHE_SIZE <= 0:
+        return get_embedding(text, model)
+
+    key = (model or settings.EMBEDDING_MODEL, text)
+    with _query_embedding_lock:
+        cached = _query_embedding_cache.get(key)
+        if cached is not None:
+            _query_embedding_cache.move_to_end(key)
+    metrics.record_cache("embedding", cached is not None)
+    if cached is not None:
+        return cached
+
+    embedding = get_embedding(text, model)
+    with _query_embedding_lock:
+        _query_embedding_cache[key] = embedding
+        while len(_query_embedding_cache) > settings.EMBEDDING_CACHE_SIZE:
+            _query_embedding_cache.popitem(last=False)
+    return embedding
+
+def store_chunks(doc_id: str, chunks: list[tuple[str, dict]], embeddings: dict = None, replace: bool = False):
+    """
+    Writes the chunks of one document to the Vector DB in a single bulk insert and commit.
+    `embeddings` comes from embedding_spaces.embed_chunks (computed here if omitted), so no
+    Ollama call happens while the transaction is open.
+    With replace=True the document's previous chunks are deleted in the same transaction.
+    """
+    if not VectorSessionLocal:
+        logger.warning("Vector DB not configured. Skipping indexing.")
+        return
+
+    if embeddings is None:
+        embeddings = embedding_spaces.embed_chunks([text_content for text_content, _ in chunks])
+    legacy = embedding_spaces.legacy_embeddings(embeddings) or [None] * len(chunks)
+
+    vector_db = VectorSessionLocal()
+    try:
+        if replace:
+            vector_db.query(DocumentChunk).filter(DocumentChunk.doc_id == doc_id).delete(synchronize_session=False)
+            answer_cache.invalidate_documents(vector_db, [doc_id])
+        rows = []
+        for ordinal, ((text_content, meta), embedding) in enumerate(zip(chunks, legacy)):
+            page_start, page_end, heading_path = chunk_structure(meta)
+            rows.append({
+                "doc_id": doc_id, "text": text_content, "embedding": embedding, "metadata_json": json.dumps(meta),
+                "chunk_index": ordinal, "page_start": page_start, "page_end": page_end,
+                "heading_path": heading_path
+            })
+        if rows:
+            chunk_ids = vector_db.execute(
+                insert(DocumentChunk).returning(DocumentChunk.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            # Active/building (non-legacy) spaces get their rows in the same transaction
+            embedding_spaces.write_embeddings(vector_db, chunk_ids, embeddings)
+        vector_db.commit()
+    except Exception as e:
+        vector_db.rollback()
+        logger.error(f"Indexing failed: {e}")
+        raise e
+    finally:
+        vector_db.close()
+
+def retrieve_relevant_chunks(query: str, doc_ids: list[str], top_k: int = 5, timings: dict = None,
+                             window: int = None) -> list[dict]:
+    """
+    Retrieve relevant chunks from the Vector DB for a given query and set of document IDs.
+    If a `timings` dict is given, "embedding" and "vector_search" durations (seconds) are written to it.
+
+    With window > 0 (default: settings.RETRIEVAL_WINDOW when RETRIEVAL_MODE is "window"),
+    the search still ranks the small chunks, but each hit is returned as its parent window
+    (the hit plus `window` neighbours on each side); see expand_to_windows.
+    """
+    if not VectorSessionLocal or not doc_ids:
+        return []
+    if window is None:
+        window = settings.RETRIEVAL_WINDOW if settings.RETRIEVAL_MODE == "window" else 0
+
+    vector_db = VectorSessionLocal()
+    try:
+        if not query or not query.strip():
+            logger.info("Empty query for retrieval. Skipping.")
+            return []
+
+        space = embedding_spaces.active_space()
+        t0 = time.perf_counter()
+        query_embedding = get_query_embedding(query, space.model)
+        t1 = time.perf_counter()
+        
+        # PGVector search: Use L2 distance (or cosine if normalized)
+        # Using l2_distance operator <->, in the active embedding space
+        if space.is_legacy:
+            distance = DocumentChunk.embedding.l2_distance(query_embedding).label("distance")
+            query_rows = vector_db.query(DocumentChunk, distance)
+        else:
+            distance = ChunkEmbedding.embedding.l2_distance(query_embedding).label("distance")
+            query_rows = vector_db.query(DocumentChunk, distance).join(
+                ChunkEmbedding, ChunkEmbedding.chunk_id == DocumentChunk.id
+            ).filter(ChunkEmbedding.space_id == space.id)
+        results = query_rows.filter(
+            DocumentChunk.doc_id.in_(doc_ids)
+        ).order_by(distance).limit(top_k).all()
+        hits = [_chunk_result(chunk, float(dist)) for chunk, dist in results]
+        if window > 0 and hits:
+            hits = expand_to_windows(vector_db, hits, window)
+        if timings is not None:
+            timings["embedding"] = t1 - t0
+            timings["vector_search"] = time.perf_counter() - t1
+        return hits
+    except Exception as e:
+        logger.error(f"Retrieval failed: {e}")
+        return []
+    finally:
+        vector_db.close()
+
+def _chunk_result(chunk: DocumentChunk, distance: float) -> dict:
+    return {
+        "chunk_id": chunk.id,
+        "text": chunk.text,
+        "doc_id": chunk.doc_id,
+        "val_score": distance, # L2 distance (lower is closer)
+        "meta": json.loads(chunk.metadata_json) if chunk.metadata_json else {},
+        "chunk_index": chunk.chunk_index,
+        "page_start": chunk.page_start,
+        "page_end": chunk.page_end,
+        "heading_path": chunk.heading_path,
+    }
+
+def expand_to_windows(vector_db: Session, hits: list[dict], window: int) -> list[dict]:
+    """
+    Small-to-big: replaces each hit with the chunks [ordinal - window, ordinal + window] of its document.
+    Overlapping or adjacent windows of the same document are merged, so no chunk is returned twice;
+    all windows are loaded in one query. Each merged window keeps the best (lowest) score of the
+    hits inside it and that hit's chunk_id/meta; results are ordered by score.
+    Hits without an ordinal (not yet backfilled) are returned as they are.
+    """
+    ranges: dict[str, list[list]] = {}
+    passthrough = []
+    for hit in hits:
+        if hit["chunk_index"] is None:
+            passthrough.append(hit)
+            continue
+        ranges.setdefault(hit["doc_id"], []).append(
+            [max(0, hit["chunk_index"] - window), hit["chunk_index"] + window, hit])
+
+    # Merge overlapping/adjacent ranges per document; the best hit represents the window
+    merged = [] # (doc_id, start, end, best hit)
+    for doc_id, doc_ranges in ranges.items():
+        doc_ranges.sort(key=lambda r: r[0])
+        current = doc_ranges[0][:]
+        for start, end, hit in doc_ranges[1:]:
+            if start <= current[1] + 1:
+                current[1] = max(current[1], end)
+                if hit["val_score"] < current[2]["val_score"]:
+                    current[2] = hit
+            else:
+                merged.append((doc_id, *current))
+                current = [start, end, hit]
+        merged.append((doc_id, *current))
+
+    if not merged:
+        return passthrough
+
+    rows = vector_db.query(
+        DocumentChunk.id, DocumentChunk.doc_id, DocumentChunk.chunk_index, DocumentChunk.text,
+        DocumentChunk.page_start, DocumentChunk.page_end
+    ).filter(or_(*[
+        and_(DocumentChunk.doc_id == doc_id, DocumentChunk.chunk_index.between(start, end))
+        for doc_id, start, end, _ in merged
+    ])).order_by(DocumentChunk.doc_id, DocumentChunk.chunk_index).all()
+
+    by_doc: dict[str, list] = {}
+    for row in rows:
+        by_doc.setdefault(row.doc_id, []).append(row)
+
+    windows = []
+    for doc_id, start, end, best in merged:
+        members = [row for row in by_doc.get(doc_id, []) if start <= row.chunk_index <= end]
+        if not members:
+            windows.append(best)
+            continue
+        pages = [p for row in members for p in (row.page_start, row.page_end) if p is not None]
+        windows.append({
+            **best,
+            "text": "\n\n".join(row.text for row in members),
+            "chunk_ids": [row.id for row in members],
+            "window_start": members[0].chunk_index,
+            "window_end": members[-1].chunk_index,
+            "page_start": min(pages) if pages else None,
+            "page_end": max(pages) if pages else None,
+        })
+    return sorted(windows + passthrough, key=lambda w: w["val_score"])
+
+def get_chunks_by_ids(chunk_ids: list[int]) -> dict[int, dict]:
+    """
+    Bulk-loads chunks by primary key (one query). Missing ids (e.g. re-indexed documents) are omitted.
+    """
+    if not VectorSessionLocal or not chunk_ids:
+        return {}
+
+    vector_db = VectorSessionLocal()
+    try:
+        rows = vector_db.query(DocumentChunk.id, DocumentChunk.doc_id, DocumentChunk.text).filter(
+            DocumentChunk.id.in_(set(chunk_ids))
+        ).all()
+        return {row.id: {"text": row.text, "doc_id": row.doc_id} for row in rows}
+    except Exception as e:
+        logger.error(f"Chunk lookup failed: {e}")
+        return {}
+    finally:
+        vector_db.close()
+
+def get_chunks_by_position(refs: list[tuple[str, int, int]]) -> dict[tuple[str, int, int], dict]:
+    """
+    Bulk-loads chunk ranges (doc_id, first ordinal, last ordinal) in one query; a range's
+    text is its chunks joined like a retrieval window. Unlike ids, positions survive
+    re-indexing an unchanged document. Ranges with no chunks left are omitted.
+    """
+    refs = set(refs)
+    if not VectorSessionLocal or not refs:
+        return {}
+
+    vector_db = VectorSessionLocal()
+    try:
+        rows = vector_db.query(DocumentChunk.doc_id, DocumentChunk.chunk_index, DocumentChunk.text).filter(or_(*[
+            and_(DocumentChunk.doc_id == doc_id, DocumentChunk.chunk_index.between(start, end))
+            for doc_id, start, end in refs
+        ])).order_by(DocumentChunk.doc_id, DocumentChunk.chunk_index).all()
+        result = {}
+        for doc_id, start, end in refs:
+            texts = [row.text for row in rows if row.doc_id == doc_id and start <= row.chunk_index <= end]
+            if texts:
+                result[(doc_id, start, end)] = {"text": "\n\n".join(texts), "doc_id": doc_id}
+        return result
+    except Exception as e:
+        logger.error(f"Chunk lookup failed: {e}")
+        return {}
+    finally:
+        vector_db.close()
+
+def delete_document_chunks(doc_id: str):
+    """
+    Deletes all chunks associated with a specific doc_id from the Vector DB.
+    """
+    if not VectorSessionLocal:
+        logger.warning("Vector DB not configured. Skipping deletion.")
+        return
+
+    vector_db = VectorSessionLocal()
+    try:
+        # Delete chunks with matching doc_id
+        # Note: Depending on your vector DB/ORM, this might need adjustment.
+        # For PGVector with SQLAlchemy:
+        deleted_count = vector_db.query(DocumentChunk).filter(DocumentChunk.doc_id == doc_id).delete()
+        answer_cache.invalidate_documents(vector_db, [doc_id])
+        vector_db.commit()
+        logger.info(f"Deleted {deleted_count} chunks for doc_id: {doc_id}")
+    except Exception as e:
+        vector_db.rollback()
+        logger.error(f"Deletion failed for doc_id {doc_id}: {e}")
+        raise e
+    finally:
+        vector_db.close()
@@ -0,0 +1,280 @@
+"""
+Web search for chat turns.
+
+Results from the Ollama web search API are parsed into a compact
+title/url/snippet form and cached per normalized query for
+WEB_SEARCH_CACHE_SECONDS. Optionally (WEB_SEARCH_FETCH_PAGES) the top results'
+pages are fetched concurrently and reduced to plain text, capped at
+WEB_SEARCH_PAGE_TOKENS each, so the prompt gets page content instead of the
+raw API payload. Page fetches only go to public addresses: every host,
+including each redirect hop, is resolved and refused if any of its addresses is
+private, loopback, link-local or otherwise reserved.
+"""
+import asyncio
+import ipaddress
+import re
+import socket
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+from app.core.config import settings
+from app.core import metrics
+from app import utils_json
+from app.utils_tokens import truncate_to_tokens
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_URL = "https://ollama.com/api/web_search"
+MAX_REDIRECTS = 5
+
+PAGE_FETCHES = metrics.counter("web_search_page_fetches_total", "Result pages fetched by outcome.", ("result",))
+
+
+class WebSearchError(Exception):
+    pass
+
+
+class BlockedURLError(Exception):
+    """A page URL that must not be fetched (non-HTTP scheme or non-public address)."""
+
+
+@dataclass
+class WebResult:
+    title: str
+    url: str
+    snippet: str
+    content: Optional[str] = None # Extracted page text (fetch-and-extract only)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+# --- Result cache ---
+
+class _TTLCache:
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, List[WebResult]]]" = OrderedDict()
+
+    def get(self, key) -> Optional[List[WebResult]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value: List[WebResult]):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_cache = _TTLCache(settings.WEB_SEARCH_CACHE_SECONDS, settings.WEB_SEARCH_CACHE_SIZE)
+_in_flight: dict = {} # key -> Future, so concurrent identical searches share one request
+
+
+# --- Search API ---
+
+def parse_results(data: dict, max_results: int) -> List[WebResult]:
+    results = []
+    for item in (data.get("results") or [])[:max_results]:
+        url = item.get("url") or ""
+        if not url:
+            continue
+        snippet = " ".join((item.get("content") or item.get("snippet") or "").split())
+        if len(snippet) > settings.WEB_SEARCH_SNIPPET_CHARS:
+            snippet = snippet[:settings.WEB_SEARCH_SNIPPET_CHARS].rstrip() + " …"
+        results.append(WebResult(title=(item.get("title") or url).strip(), url=url, snippet=snippet))
+    return results
+
+
+async def _query_api(client: httpx.AsyncClient, query: str) -> List[WebResult]:
+    if not settings.OLLAMA_WEB_SEARCH_KEY:
+        raise WebSearchError("OLLAMA_WEB_SEARCH_KEY not configured.")
+    headers = {
+        "Authorization": f"Bearer {settings.OLLAMA_WEB_SEARCH_KEY}",
+        "Content-Type": "application/json"
+    }
+    payload = {"query": query, "max_results": settings.WEB_SEARCH_MAX_RESULTS}
+    try:
+        response = await client.post(SEARCH_URL, json=payload, headers=headers, timeout=30.0)
+    except httpx.HTTPError as e:
+        raise WebSearchError(f"Web search error: {e}")
+    if response.status_code != 200:
+        raise WebSearchError(f"Web search failed: {response.status_code} {response.text[:200]}")
+    try:
+        data = utils_json.loads(response.content)
+    except utils_json.JSONDecodeError as e:
+        raise WebSearchError(f"Web search returned invalid JSON: {e}")
+    return parse_results(data, settings.WEB_SEARCH_MAX_RESULTS)
+
+
+# --- Fetch and extract ---
+
+class _TextExtractor(HTMLParser):
+    SKIP = {"script", "style", "noscript", "svg", "nav", "header", "footer", "aside", "form", "template"}
+    BLOCK = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "pre"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip_depth += 1
+        elif tag in self.BLOCK:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def extract_text(html: str) -> str:
+    """Visible text of an HTML page, whitespace-collapsed, one block per line."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass # Keep whatever was parsed from malformed markup
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+async def check_public_url(url: str):
+    """Raises BlockedURLError unless url is http(s) and its host resolves only to public addresses."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise BlockedURLError(url)
+    try:
+        infos = await asyncio.to_thread(socket.getaddrinfo, parts.hostname, parts.port or 0,
+                                        type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise BlockedURLError(url)
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise BlockedURLError(url)
+
+
+async def _fetch_page(client: httpx.AsyncClient, url: str) -> Optional[str]:
+    try:
+        # Redirects are followed here, one checked hop at a time, never by the client
+        for _ in range(MAX_REDIRECTS + 1):
+            await check_public_url(url)
+            async with client.stream("GET", url, timeout=settings.WEB_SEARCH_FETCH_TIMEOUT_SECONDS,
+                                     follow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers["location"])
+                    continue
+                content_type = response.headers.get("content-type", "")
+                if response.status_code != 200 or not re.match(r"text/(html|plain)", content_type):
+                    PAGE_FETCHES.labels("skipped").inc()
+                    return None
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body.extend(chunk)
+                    if len(body) >= settings.WEB_SEARCH_FETCH_MAX_BYTES:
+                        break
+                break
+        else:
+            PAGE_FETCHES.labels("skipped").inc() # Too many redirects
+            return None
+        text = bytes(body).decode(response.encoding or "utf-8", errors="ignore")
+        if content_type.startswith("text/html"):
+            text = await asyncio.to_thread(extract_text, text)
+        PAGE_FETCHES.labels("ok").inc()
+        return truncate_to_tokens(text, settings.WEB_SEARCH_PAGE_TOKENS)
+    except BlockedURLError:
+        logger.warning(f"Refusing to fetch non-public URL {url}")
+        PAGE_FETCHES.labels("blocked").inc()
+    except httpx.TimeoutException:
+        PAGE_FETCHES.labels("timeout").inc()
+    except Exception as e:
+        logger.debug(f"Fetching {url} failed: {e}")
+        PAGE_FETCHES.labels("error").inc()
+    return None
+
+
+async def _fetch_contents(client: httpx.AsyncClient, results: List[WebResult]):
+    """Fills `content` of the top results concurrently; results that fail or time out keep their snippet."""
+    top = results[:settings.WEB_SEARCH_FETCH_TOP]
+    tasks = [asyncio.create_task(_fetch_page(client, result.url)) for result in top]
+    if not tasks:
+        return
+    # Overall deadline on top of the per-request timeouts (slow bodies, redirects)
+    done, pending = await asyncio.wait(tasks, timeout=settings.WEB_SEARCH_FETCH_TIMEOUT_SECONDS * 2)
+    for task in pending:
+        task.cancel()
+        PAGE_FETCHES.labels("timeout").inc()
+    for result, task in zip(top, tasks):
+        if task in done and not task.cancelled() and task.exception() is None:
+            result.content = task.result()
+
+
+async def _search_uncached(query: str, fetch_pages: bool) -> List[WebResult]:
+    async with httpx.AsyncClient(follow_redirects=False,
+                                 headers={"User-Agent": settings.WEB_SEARCH_USER_AGENT}) as client:
+        results = await _query_api(client, query)
+        if fetch_pages and results:
+            await _fetch_contents(client, results)
+    return results
+
+
+async def search(query: str, fetch_pages: Optional[bool] = None) -> List[WebResult]:
+    """
+    Cached web search. Raises WebSearchError on failure (failures are not cached).
+    """
+    fetch_pages = settings.WEB_SEARCH_FETCH_PAGES if fetch_pages is None else fetch_pages
+    key = (normalize_query(query), fetch_pages)
+    cached = _cache.get(key)
+    metrics.record_cache("web_search", cached is not None)
+    if cached is not None:
+        return cached
+
+    future = _in_flight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_search_uncached(query, fetch_pages))
+        _in_flight[key] = future
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+    results = await asyncio.shield(future)
+    _cache.put(key, results)
+    return results
+
+
+def format_results(results: List[WebResult]) -> str:
+    """Compact prompt form: numbered title, url, then page extract (or snippet)."""
+    blocks = []
+    for i, result in enumerate(results, 1):
+        body = result.content or result.snippet
+        blocks.append(f"[{i}] {result.title}\n{result.url}\n{body}".rstrip())
+    return "\n\n".join(blocks)
+
+
+def clear_cache():
+    _cache.clear()
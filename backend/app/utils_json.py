@@ -0,0 +1,26 @@
+"""
+Utility module for fast JSON encoding/decoding.
+Uses orjson when installed and falls back to the stdlib json module.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError if orjson is None else (json.JSONDecodeError, orjson.JSONDecodeError)
+
+
+def dumps(obj) -> str:
+    """Serializes obj to a compact JSON string."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(data):
+    """Parses JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
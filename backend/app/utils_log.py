@@ -1,16 +1,22 @@
 """
 Utility module for logging debug information to a file.
 """
-import os
-from datetime import datetime
+import logging
 
 LOG_FILE = "debug_log.txt"
 
+# A dedicated logger keeps the file handle open instead of reopening it on every call
+_debug_logger = logging.getLogger("debug_log")
+_debug_logger.setLevel(logging.DEBUG)
+_debug_logger.propagate = False
+if not _debug_logger.handlers:
+    _handler = logging.FileHandler(LOG_FILE, encoding="utf-8", delay=True)
+    _handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+    _debug_logger.addHandler(_handler)
+
 def log_debug(message: str):
     """Logs a message to debug_log.txt in the project root."""
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"[{timestamp}] {message}\n")
+        _debug_logger.debug(message)
     except Exception as e:
         print(f"Failed to log debug message: {e}")
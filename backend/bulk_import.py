@@ -0,0 +1,256 @@
+"""
+Bulk import of a document corpus (directory tree or manifest) into the RAG store.
+
+    python bulk_import.py D:\\corpus
+    python bulk_import.py manifest.txt --convert-workers 6 --embed-workers 16
+
+Pipeline:
+  1. Hash every file (SHA-256) and skip files already indexed (Attachments.content_hash)
+     or recorded as done in the checkpoint file.
+  2. Convert + chunk in a process pool (Docling is CPU/GPU bound); converted
+     documents are cached, so re-running after a failure skips conversion.
+  3. Embed chunks in a thread pool (Ollama calls are I/O bound), bulk-insert the
+     vectors and create the Attachment row.
+  4. Append the result to a JSONL checkpoint, so an interrupted run resumes where it stopped.
+
+Imported files are copied into UPLOAD_DIR (like uploads), so purging an
+attachment never touches the source corpus.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from app.core.config import settings
+from app.services.docling_cache import file_sha256
+
+DEFAULT_CHECKPOINT = os.path.join("storage", "import_checkpoint.jsonl")
+
+
+def iter_input_files(source: str, extensions=None):
+    """Yields file paths from a directory tree or a manifest (one path per line, # comments)."""
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if extensions and os.path.splitext(name)[1].lower() not in extensions:
+                    continue
+                yield os.path.abspath(os.path.join(root, name))
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield os.path.abspath(os.path.join(base_dir, line))
+
+
+def load_checkpoint(path: str) -> dict:
+    """Latest checkpoint entry per source path."""
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # Torn last line of an interrupted run
+                done[entry["path"]] = entry
+    return done
+
+
+def indexed_hashes(hashes) -> set:
+    """Content hashes that already have a fully indexed attachment."""
+    from app.core.database import SessionLocal
+    from app.models import sql_models as models
+    hashes = list(hashes)
+    found = set()
+    db = SessionLocal()
+    try:
+        for i in range(0, len(hashes), 1000):
+            rows = db.query(models.Attachment.content_hash).filter(
+                models.Attachment.content_hash.in_(hashes[i:i + 1000])
+            ).all()
+            found.update(row.content_hash for row in rows)
+    finally:
+        db.close()
+    return found
+
+
+def copy_into_uploads(path: str, content_hash: str) -> str:
+    from app.services.file_service import place_file, upload_target_dir
+    target_dir = upload_target_dir()
+    tmp_path = os.path.join(target_dir, f".{uuid.uuid4().hex}.part")
+    shutil.copyfile(path, tmp_path)
+    return place_file(tmp_path, target_dir, os.path.basename(path), content_hash)
+
+
+def index_converted(path: str, content_hash: str, converted, embed_pool: ThreadPoolExecutor) -> dict:
+    """Embeds + stores the chunks of one converted file and records its Attachment."""
+    from app.core.database import SessionLocal
+    from app.models import sql_models as models
+    from app.services import embedding_spaces, ingestion
+    from app.services.blob_store import blob_store
+
+    markdown, pages, chunks = converted
+    file_path = copy_into_uploads(path, content_hash)
+
+    db = SessionLocal()
+    try:
+        attachment = models.Attachment(
+            file_name=os.path.basename(path),
+            file_type="application/octet-stream",
+            file_size=os.path.getsize(file_path),
+            file_path=file_path,
+            extracted_text=""
+        )
+        db.add(attachment)
+        db.commit()
+        doc_id = str(attachment.id)
+
+        try:
+            embeddings = embedding_spaces.embed_chunks([text for text, _ in chunks], embed_pool.map)
+            ingestion.store_chunks(doc_id, chunks, embeddings)
+        except Exception:
+            ingestion.delete_document_chunks(doc_id)
+            db.delete(attachment)
+            db.commit()
+            os.remove(file_path)
+            raise
+
+        if settings.BLOB_STORE_ENABLED and markdown:
+            attachment.text_digest = blob_store.put(markdown)
+            attachment.extracted_text = None
+        else:
+            attachment.extracted_text = markdown
+        attachment.content_hash = content_hash # Marks the content as fully indexed
+        db.commit()
+        return {"attachment_id": attachment.id, "pages": pages, "chunks": len(chunks)}
+    finally:
+        db.close()
+
+
+def run_import(args) -> int:
+    from app.services import ingestion
+
+    started = time.perf_counter()
+    extensions = {e.lower() if e.startswith(".") else f".{e.lower()}" for e in args.ext} if args.ext else None
+    checkpoint = load_checkpoint(args.checkpoint)
+    os.makedirs(os.path.dirname(os.path.abspath(args.checkpoint)), exist_ok=True)
+
+    stats = {"scanned": 0, "skipped": 0, "imported": 0, "failed": 0, "pages": 0, "chunks": 0, "bytes": 0}
+
+    # 1. Discover + hash (skip what the checkpoint already covers)
+    pending = []
+    for path in iter_input_files(args.source, extensions):
+        stats["scanned"] += 1
+        entry = checkpoint.get(path)
+        if entry and entry["status"] in ("ok", "skipped"):
+            stats["skipped"] += 1
+            continue
+        try:
+            pending.append((path, file_sha256(path)))
+        except OSError as e:
+            print(f"  ! Cannot read {path}: {e}")
+            stats["failed"] += 1
+
+    known = indexed_hashes({h for _, h in pending})
+    seen = set()
+    to_import = []
+    with open(args.checkpoint, "a", encoding="utf-8") as log:
+        for path, content_hash in pending:
+            if content_hash in known or content_hash in seen:
+                stats["skipped"] += 1
+                log.write(json.dumps({"path": path, "sha256": content_hash, "status": "skipped"}) + "\n")
+                continue
+            seen.add(content_hash)
+            to_import.append((path, content_hash))
+    print(f"Scanned {stats['scanned']} files: {len(to_import)} to import, {stats['skipped']} already done.")
+
+    # 2-4. Convert in processes, embed/store in threads, checkpoint each result
+    with open(args.checkpoint, "a", encoding="utf-8") as log, \
+            ProcessPoolExecutor(max_workers=args.convert_workers) as convert_pool, \
+            ThreadPoolExecutor(max_workers=args.embed_workers) as embed_pool, \
+            ThreadPoolExecutor(max_workers=args.index_workers) as index_pool:
+
+        def record(entry: dict):
+            log.write(json.dumps(entry) + "\n")
+            log.flush()
+
+        queue = list(reversed(to_import))
+        converting, indexing = {}, {}
+        max_in_flight = args.convert_workers * 2 # Bounds memory held by converted documents
+
+        while queue or converting or indexing:
+            while queue and len(converting) < max_in_flight:
+                path, content_hash = queue.pop()
+                converting[convert_pool.submit(ingestion.convert_and_chunk, path, content_hash)] = (path, content_hash)
+
+            done, _ = wait(list(converting) + list(indexing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in converting:
+                    path, content_hash = converting.pop(future)
+                    try:
+                        converted = future.result()
+                    except Exception as e:
+                        stats["failed"] += 1
+                        record({"path": path, "sha256": content_hash, "status": "failed", "error": f"convert: {e}"})
+                        print(f"  ! {path}: conversion failed: {e}")
+                        continue
+                    indexing[index_pool.submit(index_converted, path, content_hash, converted, embed_pool)] = \
+                        (path, content_hash)
+                else:
+                    path, content_hash = indexing.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        stats["failed"] += 1
+                        record({"path": path, "sha256": content_hash, "status": "failed", "error": f"index: {e}"})
+                        print(f"  ! {path}: indexing failed: {e}")
+                        continue
+                    stats["imported"] += 1
+                    stats["pages"] += result["pages"]
+                    stats["chunks"] += result["chunks"]
+                    stats["bytes"] += os.path.getsize(path)
+                    record({"path": path, "sha256": content_hash, "status": "ok", **result})
+                    if stats["imported"] % args.progress_every == 0:
+                        elapsed = time.perf_counter() - started
+                        print(f"  {stats['imported']}/{len(to_import)} imported "
+                              f"({stats['imported'] / elapsed:.2f} files/s)")
+
+    # Summary
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    print("\nImport summary")
+    print(f"  Files scanned:   {stats['scanned']}")
+    print(f"  Imported:        {stats['imported']}")
+    print(f"  Skipped:         {stats['skipped']}")
+    print(f"  Failed:          {stats['failed']}")
+    print(f"  Pages / chunks:  {stats['pages']} / {stats['chunks']}")
+    print(f"  Elapsed:         {elapsed:.1f}s")
+    print(f"  Throughput:      {stats['imported'] / elapsed:.2f} files/s, {stats['pages'] / elapsed:.2f} pages/s, "
+          f"{stats['chunks'] / elapsed:.2f} chunks/s, {stats['bytes'] / elapsed / 1024 ** 2:.2f} MB/s")
+    return 1 if stats["failed"] else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk import documents into the RAG store.")
+    parser.add_argument("source", help="Directory to import recursively, or a manifest file with one path per line.")
+    parser.add_argument("--ext", nargs="*", help="Only import these extensions (directory mode), e.g. pdf docx.")
+    parser.add_argument("--convert-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Docling conversion processes.")
+    parser.add_argument("--embed-workers", type=int, default=8, help="Concurrent embedding requests.")
+    parser.add_argument("--index-workers", type=int, default=4, help="Documents embedded/stored concurrently.")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="JSONL progress file used to resume.")
+    parser.add_argument("--progress-every", type=int, default=25, help="Print progress every N files.")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+    return run_import(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
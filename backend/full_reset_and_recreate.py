@@ -73,9 +73,21 @@ def reset_storage():
         os.makedirs(upload_dir, exist_ok=True)
         print("  Upload directory created.")
 
+def reset_blob_store():
+    print("\nCleaning Blob Store...")
+    blob_dir = settings.BLOB_STORE_DIR
+    if os.path.exists(blob_dir):
+        try:
+            shutil.rmtree(blob_dir)
+            print(f"  Deleted blob store at {blob_dir}.")
+        except Exception as e:
+            print(f"Error cleaning blob store: {e}")
+    os.makedirs(blob_dir, exist_ok=True)
+
 if __name__ == "__main__":
     print("Starting Phase ZERO Full Reset & Recreate...")
     reset_mssql()
     reset_postgres()
     reset_storage()
+    reset_blob_store()
     print("\nFull Reset & Recreate Complete.")
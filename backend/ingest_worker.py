@@ -0,0 +1,156 @@
+"""
+Ingestion worker: runs the jobs the API queues when INGESTION_MODE = "worker".
+
+    python ingest_worker.py                 # one worker process
+    python ingest_worker.py --processes 3   # three processes sharing the queue
+    python ingest_worker.py --metrics-port 9101   # /metrics on 9101 (9102, ... for more processes)
+
+Only these processes load Docling, torch and the OCR/layout models; the API
+workers stay lightweight and can be scaled with `uvicorn --workers N` (set
+API_WORKERS = N too, so the LLM limits are split between them).
+Each job converts + indexes one attachment and stores its extracted text and
+content hash. The job is completed right after indexing: the ingest-time
+summary (SUMMARIZE_ON_INGEST) is built by the API process that queued the job,
+so its LLM calls go through that process's scheduler at BACKGROUND priority
+and yield to chats, and the waiting upload request does not wait for it.
+
+Ingestion metrics (stage durations, pages, chunks, embeddings, Docling cache
+hits, job events) are recorded in the worker process, so the API's /metrics does
+not have them. With --metrics-port (or INGEST_WORKER_METRICS_PORT) each worker
+process serves its own /metrics; scrape them as separate targets.
+"""
+import argparse
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+
+from app.core.config import settings
+from app.services.ingest_queue import ingest_queue
+
+HEARTBEAT_SECONDS = 30
+MAINTENANCE_SECONDS = 60
+
+
+def run_job(job: dict):
+    from app.core.database import SessionLocal
+    from app.models import sql_models as models
+    from app.services import file_service
+
+    db = SessionLocal()
+    try:
+        attachment = db.query(models.Attachment).filter(models.Attachment.id == job["attachment_id"]).first()
+        if attachment is None:
+            return {"skipped": "attachment deleted"}
+        if attachment.file_path != job["file_path"]:
+            return {"skipped": "attachment was overwritten"} # A newer job indexes the new file
+        file_service.index_attachment(db, attachment, job["file_path"], job.get("content_hash"))
+    finally:
+        db.close()
+    return {"attachment_id": job["attachment_id"]}
+
+
+def serve_metrics(port: int, host: str = None):
+    """Serves this process's metrics registry at http://host:port/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from app.core import metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass # Scrapes every few seconds would drown the job log
+
+    server = ThreadingHTTPServer((host or settings.INGEST_WORKER_METRICS_HOST, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def _heartbeat(job_id: str, done: threading.Event):
+    while not done.wait(HEARTBEAT_SECONDS):
+        ingest_queue.heartbeat(job_id)
+
+
+def worker_loop(poll_seconds: float, stop: threading.Event):
+    from app.services import ingestion  # noqa: F401 (load Docling/torch once, before the first job)
+
+    name = multiprocessing.current_process().name
+    print(f"[{name}] Waiting for ingestion jobs in {ingest_queue.root}", flush=True)
+    last_maintenance = 0.0
+    while not stop.is_set():
+        if time.monotonic() - last_maintenance > MAINTENANCE_SECONDS:
+            ingest_queue.requeue_stale()
+            ingest_queue.cleanup(settings.INGEST_JOB_RETENTION_HOURS * 3600)
+            last_maintenance = time.monotonic()
+
+        claimed = ingest_queue.claim()
+        if claimed is None:
+            stop.wait(poll_seconds)
+            continue
+
+        job_id, job = claimed
+        started = time.perf_counter()
+        done = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job_id, done), daemon=True).start()
+        try:
+            result = run_job(job)
+            ingest_queue.complete(job_id, result)
+            print(f"[{name}] Job {job_id} done in {time.perf_counter() - started:.1f}s: {result}", flush=True)
+        except Exception as e:
+            ingest_queue.fail(job_id, str(e))
+            print(f"[{name}] Job {job_id} failed: {e}", flush=True)
+        finally:
+            done.set()
+
+
+def _run_process(poll_seconds: float, metrics_port: int = 0):
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    if metrics_port:
+        serve_metrics(metrics_port)
+        print(f"[{multiprocessing.current_process().name}] Metrics on port {metrics_port}", flush=True)
+    worker_loop(poll_seconds, stop)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Process queued ingestion jobs.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes (each loads the models).")
+    parser.add_argument("--poll", type=float, default=1.0, help="Seconds between queue polls when idle.")
+    parser.add_argument("--metrics-port", type=int, default=settings.INGEST_WORKER_METRICS_PORT,
+                        help="First /metrics port (one per process, consecutive); 0 = no endpoint.")
+    args = parser.parse_args(argv)
+
+    if args.processes <= 1:
+        _run_process(args.poll, args.metrics_port)
+        return 0
+
+    processes = [multiprocessing.Process(target=_run_process,
+                                         args=(args.poll, args.metrics_port + i if args.metrics_port else 0),
+                                         name=f"ingest-{i + 1}")
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
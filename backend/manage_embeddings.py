@@ -0,0 +1,80 @@
+"""
+Embedding space management (see app/services/embedding_spaces.py).
+
+    python manage_embeddings.py list
+    python manage_embeddings.py create mxbai-v1 mxbai-embed-large 1024
+    python manage_embeddings.py backfill mxbai-v1 --rate 10
+    python manage_embeddings.py activate mxbai-v1
+    python manage_embeddings.py activate legacy          # roll back
+    python manage_embeddings.py drop mxbai-v1
+
+backfill can be stopped and restarted at any time; it resumes with the chunks
+that are still missing. Use --activate to switch as soon as it completes.
+"""
+import argparse
+import sys
+
+from app.services import embedding_spaces
+from app.services.embedding_spaces import EmbeddingSpaceError
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Manage versioned embedding spaces.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="Show spaces and how many chunks each is missing.")
+
+    create = commands.add_parser("create", help="Create a space in 'building' state.")
+    create.add_argument("name")
+    create.add_argument("model")
+    create.add_argument("dimensions", type=int)
+
+    backfill = commands.add_parser("backfill", help="Re-embed existing chunks into a building space (throttled).")
+    backfill.add_argument("name")
+    backfill.add_argument("--rate", type=float, default=None, help="Max embeddings per second.")
+    backfill.add_argument("--batch-size", type=int, default=None)
+    backfill.add_argument("--activate", action="store_true", help="Activate the space when complete.")
+
+    activate = commands.add_parser("activate", help="Atomically switch queries to a space.")
+    activate.add_argument("name")
+    activate.add_argument("--force", action="store_true", help="Activate even if chunks are missing.")
+
+    drop = commands.add_parser("drop", help="Delete a non-active space and its embeddings.")
+    drop.add_argument("name")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "list":
+            active = embedding_spaces.active_space().name
+            print(f"{'legacy':<20} {embedding_spaces.LEGACY_SPACE.model:<30} "
+                  f"{'active' if active == 'legacy' else 'standby'}")
+            for space in embedding_spaces.list_spaces():
+                print(f"{space['name']:<20} {space['model']:<30} {space['status']:<10} "
+                      f"{space['dimensions']} dims, {space['missing']} chunks missing")
+        elif args.command == "create":
+            embedding_spaces.create_space(args.name, args.model, args.dimensions)
+            print(f"Created '{args.name}'. New chunks are written to it; run backfill for existing ones.")
+        elif args.command == "backfill":
+            try:
+                done = embedding_spaces.backfill(args.name, args.batch_size, args.rate)
+            except KeyboardInterrupt:
+                print("Interrupted; run backfill again to resume.")
+                return 1
+            print(f"Embedded {done} chunks into '{args.name}'.")
+            if args.activate:
+                embedding_spaces.activate(args.name)
+                print(f"'{args.name}' is now active.")
+        elif args.command == "activate":
+            embedding_spaces.activate(args.name, force=args.force)
+            print(f"'{args.name}' is now active.")
+        elif args.command == "drop":
+            embedding_spaces.drop_space(args.name)
+            print(f"Dropped '{args.name}'.")
+    except EmbeddingSpaceError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
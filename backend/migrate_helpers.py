@@ -2,26 +2,55 @@ from sqlalchemy import create_engine, text
 from app.core.config import settings
 
 def run_migration():
+    """
+    Applies the versioned schema migrations (columns added over time and the
+    hot-path indexes) to MSSQL and the vector DB. See app/core/migrations.py.
+    """
+    from app.core.migrations import migrate, MSSQL_MIGRATIONS, VECTOR_MIGRATIONS
     print("Running Helper Migration...")
     engine = create_engine(settings.DATABASE_URL)
-    with engine.connect() as conn:
-        # 1. Add augmented_content to Messages
-        try:
-            print("Attempting to add augmented_content to Messages...")
-            conn.execute(text("ALTER TABLE Messages ADD augmented_content NVARCHAR(MAX) NULL;"))
-            conn.commit()
-            print("Success: augmented_content added.")
-        except Exception as e:
-            print(f"Info: augmented_content might already exist or error: {e}")
+    applied = migrate(engine, MSSQL_MIGRATIONS)
+    print(f"MSSQL: applied {applied or 'nothing (up to date)'}")
 
-        # 2. Create MessageContext Table (if not exists via SQLAlchemy logic usually, but here we enforce if needed or let main.py do it)
-        # Main.py uses create_all, which works for new tables. MessageContext is new.
-        # So we just need to ensure Messages table is updated.
-        
-        # However, we also need to make sure MessageContext table is created if create_all doesn't run again or if we want to force it.
-        # Base.metadata.create_all(bind=engine) will be called in main.py.
-        # But if the app is already running (reloading), it might have missed it?
-        # Let's let main.py handle new table creation. This script is just for ALTER.
+    if settings.VECTOR_DB_URL:
+        vector_engine = create_engine(settings.VECTOR_DB_URL)
+        applied = migrate(vector_engine, VECTOR_MIGRATIONS)
+        print(f"Vector DB: applied {applied or 'nothing (up to date)'}")
+
+def move_text_to_blob_store(batch_size: int = 200):
+    """
+    Moves existing inline Attachments.extracted_text / MessageContext.content into the
+    blob store, leaving only digests in MSSQL. Safe to re-run.
+    """
+    from app.services.blob_store import blob_store
+    print("Moving inline text to the blob store...")
+    engine = create_engine(settings.DATABASE_URL)
+    jobs = (
+        ("Attachments", "extracted_text", "text_digest"),
+        ("MessageContext", "content", "content_digest"),
+    )
+    for table, text_column, digest_column in jobs:
+        moved = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(text(
+                    f"SELECT TOP {int(batch_size)} id, {text_column} FROM {table} "
+                    f"WHERE {text_column} IS NOT NULL AND {digest_column} IS NULL"
+                )).fetchall()
+                if not rows:
+                    break
+                for row_id, value in rows:
+                    digest = blob_store.put(value)
+                    conn.execute(
+                        text(f"UPDATE {table} SET {digest_column} = :digest, {text_column} = NULL WHERE id = :id"),
+                        {"digest": digest, "id": row_id}
+                    )
+                moved += len(rows)
+        print(f"  {table}: moved {moved} rows.")
 
 if __name__ == "__main__":
     run_migration()
+    if settings.BLOB_STORE_ENABLED:
+        move_text_to_blob_store()
+    else:
+        print("BLOB_STORE_ENABLED is off: inline text left in place.")
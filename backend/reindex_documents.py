@@ -0,0 +1,64 @@
+"""
+Re-chunks and re-embeds existing attachments, e.g. after changing the chunker
+settings or the embedding model.
+
+    python reindex_documents.py              # every attachment
+    python reindex_documents.py 12 15 40     # selected attachment ids
+
+Converted documents are loaded from the Docling document cache, so no OCR or
+layout analysis runs unless the cache has no entry for a file (then it is
+converted once and cached). Each document's chunks are replaced atomically.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.core.database import SessionLocal
+from app.models import sql_models as models
+
+
+def load_attachments(ids=None):
+    db = SessionLocal()
+    try:
+        query = db.query(models.Attachment.id, models.Attachment.file_path, models.Attachment.content_hash)
+        if ids:
+            query = query.filter(models.Attachment.id.in_(ids))
+        return query.order_by(models.Attachment.id).all()
+    finally:
+        db.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Re-chunk and re-embed attachments from the Docling cache.")
+    parser.add_argument("ids", nargs="*", type=int, help="Attachment ids (default: all).")
+    parser.add_argument("--workers", type=int, default=4, help="Documents processed concurrently.")
+    args = parser.parse_args(argv)
+
+    from app.services import ingestion
+
+    attachments = [a for a in load_attachments(args.ids) if a.file_path and os.path.exists(a.file_path)]
+    print(f"Re-indexing {len(attachments)} attachments...")
+    started = time.perf_counter()
+    chunks = failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(ingestion.reindex_document, a.file_path, str(a.id), a.content_hash): a.id
+            for a in attachments
+        }
+        for future in as_completed(futures):
+            try:
+                chunks += future.result()
+            except Exception as e:
+                failed += 1
+                print(f"  ! Attachment {futures[future]}: {e}")
+
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    print(f"Done: {len(attachments) - failed} documents, {chunks} chunks, {failed} failed "
+          f"in {elapsed:.1f}s ({(len(attachments) - failed) / elapsed:.2f} docs/s).")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+@echo off
+echo Starting Ingestion Worker (INGESTION_MODE=worker)...
+::call venv\Scripts\activate
+cd backend
+python ingest_worker.py
+pause